@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import numpy as np
+import pandas as pd
+
+
+# startup benchmark of the solar-tk command line entry points: for each entry point it records
+# the module import time and the latency of the first output line and of the whole run, on a small
+# offline workload (the bundled example data, a synthetic weather archive and explicit timezone and
+# elevation), and compares them with a saved baseline to catch regressions
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+solartk = os.path.join(root, 'solartk')
+
+# optional dependencies that no entry point should import on these code paths
+heavy_modules = ['sklearn', 'matplotlib', 'googlemaps', 'pysolar', 'tzwhere', 'requests']
+
+
+def write_archive(path):
+
+    # hourly observations of a station next to the example site, covering the workloads
+    times = pd.date_range('2014-12-30', '2015-06-01', freq='h', tz='UTC')
+    hours = np.arange(len(times))
+    pd.DataFrame({'station': 'BENCH', 'latitude': 42.05, 'longitude': -72.05, 'time': times.astype(np.int64) // 10**9,
+                  'temperature': 50 + 20*np.sin(2*np.pi*hours/24), 'clds': np.array(['CLR', 'FEW', 'SCT', 'BKN', 'OVC'])[hours % 5]
+                  }).to_csv(path, index=False)
+
+
+def import_time(module, environment):
+
+    # seconds to import the module in a fresh interpreter, and the heavy modules it loaded
+    code = ('import sys, time, json; start = time.perf_counter(); import {}; '
+            'print(json.dumps([time.perf_counter() - start, [m for m in {} if m in sys.modules]]))').format(module, heavy_modules)
+    output = subprocess.run([sys.executable, '-c', code], cwd=solartk, env=environment, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def run_latency(command, stdin, environment):
+
+    # seconds until the first output line, and until the process exits
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + command, cwd=solartk, env=environment, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if (stdin != None):
+        process.stdin.write(stdin)
+    process.stdin.close()
+
+    first_line = process.stdout.readline()
+    first = time.perf_counter() - start
+    output = first_line + process.stdout.read()
+    if (process.wait() != 0):
+        raise RuntimeError('{} failed with exit code {}.'.format(' '.join(command), process.returncode))
+
+    return first, time.perf_counter() - start, output
+
+
+def benchmark(repeats=5):
+
+    # the archive and the cache are written to a temporary directory, removed once the runs are done
+    with tempfile.TemporaryDirectory(prefix='solartk-startup-') as directory:
+        archive = os.path.join(directory, 'archive.csv')
+        write_archive(archive)
+
+        # a private cache directory, warmed by a first untimed run of each workload
+        environment = dict(os.environ, SOLARTK_CACHE_DIR=os.path.join(directory, 'cache'))
+
+        example = os.path.join(root, 'data', 'example_home_days.csv')
+        common = ['--timezone', 'US/Eastern', '--weather-archive', archive]
+        parameters = '42 -72 42.2 42.5 188 0.005 0'
+        workloads = [
+            ('parameters', ['parameters.py', '42', '-72', example, '--elevation', '0'] + common, None),
+            ('maximum_generation', ['maximum_generation.py', '2015-01-02 00:00:00', '2015-01-02 23:00:00', '3600'] + common, parameters),
+            ('weather_adjusted', ['weather_adjusted.py', '--weather-archive', archive, '--seed', '1'], None),
+        ]
+
+        results = {}
+        for name, command, stdin in workloads:
+
+            # weather_adjusted reads the output of maximum_generation
+            if (stdin == None and name == 'weather_adjusted'):
+                stdin = results['maximum_generation'].pop('output')
+
+            run_latency(command, stdin, environment)
+            imports = [import_time(name, environment) for _ in range(repeats)]
+            runs = [run_latency(command, stdin, environment) for _ in range(repeats)]
+
+            results[name] = {'import_seconds': statistics.median(seconds for seconds, _ in imports),
+                             'first_output_seconds': statistics.median(first for first, _, _ in runs),
+                             'total_seconds': statistics.median(total for _, total, _ in runs),
+                             'heavy_modules': imports[0][1],
+                             'output': runs[0][2]}
+
+    for result in results.values():
+        result.pop('output', None)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+
+    # the regressions of the results with respect to the baseline, as messages
+    regressions = []
+    for name, result in results.items():
+        if (name not in baseline):
+            continue
+        for metric in ['import_seconds', 'first_output_seconds', 'total_seconds']:
+            if (result[metric] > baseline[name][metric] * (1 + tolerance)):
+                regressions.append('{} {}: {:.3f}s, baseline {:.3f}s'.format(name, metric, result[metric], baseline[name][metric]))
+        for module in result['heavy_modules']:
+            if (module not in baseline[name]['heavy_modules']):
+                regressions.append('{} imports {}'.format(name, module))
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the solar-tk entry points.')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs of each entry point (default: 5)')
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare with, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline (default: 0.25)')
+    args = parser.parse_args()
+
+    results = benchmark(repeats=args.repeats)
+    print(json.dumps(results, indent=2))
+
+    if (args.output != None):
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if (args.baseline != None):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        sys.exit(1 if len(regressions) > 0 else 0)
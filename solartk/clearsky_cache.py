@@ -0,0 +1,123 @@
+import collections
+import numpy as np
+import pandas as pd
+
+from helpers import granularity_to_freq, freq_to_seconds, localize
+from irradiance import get_clearsky_irradiance
+
+
+# in-memory memoization of clearsky irradiance, keyed by site, method and granularity, that stores
+# the computed time segments and, for a request that overlaps them, only computes the missing
+# sub-ranges and splices them in (e.g. for forecasts over sliding, overlapping windows)
+class ClearskyCache:
+
+    # a constructor to initialize the size bound (total number of cached times) and the coordinate rounding
+    def __init__(self, max_points=10**7, decimals=4):
+
+        self.max_points = max_points
+        self.decimals = decimals
+
+        # cached segments of each key, as sorted lists of [first position, last position, dataframe]
+        self.segments = collections.OrderedDict()
+
+        # hit and miss counters, in number of times served from the cache or computed
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'requests': self.requests, 'hits': self.hits, 'misses': self.misses,
+                'points': self.size(), 'keys': len(self.segments)}
+
+    def size(self):
+        return sum(len(segment[2]) for segments in self.segments.values() for segment in segments)
+
+    def clear(self):
+        self.segments.clear()
+
+    def get_clearsky_irradiance(self, start_time=None, end_time=None, timezone=None, latitude=None, longitude=None,
+                                granularity=60, clearsky_estimation_method='pysolar', google_api_key=None,
+                                elevation=None, elevation_provider=None):
+
+        # the lau model results depend on the elevation, so resolve it once and make it part of the key
+        if (clearsky_estimation_method == 'lau_model' and elevation is None and elevation_provider is not None):
+            elevation = elevation_provider.get_elevation(latitude, longitude)
+        elevation_known = (elevation is not None or google_api_key is not None)
+
+        if (clearsky_estimation_method == 'pysolar' or (clearsky_estimation_method == 'lau_model' and not elevation_known)):
+            method = 'pysolar'
+        elif (clearsky_estimation_method == 'lau_model'):
+            method = 'lau_model'
+        else:
+            # other methods are not cached
+            return get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=timezone,
+                        latitude=latitude, longitude=longitude, granularity=granularity,
+                        clearsky_estimation_method=clearsky_estimation_method, google_api_key=google_api_key,
+                        elevation=elevation)
+
+        # positions of the times on the granularity grid, both methods step in absolute time (UTC)
+        step = freq_to_seconds(granularity_to_freq(granularity)) * 10**9
+        first = pd.Timestamp(localize(start_time, timezone)).value
+        last = pd.Timestamp(localize(end_time, timezone)).value
+        last = first + ((last - first) // step) * step
+
+        key = (round(latitude, self.decimals), round(longitude, self.decimals), method, step, first % step,
+               str(timezone), elevation if method == 'lau_model' else None, google_api_key if elevation is None else None)
+
+        self.requests += 1
+        segments = self.segments.pop(key, [])
+
+        # find the cached segments that overlap (or touch) the request, and compute the gaps between them
+        touching = [segment[0] <= last + step and segment[1] >= first - step for segment in segments]
+        overlapping = [segment for segment, flag in zip(segments, touching) if flag]
+        others = [segment for segment, flag in zip(segments, touching) if not flag]
+
+        pieces = []
+        position = first
+        for segment in overlapping:
+            if (segment[0] > position):
+                pieces.append(self.compute(position, segment[0] - step, method, step, timezone, latitude, longitude,
+                                           granularity, google_api_key, elevation))
+            pieces.append(segment)
+            position = max(position, segment[1] + step)
+        if (position <= last):
+            pieces.append(self.compute(position, last, method, step, timezone, latitude, longitude,
+                                       granularity, google_api_key, elevation))
+
+        # splice everything into a single segment that covers the request
+        merged = [pieces[0][0], max(piece[1] for piece in pieces),
+                  pd.concat([piece[2] for piece in pieces], ignore_index=True) if len(pieces) > 1 else pieces[0][2]]
+        self.hits += sum(min(segment[1], last) - max(segment[0], first) + step for segment in overlapping
+                         if segment[0] <= last and segment[1] >= first) // step
+
+        self.segments[key] = sorted(others + [merged], key=lambda segment: segment[0])
+        self.evict(keep=key)
+
+        # select the requested times from the merged segment
+        offset = (first - merged[0]) // step
+        return merged[2].iloc[offset:offset + (last - first) // step + 1].reset_index(drop=True).copy()
+
+    def compute(self, first, last, method, step, timezone, latitude, longitude, granularity, google_api_key, elevation):
+
+        # compute the clearsky irradiance of the positions between first and last
+        start_time = pd.Timestamp(first, tz='UTC').to_pydatetime()
+        end_time = pd.Timestamp(last, tz='UTC').to_pydatetime()
+
+        irradiance = get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=timezone,
+                        latitude=latitude, longitude=longitude, granularity=granularity,
+                        clearsky_estimation_method=method, google_api_key=google_api_key, elevation=elevation)
+
+        self.misses += len(irradiance)
+
+        return [first, last, irradiance]
+
+    def evict(self, keep=None):
+
+        # remove the least recently used keys until the cache fits in its size bound
+        total = self.size()
+        for key in list(self.segments.keys()):
+            if (total <= self.max_points):
+                break
+            if (key == keep):
+                continue
+            total -= sum(len(segment[2]) for segment in self.segments.pop(key))
@@ -0,0 +1,260 @@
+import os
+import json
+import warnings
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+from helpers import cache_directory
+
+
+# elevation providers used by the lau_model clearsky estimation, every provider has a
+# get_elevation(latitude, longitude) function that returns the elevation in meters,
+# or None if the provider has no data for the given location
+
+# provider that returns an explicitly specified elevation
+class ConstantElevation:
+
+    def __init__(self, elevation=0.0):
+        self.elevation = float(elevation)
+
+    def get_elevation(self, latitude, longitude):
+        return self.elevation
+
+
+# provider of the last resort, sea level, with a warning since the clearsky 
+# irradiance of the lau model is then likely underestimated
+class SeaLevelElevation(ConstantElevation):
+
+    def __init__(self):
+        ConstantElevation.__init__(self, 0.0)
+
+    def get_elevation(self, latitude, longitude):
+        warnings.warn('the elevation of ({}, {}) is not known, sea level (0 m) is used.'.format(latitude, longitude))
+        return self.elevation
+
+
+# provider that interpolates (bilinear) a regular latitude/longitude grid of elevations,
+# read from a CSV file with latitude, longitude and elevation columns
+class GridElevation:
+
+    def __init__(self, data_file=None):
+
+        if (data_file is None):
+            raise ValueError('please specify the elevation grid file.')
+
+        grid = pd.read_csv(data_file).pivot_table(index='latitude', columns='longitude', values='elevation')
+        self.latitudes = grid.index.values.astype(float)
+        self.longitudes = grid.columns.values.astype(float)
+        self.values = grid.values.astype(float)
+
+    def get_elevation(self, latitude, longitude):
+        return bilinear_interpolation(self.latitudes, self.longitudes, self.values, latitude, longitude)
+
+
+# provider that interpolates (bilinear) a local DEM raster, either an ESRI ASCII grid (.asc)
+# or, if rasterio is installed, any raster format it can read (e.g. GeoTIFF) in lat/lon coordinates
+class RasterElevation:
+
+    def __init__(self, data_file=None):
+
+        if (data_file is None):
+            raise ValueError('please specify the DEM raster file.')
+
+        if (data_file.lower().endswith('.asc')):
+            self.latitudes, self.longitudes, self.values = read_ascii_grid(data_file)
+        else:
+            self.latitudes, self.longitudes, self.values = read_raster(data_file)
+
+    def get_elevation(self, latitude, longitude):
+        return bilinear_interpolation(self.latitudes, self.longitudes, self.values, latitude, longitude)
+
+
+# provider that queries the google maps elevation api (needs network access and an api key)
+class GoogleElevation:
+
+    def __init__(self, google_api_key=None):
+
+        if (google_api_key is None):
+            raise ValueError('please specify the google api key.')
+
+        self.google_api_key = google_api_key
+        self.client = None
+
+    def get_elevation(self, latitude, longitude):
+
+        # create the client on first use, so that googlemaps is only needed when it is used
+        if (self.client is None):
+            import googlemaps
+            self.client = googlemaps.Client(key=self.google_api_key)
+
+        elevation_api_response = self.client.elevation((latitude, longitude))
+        if (len(elevation_api_response) == 0):
+            return None
+
+        return elevation_api_response[0]['elevation']
+
+
+# provider that tries a list of providers in order and returns the first available elevation
+class ElevationChain:
+
+    def __init__(self, providers=None):
+        self.providers = [provider for provider in (providers or []) if provider is not None]
+
+    def get_elevation(self, latitude, longitude):
+
+        for provider in self.providers:
+            elevation = provider.get_elevation(latitude, longitude)
+            if (elevation is not None):
+                return elevation
+
+        return None
+
+
+# provider that keeps the results of another provider in a persistent key-value
+# store (a JSON file), keyed by the rounded latitude and longitude. It can be shared by
+# threads (e.g. the service workers), the cache is only changed and saved under its lock,
+# and the lookups saved by other processes are merged, as by timezones.TimezoneResolver
+class CachedElevation:
+
+    def __init__(self, provider=None, cache_file=None, decimals=4):
+
+        self.provider = provider
+        self.cache_file = os.path.join(cache_directory(), 'elevation.json') if cache_file is None else cache_file
+        self.decimals = decimals
+        self.lock = threading.RLock()
+
+        self.cache = self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get_elevation(self, latitude, longitude):
+
+        key = '{:.{d}f},{:.{d}f}'.format(round(latitude, self.decimals), round(longitude, self.decimals), d=self.decimals)
+
+        if (key in self.cache):
+            return self.cache[key]
+
+        # the provider (e.g. a web api) is not called under the lock, so that other locations are not held up
+        elevation = self.provider.get_elevation(latitude, longitude) if self.provider is not None else None
+        if (elevation is not None):
+            with self.lock:
+                self.cache[key] = float(elevation)
+                self.save()
+
+        return elevation
+
+    def save(self):
+
+        # the lookups saved by other processes are kept, and the file is written to a temporary 
+        # file first so that concurrent readers never see a partial file
+        with self.lock:
+            cache = self.load()
+            cache.update(self.cache)
+            self.cache = cache
+
+            directory = os.path.dirname(os.path.abspath(self.cache_file))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_file)
+
+
+# function to get the default elevation provider: past lookups from the persistent cache,
+# then the local DEM (if given), then google (if an api key is given), and finally sea level, 
+# with a warning
+def default_elevation_provider(dem_file=None, google_api_key=None):
+
+    providers = []
+    if (dem_file is not None):
+        providers.append(RasterElevation(dem_file))
+    if (google_api_key is not None and google_api_key.strip() != ''):
+        providers.append(GoogleElevation(google_api_key))
+
+    return ElevationChain([CachedElevation(ElevationChain(providers)), SeaLevelElevation()])
+
+
+# function to interpolate a (latitudes x longitudes) grid of values at the given location,
+# latitudes and longitudes are ascending axis coordinates of the grid points
+def bilinear_interpolation(latitudes, longitudes, values, latitude, longitude):
+
+    # locations outside the grid have no data
+    if (not (latitudes[0] <= latitude <= latitudes[-1] and longitudes[0] <= longitude <= longitudes[-1])):
+        return None
+
+    # find the grid cell and the position inside it
+    i = min(max(np.searchsorted(latitudes, latitude, side='right') - 1, 0), max(len(latitudes) - 2, 0))
+    j = min(max(np.searchsorted(longitudes, longitude, side='right') - 1, 0), max(len(longitudes) - 2, 0))
+    i1, j1 = min(i + 1, len(latitudes) - 1), min(j + 1, len(longitudes) - 1)
+    u = (latitude - latitudes[i])/(latitudes[i1] - latitudes[i]) if i1 != i else 0.0
+    v = (longitude - longitudes[j])/(longitudes[j1] - longitudes[j]) if j1 != j else 0.0
+
+    weights = np.array([(1-u)*(1-v), (1-u)*v, u*(1-v), u*v])
+    corners = np.array([values[i, j], values[i, j1], values[i1, j], values[i1, j1]])
+
+    # missing corners (no data) that contribute to the result make the elevation unknown
+    used = weights > 0
+    if (np.isnan(corners[used]).any()):
+        return None
+
+    return float(np.sum(weights[used]*corners[used]))
+
+
+# function to read an ESRI ASCII grid and return ascending latitude/longitude axes (cell centers) and values
+def read_ascii_grid(data_file):
+
+    header = {}
+    with open(data_file) as f:
+        for _ in range(6):
+            position = f.tell()
+            line = f.readline().split()
+            if (len(line) != 2 or not line[0][0].isalpha()):
+                f.seek(position)
+                break
+            header[line[0].lower()] = float(line[1])
+        values = np.loadtxt(f, dtype=float, ndmin=2)
+
+    nrows, ncols, cellsize = int(header['nrows']), int(header['ncols']), header['cellsize']
+    if ('xllcenter' in header):
+        lon0, lat0 = header['xllcenter'], header['yllcenter']
+    else:
+        lon0, lat0 = header['xllcorner'] + cellsize/2, header['yllcorner'] + cellsize/2
+
+    if ('nodata_value' in header):
+        values[values == header['nodata_value']] = np.nan
+
+    # the first row of the file is the northern most one
+    latitudes = lat0 + cellsize*np.arange(nrows)
+    longitudes = lon0 + cellsize*np.arange(ncols)
+
+    return latitudes, longitudes, values[::-1]
+
+
+# function to read a north-up raster with rasterio and return ascending latitude/longitude axes (cell centers) and values
+def read_raster(data_file):
+
+    try:
+        import rasterio
+    except ImportError:
+        raise ImportError('reading {} requires rasterio, or use an ESRI ASCII grid (.asc) instead.'.format(data_file))
+
+    with rasterio.open(data_file) as raster:
+        values = raster.read(1).astype(float)
+        if (raster.nodata is not None):
+            values[values == raster.nodata] = np.nan
+        transform = raster.transform
+
+    longitudes = transform.c + transform.a*(np.arange(values.shape[1]) + 0.5)
+    latitudes = transform.f + transform.e*(np.arange(values.shape[0]) + 0.5)
+
+    if (latitudes[0] > latitudes[-1]):
+        latitudes, values = latitudes[::-1], values[::-1]
+
+    return latitudes, longitudes, values
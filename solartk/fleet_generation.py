@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+import math
+import datetime
+import argparse
+import pytz
+import numpy as np
+import pandas as pd
+
+from irradiance import get_clearsky_irradiance, get_refraction_correction, get_radiation_direct
+from weather import get_temperature_cloudcover
+from sunpos import get_sun_position_multisite, Ephemeris
+from helpers import granularity_to_freq, time_chunks, localize
+from instrumentation import Instrumentation
+from timezones import get_resolver
+from writers import open_writer
+
+
+# maximum generation potential of a fleet of sites over the same time range: the sites share the
+# time grid (and so the timezone), the sun position of all the sites comes from one ephemeris (see
+# sunpos.py), the clearsky irradiance and the weather are computed once per location cell (the
+# latitude and longitude rounded to the given decimals, 2 decimals is about 1 km) rather than
+# once per site, and the maximum generation of all the sites is one broadcast (sites x times) expression
+class FleetGenerationPotential:
+
+    # a constructor to initialize the arrays of k, tilt, orientation, latitude, longitude, temperature
+    # coefficient and baseline temperature of the sites (scalars are shared by all the sites), in the
+    # same units as GenerationPotential, the site ids name the sites in the output (0, 1, ... by default)
+    def __init__(self, k=None, tilt=None, orientation=None, latitude=None, longitude=None, baseline_temperature=25,
+                 temperature_coefficient=0.5, site_ids=None, decimals=2):
+
+        if (k is None or latitude is None or longitude is None or tilt is None or orientation is None):
+            raise ValueError('please specify the k, tilt, orientation, latitude and longitude values.')
+
+        k, tilt, orientation, latitude, longitude, baseline_temperature, temperature_coefficient = np.broadcast_arrays(
+            *[np.atleast_1d(np.asarray(x, dtype=float)) for x in [k, tilt, orientation, latitude, longitude,
+                                                                   baseline_temperature, temperature_coefficient]])
+
+        if ((k <= 0).any()):
+            raise ValueError('please specify the k values, where k > 0.')
+        if ((tilt < 0).any()):
+            raise ValueError('please specify the tilt values, where tilt => 0.')
+        if ((orientation < 0).any()):
+            raise ValueError('please specify the orientation values, where orientation => 0.')
+
+        # convert back to k at 20% efficiency, and the angles to radians
+        self.k = k * 0.20
+        self.tilt_ = np.radians(tilt)
+        self.ore_ = np.radians(orientation)
+        self.lat_ = latitude
+        self.lon_ = longitude
+        self.t_baseline = baseline_temperature
+        self.c = temperature_coefficient
+        self.site_ids = list(range(len(self.k))) if site_ids is None else list(site_ids)
+
+        # location cells, and the cell of each site
+        cells = np.stack([np.round(latitude, decimals), np.round(longitude, decimals)], axis=1)
+        cells, self.cell_index = np.unique(cells, axis=0, return_inverse=True)
+        self.cell_index = self.cell_index.reshape(-1)
+        self.cell_lat, self.cell_lon = cells[:, 0], cells[:, 1]
+
+        # set default data sources for clearsky, sun position and temperature, as GenerationPotential
+        self.clearsky_source = 'pysolar'
+        self.temperature_source = 'weather_underground'
+        self.weather_archive = None
+
+        # optional shared sun position ephemeris that covers the time range
+        self.ephemeris = None
+
+        # optional clearsky cache (see clearsky_cache.py), used by the clearsky sources other than 'pysolar'
+        self.clearsky_cache = None
+
+        # stage timers (see instrumentation.py)
+        self.instrumentation = Instrumentation()
+
+        # timezone of the fleet (a name or a pytz timezone), looked up from the locations if it is None
+        self.timezone = None
+
+    def __len__(self):
+        return len(self.k)
+
+    def set_data_sources(self, clearsky_source='pysolar', temperature_source='darksky', weather_archive=None):
+
+        # set the parameters based on the specified values, weather_archive is the
+        # path of the local archive used by the 'archive' temperature source
+        self.clearsky_source = clearsky_source
+        self.temperature_source = temperature_source
+        self.weather_archive = weather_archive
+
+    def set_ephemeris(self, ephemeris=None):
+
+        # use a precomputed (site independent) sun position ephemeris that covers the time range
+        self.ephemeris = ephemeris
+
+    def set_clearsky_cache(self, cache=None):
+
+        # use the given clearsky cache, or no cache if it is None
+        self.clearsky_cache = cache
+
+    def set_timezone(self, timezone=None):
+
+        # use the given timezone instead of looking it up from the locations
+        self.timezone = timezone
+
+    def get_timezone(self):
+
+        # the timezone of the cells (see timezones.py), which must be the same for the whole fleet
+        if (self.timezone is not None):
+            return get_resolver().get_timezone(timezone=self.timezone)
+
+        names = set(get_resolver().timezone_name(lat, lon) for lat, lon in zip(self.cell_lat, self.cell_lon))
+        if (len(names) > 1):
+            raise ValueError('the sites are in different timezones ({}), please split the fleet or specify the timezone.'.format(
+                                ', '.join(sorted(names))))
+
+        return pytz.timezone(names.pop())
+
+    # a function to compute the maximum generation potential of the sites between the start and end
+    # times (local times of the fleet timezone), it returns the local times and the (sites x times)
+    # maximum generation, and with a chunk size, the time range is computed in blocks
+    def maximum_generation(self, start_time=None, end_time=None, granularity=60, chunk_size=None):
+
+        self.check_times(start_time, end_time)
+
+        if (chunk_size is None):
+            return self.compute_maximum_generation(start_time=start_time, end_time=end_time,
+                        granularity=granularity, timezone=self.get_timezone())
+
+        chunks = list(self.iter_maximum_generation(start_time=start_time, end_time=end_time,
+                        granularity=granularity, chunk_size=chunk_size))
+        return chunks[0][0].append([time for time, _ in chunks[1:]]), np.concatenate([matrix for _, matrix in chunks], axis=1)
+
+    # a generator that walks the time range in blocks of at most chunk_size times and
+    # yields the times and the maximum generation of each block
+    def iter_maximum_generation(self, start_time=None, end_time=None, granularity=60, chunk_size=86400):
+
+        # the chunks split the same absolute time grid as the whole range, with aware bounds
+        timezone = self.get_timezone()
+
+        for chunk_start, chunk_end in time_chunks(start_time, end_time, granularity, chunk_size, timezone=timezone):
+            yield self.compute_maximum_generation(start_time=chunk_start, end_time=chunk_end,
+                        granularity=granularity, timezone=timezone)
+
+    # a function to write the maximum generation with a writer (see writers.py), as a table of the
+    # times (#time) and a column per site, with a chunk size, each block is written as soon as it is computed
+    def write_maximum_generation(self, writer=None, start_time=None, end_time=None, granularity=60, chunk_size=None):
+
+        self.check_times(start_time, end_time)
+
+        if (chunk_size is None):
+            chunks = [self.compute_maximum_generation(start_time=start_time, end_time=end_time,
+                        granularity=granularity, timezone=self.get_timezone())]
+        else:
+            chunks = self.iter_maximum_generation(start_time=start_time, end_time=end_time,
+                        granularity=granularity, chunk_size=chunk_size)
+
+        for time, matrix in chunks:
+            with self.instrumentation.stage('output'):
+                table = pd.DataFrame(matrix.T, columns=[str(site_id) for site_id in self.site_ids])
+                table.insert(0, '#time', time)
+                writer.write(table)
+
+    def check_times(self, start_time=None, end_time=None):
+
+        # if time is not defined or defined as something other than datetime object, raise an error
+        if (start_time is None or end_time is None or isinstance(start_time, datetime.datetime) == False or isinstance(end_time, datetime.datetime) == False):
+            raise ValueError('please specify the correct start and end times as a datetime object.')
+
+    # a function to compute the maximum generation between two local times (naive, or aware as the 
+    # chunk bounds of iter_maximum_generation), the same localization as GenerationPotential
+    def compute_maximum_generation(self, start_time=None, end_time=None, granularity=60, timezone=None):
+
+        # the time grid, stepped in absolute time from the localized start time so that DST
+        # transitions are handled as by the clearsky irradiance, and the ephemeris of the grid
+        utc = pytz.timezone('UTC')
+        start_utc, end_utc = localize(start_time, timezone).astimezone(utc), localize(end_time, timezone).astimezone(utc)
+
+        # sun position of every site as (sites x times) matrices
+        with self.instrumentation.stage('sun_position'):
+            if (self.ephemeris is None):
+                ephemeris = Ephemeris(pd.date_range(start_utc, end_utc, freq=granularity_to_freq(granularity)))
+            else:
+                ephemeris = self.ephemeris.between(start_utc, end_utc)
+            _, sun_azimuth, sun_zenith = get_sun_position_multisite(start_time=start_utc, end_time=end_utc,
+                                            granularity=granularity, latitudes=self.lat_, longitudes=self.lon_,
+                                            ephemeris=ephemeris)
+
+        # local times of the grid
+        time = ephemeris.time if ephemeris.time.tz is not None else ephemeris.time.tz_localize(utc)
+        time = time.tz_convert(timezone).tz_localize(None)
+
+        # clearsky irradiance of every cell (cells x times), the 'pysolar' model of irradiance.py on the
+        # shared ephemeris, and the other models cell by cell, on the same UTC grid
+        with self.instrumentation.stage('clearsky'):
+            if (self.clearsky_source == 'pysolar'):
+                _, cell_zenith = ephemeris.sun_position(self.cell_lat.reshape(-1, 1), self.cell_lon.reshape(-1, 1))
+                altitude_deg = 90 - np.rad2deg(cell_zenith)
+                altitude_deg = altitude_deg + get_refraction_correction(altitude_deg)
+                clearsky = get_radiation_direct(ephemeris.time, altitude_deg)
+            else:
+                clearsky = np.stack([get_clearsky_irradiance(start_time=start_utc, end_time=end_utc, timezone=timezone,
+                                        granularity=granularity, latitude=lat, longitude=lon,
+                                        clearsky_estimation_method=self.clearsky_source,
+                                        cache=self.clearsky_cache)['clearsky'].to_numpy(dtype=float)
+                                     for lat, lon in zip(self.cell_lat, self.cell_lon)])
+
+        # ambient air temperature of every cell on the time grid, the weather sources take naive local 
+        # times, and the repeated hour at the end of daylight saving time is kept once
+        with self.instrumentation.stage('weather'):
+            temperature = np.stack([get_temperature_cloudcover(start_time=start_utc.astimezone(timezone).replace(tzinfo=None),
+                                        end_time=end_utc.astimezone(timezone).replace(tzinfo=None),
+                                        granularity=granularity, latitude=lat, longitude=lon,
+                                        source=self.temperature_source, timezone=timezone,
+                                        archive_path=self.weather_archive
+                                        ).drop_duplicates(subset='time').set_index('time')['temperature'].reindex(time).to_numpy(dtype=float)
+                                    for lat, lon in zip(self.cell_lat, self.cell_lon)])
+
+        # compute maximum power generation of all the sites at once, the same expression as GenerationPotential
+        k, tilt, ori = self.k[:, np.newaxis], self.tilt_[:, np.newaxis], self.ore_[:, np.newaxis]
+        c, t_baseline = self.c[:, np.newaxis], self.t_baseline[:, np.newaxis]
+        max_generation = clearsky[self.cell_index] * k * (
+            1 + c*(t_baseline - temperature[self.cell_index]))*(
+            np.cos(math.radians(90)-sun_zenith)
+            *np.sin(tilt)
+            *np.cos(sun_azimuth-ori)
+            +np.sin(math.radians(90)-sun_zenith)
+            *np.cos(tilt))
+
+        return time, max_generation
+
+
+def read_fleet(manifest_file, decimals=2):
+
+    # fleet of a manifest CSV file with site_id, latitude, longitude, k, tilt, orientation, temperature_coefficient
+    # and baseline_temperature columns (e.g. the output of fleet_parameters.py, whose failed sites are skipped)
+    manifest = pd.read_csv(manifest_file)
+    columns = ['site_id', 'latitude', 'longitude', 'k', 'tilt', 'orientation', 'temperature_coefficient', 'baseline_temperature']
+    missing = [column for column in columns if column not in manifest.columns]
+    if (len(missing) > 0):
+        raise ValueError('the manifest has no {} column.'.format(', '.join(missing)))
+    if ('status' in manifest.columns):
+        manifest = manifest[manifest['status'] == 'ok']
+
+    return FleetGenerationPotential(k=manifest['k'], tilt=manifest['tilt'], orientation=manifest['orientation'],
+                latitude=manifest['latitude'], longitude=manifest['longitude'],
+                baseline_temperature=manifest['baseline_temperature'], temperature_coefficient=manifest['temperature_coefficient'],
+                site_ids=manifest['site_id'], decimals=decimals)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compute the maximum generation potential of a fleet of solar sites.')
+    parser.add_argument('manifest', help='CSV file with site_id, latitude, longitude, k, tilt, orientation, '
+                                         'temperature_coefficient and baseline_temperature columns')
+    parser.add_argument('start_time', help='local start time, "%%Y-%%m-%%d %%H:%%M:%%S"')
+    parser.add_argument('end_time', help='local end time, "%%Y-%%m-%%d %%H:%%M:%%S"')
+    parser.add_argument('granularity', type=float, help='seconds between two times')
+    parser.add_argument('--output', default=None, help='output .csv, .parquet or .npy file (default: CSV on stdout)')
+    parser.add_argument('--chunk-size', type=int, default=None, help='compute and write blocks of this many times')
+    parser.add_argument('--weather-archive', default=None, help='local weather archive instead of the web')
+    parser.add_argument('--timezone', default=None, help='timezone of the fleet instead of the lookup of the locations')
+    parser.add_argument('--decimals', type=int, default=2, help='decimals of the location cells (default: 2, about 1 km)')
+    parser.add_argument('--profile', default=None, help="write the stage timers as JSON ('-' for stderr)")
+    args = parser.parse_args()
+
+    fleet = read_fleet(args.manifest, decimals=args.decimals)
+    if (args.weather_archive is not None):
+        fleet.set_data_sources(clearsky_source=fleet.clearsky_source, temperature_source='archive', weather_archive=args.weather_archive)
+    fleet.set_timezone(args.timezone)
+    fleet.instrumentation = Instrumentation(trace_memory=(args.profile is not None))
+
+    start_time_ = datetime.datetime.strptime(args.start_time, "%Y-%m-%d %H:%M:%S")
+    end_time_ = datetime.datetime.strptime(args.end_time, "%Y-%m-%d %H:%M:%S")
+
+    with open_writer(args.output) as writer:
+        fleet.write_maximum_generation(writer=writer, start_time=start_time_, end_time=end_time_,
+                                       granularity=args.granularity, chunk_size=args.chunk_size)
+
+    if (args.profile is not None):
+        fleet.instrumentation.write_report(args.profile)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+import os
+import io
+import sys
+import time
+import argparse
+import importlib.util
+import contextlib
+import concurrent.futures
+import pandas as pd
+
+from parameters import ParameterModeling
+from sunpos_cache import SunPositionCache, default_sun_position_cache
+from elevation import ConstantElevation, default_elevation_provider
+from timezones import get_resolver
+from instrumentation import Instrumentation
+
+
+# fleet parameter estimation: fits the parameters of many sites, listed in a manifest CSV file
+# with site_id, latitude, longitude and csv (historical generation data file, relative to the
+# manifest) columns, and an optional timezone column, over a pool of worker processes that keep
+# their warm state (timezone resolver, elevation provider, sun position cache) between sites
+
+result_columns = ['site_id', 'latitude', 'longitude', 'k', 'tilt', 'orientation', 'temperature_coefficient',
+                  'baseline_temperature', 'rounds', 'evaluations', 'seconds', 'status', 'error']
+
+# warm state of a worker process, set by the pool initializer
+worker_state = {}
+
+
+def init_worker(options):
+
+    # state shared by all the sites of a worker, the timezone resolver of the process (see 
+    # timezones.py) only loads the timezone polygons for sites without a timezone that it has not seen
+    worker_state['options'] = options
+    worker_state['timezone_resolver'] = get_resolver()
+    # the sun position tables are only kept when a cache directory is given (or the cache is enabled)
+    if (options.get('cache_dir') is not None):
+        worker_state['sun_position_cache'] = SunPositionCache(directory=options['cache_dir'])
+    else:
+        worker_state['sun_position_cache'] = default_sun_position_cache()
+    if (options.get('elevation') is not None):
+        worker_state['elevation_provider'] = ConstantElevation(options['elevation'])
+    else:
+        worker_state['elevation_provider'] = default_elevation_provider(dem_file=options.get('dem'))
+
+
+def fit_site(site):
+
+    # fit the parameters of a site (a dictionary of a manifest row), failures are recorded in the result
+    result = {'site_id': site['site_id'], 'latitude': site['latitude'], 'longitude': site['longitude'],
+              'status': 'ok', 'error': None}
+    options = worker_state['options']
+    start = time.time()
+
+    # stage timers of the site (see instrumentation.py), returned with the 'profile' option
+    instrumentation = Instrumentation(trace_memory=options.get('profile', False))
+
+    try:
+        timezone = site.get('timezone')
+        if (not isinstance(timezone, str) or timezone.strip() == ''):
+            timezone = None
+        timezone = worker_state['timezone_resolver'].get_timezone(site['latitude'], site['longitude'], timezone)
+
+        # ParameterModeling prints its file errors on stdout, which is not part of the fleet output 
+        # (the error is recorded in the result)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parameters = ParameterModeling(latitude=site['latitude'], longitude=site['longitude'],
+                                           data_file=site['csv'], timezone=timezone)
+            parameters.elevation_provider = worker_state['elevation_provider']
+            parameters.set_sun_position_cache(worker_state['sun_position_cache'])
+            if (options.get('weather_archive') is not None):
+                parameters.temperature_source, parameters.weather_archive = 'archive', options['weather_archive']
+            parameters.set_search_schedule(search_mode=options.get('search', 'exhaustive'),
+                                           k_search=options.get('k_search', 'grid'))
+            parameters.compact = options.get('compact', False)
+            parameters.instrumentation = instrumentation
+
+            # the search does not use the temperature, so without an archive the weather is not fetched
+            parameters.get_onetime_data(weather=(options.get('weather_archive') is not None))
+            parameters.preprocess_data()
+            k_, tilt_, ori_ = parameters.find_parameters()
+
+            # the search gives k = 0 when every capacity violates the upper limit of the generation data 
+            # (e.g. with a wrong timezone), which is not a fit of the site
+            if (k_ <= 0):
+                raise ValueError('no capacity k is feasible for the generation data, please check the location and timezone of the site.')
+            with instrumentation.stage('temperature_coefficients'):
+                t_base, c_ = parameters.find_temp_coefficients(k_, tilt_, ori_)
+
+        # k in the same units as the parameters.py output
+        result.update({'k': k_/0.18, 'tilt': tilt_, 'orientation': ori_, 'temperature_coefficient': c_,
+                       'baseline_temperature': t_base, 'rounds': parameters.rounds, 'evaluations': parameters.evaluations})
+
+    except Exception as e:
+        result.update({'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)})
+
+    result['seconds'] = time.time() - start
+
+    # the stage timers are merged by fit_fleet, they are not part of the results
+    if (options.get('profile', False)):
+        result['report'] = instrumentation.report()
+    return result
+
+
+def fit_fleet(manifest, workers=None, options=None, instrumentation=None):
+
+    # fit all the sites of a manifest dataframe, and return a dataframe of results in the manifest order, 
+    # the stage timers of the sites (with the 'profile' option) and their counts are merged into the instrumentation
+    options = options or {}
+    sites = manifest.to_dict('records')
+    results = [None]*len(sites)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(options,)) as executor:
+        futures = {executor.submit(fit_site, site): i for i, site in enumerate(sites)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                # the worker itself failed (e.g. it was killed), the site is still reported
+                results[i] = {'site_id': sites[i]['site_id'], 'latitude': sites[i]['latitude'],
+                              'longitude': sites[i]['longitude'], 'status': 'error',
+                              'error': '{}: {}'.format(type(e).__name__, e)}
+            print('{} {}'.format(results[i]['site_id'], results[i]['status']), file=sys.stderr)
+
+            report = results[i].pop('report', None)
+            if (instrumentation is not None):
+                instrumentation.count('sites')
+                instrumentation.count('failed_sites', int(results[i]['status'] != 'ok'))
+                if (report is not None):
+                    instrumentation.merge(report)
+
+    return pd.DataFrame(results, columns=result_columns)
+
+
+def read_manifest(manifest_file):
+
+    manifest = pd.read_csv(manifest_file)
+    missing = [column for column in ['site_id', 'latitude', 'longitude', 'csv'] if column not in manifest.columns]
+    if (len(missing) > 0):
+        raise ValueError('the manifest has no {} column.'.format(', '.join(missing)))
+
+    # data files are relative to the manifest
+    directory = os.path.dirname(os.path.abspath(manifest_file))
+    manifest['csv'] = [os.path.join(directory, path) for path in manifest['csv']]
+
+    return manifest
+
+
+def write_results(results, output_file=None):
+
+    # parquet for .parquet files, and csv otherwise (stdout if no file is given)
+    if (output_file is None):
+        results.to_csv(sys.stdout, index=False)
+    elif (output_file.endswith('.parquet')):
+        results.to_parquet(output_file, index=False)
+    else:
+        results.to_csv(output_file, index=False)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Estimate the parameters of a fleet of solar sites.')
+    parser.add_argument('manifest', help='CSV file with site_id, latitude, longitude, csv (and optional timezone) columns')
+    parser.add_argument('--output', default=None, help='output .csv or .parquet file (default: CSV on stdout)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--elevation', type=float, default=None, help='elevation in meters of all the sites')
+    parser.add_argument('--dem', default=None, help='DEM raster file to look up the site elevations')
+    parser.add_argument('--weather-archive', default=None, help='local weather archive instead of the web')
+    parser.add_argument('--cache-dir', default=None, help='sun position cache directory, enables the sun position tables (see sunpos_cache.py)')
+    parser.add_argument('--search', default='exhaustive', choices=['exhaustive', 'coarse_to_fine'], help='search schedule')
+    parser.add_argument('--k-search', default='grid', choices=['grid', 'bisection'], help='k search')
+    parser.add_argument('--compact', action='store_true', help='search on float32 columns to reduce the memory of the workers')
+    parser.add_argument('--profile', default=None, help="write the stage timers of all the sites as JSON ('-' for stderr)")
+    args = parser.parse_args()
+
+    # check the parquet support before fitting the fleet, rather than after
+    if (args.output is not None and args.output.endswith('.parquet')):
+        if (importlib.util.find_spec('pyarrow') is None and importlib.util.find_spec('fastparquet') is None):
+            parser.error('writing parquet files requires pyarrow (or fastparquet), or use a .csv output file.')
+
+    options = {'elevation': args.elevation, 'dem': args.dem, 'weather_archive': args.weather_archive,
+               'cache_dir': args.cache_dir, 'search': args.search, 'k_search': args.k_search,
+               'compact': args.compact, 'profile': (args.profile is not None)}
+
+    instrumentation = Instrumentation(trace_memory=(args.profile is not None))
+    with instrumentation.stage('fit_fleet'):
+        results = fit_fleet(read_manifest(args.manifest), workers=args.workers, options=options, instrumentation=instrumentation)
+    with instrumentation.stage('output'):
+        write_results(results, args.output)
+
+    if (args.profile is not None):
+        instrumentation.write_report(args.profile)
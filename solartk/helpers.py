@@ -1,4 +1,8 @@
+import os
+import datetime
 import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
 # function to translate granularity in seconds to 
 # appropriate pandas date_range frequency
@@ -29,3 +33,64 @@ def okta_to_percent(x):
     else: 
         return np.nan 
 
+# cloud cover percent range of each okta code, as used by okta_to_percent
+okta_codes = ['CLR', 'FEW', 'SCT', 'BKN', 'OVC']
+okta_lower = np.array([0, 13, 38, 62, 88, np.nan])
+okta_upper = np.array([12, 37, 62, 87, 100, np.nan])
+
+# array version of okta_to_percent, it maps the codes to their ranges through categorical 
+# codes (unknown codes are -1, which index the trailing nan) and draws all the samples in 
+# one call from the given numpy random generator (or seed)
+def okta_to_percent_array(x, rng=None):
+    rng = np.random.default_rng(rng)
+    codes = pd.Categorical(x, categories=okta_codes).codes
+    lower, upper = okta_lower[codes], okta_upper[codes]
+    return lower + rng.random(len(codes)) * (upper - lower)
+
+
+# function to get the directory where solar-tk keeps its on-disk caches, 
+# it can be moved with the SOLARTK_CACHE_DIR environment variable
+def cache_directory(name=''):
+    base = os.environ.get('SOLARTK_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'solartk'))
+    return os.path.join(base, name)
+
+# function to get the number of seconds between two timestamps of the 
+# pandas date_range frequency used for the given granularity
+def freq_to_seconds(freq):
+    return to_offset(freq).nanos // 10**9
+
+# function to split the time range between start_time and end_time into consecutive 
+# chunks of at most chunk_size timestamps on the granularity grid, with a timezone the 
+# times are localized and the grid steps in absolute time (like the pysolar clearsky path), 
+# so that a DST change falls inside a chunk the same way as in the whole range, and the 
+# chunk bounds are aware datetimes in the timezone
+def time_chunks(start_time, end_time, granularity, chunk_size, timezone=None):
+    step = datetime.timedelta(seconds=freq_to_seconds(granularity_to_freq(granularity)))
+    if timezone is not None:
+        start_time = localize(start_time, timezone).astimezone(datetime.timezone.utc)
+        end_time = localize(end_time, timezone).astimezone(datetime.timezone.utc)
+    chunk_start = start_time
+    while chunk_start <= end_time:
+        chunk_end = min(end_time, chunk_start + (chunk_size - 1)*step)
+        if timezone is not None:
+            yield chunk_start.astimezone(timezone), chunk_end.astimezone(timezone)
+        else:
+            yield chunk_start, chunk_end
+        chunk_start = chunk_end + step
+
+# function to remove an optional "--name value" pair from the command line 
+# arguments and return its value, or the default if it was not given
+def pop_option(args, name, default=None):
+    if name not in args:
+        return default
+    position = args.index(name)
+    value = args[position + 1]
+    del args[position:position + 2]
+    return value
+
+# function to attach the timezone to a naive datetime (pytz localize), or to 
+# convert an aware datetime to the timezone
+def localize(time, timezone):
+    if time.tzinfo is not None:
+        return time.astimezone(timezone)
+    return timezone.localize(time)
@@ -0,0 +1,93 @@
+import sys
+import json
+import time
+import contextlib
+import collections
+import tracemalloc
+
+
+# instrumentation of the solar-tk pipelines: per-stage timers (wall clock and, optionally, peak
+# traced memory), counters, and callback hooks for the search events, e.g.
+#   candidate_evaluated(parameter, candidates, values), a batch of candidates and their rmse
+#   round_finished(round, k, tilt, orientation, evaluations)
+# an instance without hooks and without memory tracing only costs a clock read per stage
+class Instrumentation:
+
+    # a constructor to initialize the stage timers, and whether the peak memory is traced (tracemalloc)
+    def __init__(self, trace_memory=False):
+
+        self.trace_memory = trace_memory
+        self.stages = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.hooks = collections.defaultdict(list)
+
+        # peak memory of the stages that are running, outermost first
+        self.running = []
+
+    def add_hook(self, event, callback):
+
+        # call callback(**details) on every event of the given name
+        self.hooks[event].append(callback)
+
+    def emit(self, event, **details):
+        for callback in self.hooks.get(event, []):
+            callback(**details)
+
+    def count(self, name, n=1):
+
+        # add n to a counter, e.g. the number of evaluated candidates
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def stage(self, name):
+
+        # time the enclosed block, the times and peaks of repeated stages are accumulated
+        if (self.trace_memory):
+            if (not tracemalloc.is_tracing()):
+                tracemalloc.start()
+            # the peak of the enclosing stage so far is kept before the peak is reset for this one
+            if (len(self.running) > 0):
+                self.running[-1] = max(self.running[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.running.append(0)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+
+            if (self.trace_memory):
+                peak = max(self.running.pop(), tracemalloc.get_traced_memory()[1])
+                stage['peak_bytes'] = max(stage.get('peak_bytes', 0), peak)
+                if (len(self.running) > 0):
+                    self.running[-1] = max(self.running[-1], peak)
+
+    def report(self):
+        return {'stages': self.stages, 'counters': self.counters}
+
+    def merge(self, report):
+
+        # add the stage times and counters of another report (e.g. of a worker process), the peaks are the largest
+        for name, other in report['stages'].items():
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += other['calls']
+            stage['seconds'] += other['seconds']
+            if ('peak_bytes' in other):
+                stage['peak_bytes'] = max(stage.get('peak_bytes', 0), other['peak_bytes'])
+        for name, n in report['counters'].items():
+            self.count(name, n)
+
+    def write_report(self, path):
+
+        # write the stage timers as JSON, '-' writes them to stderr
+        if (path == '-'):
+            json.dump(self.report(), sys.stderr, indent=2)
+            sys.stderr.write('\n')
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
@@ -1,41 +1,75 @@
 import datetime
-import pysolar
 import pytz
 import pandas as pd
-import requests
 import os 
-import googlemaps
 import numpy as np
 
-from helpers import granularity_to_freq
+from helpers import granularity_to_freq, time_chunks, localize
+from sunpos import get_sun_position, Ephemeris
+from elevation import GoogleElevation
 
 from typing import List, Dict, Tuple
 
+def iter_clearsky_irradiance(start_time: datetime.datetime = None, end_time: datetime.datetime = None, timezone: pytz.timezone = None, 
+                latitude: float = None, longitude: float = None, granularity: int = 60, chunk_size: int = 86400, **kwargs):
+
+    # generate the clearsky irradiance in consecutive blocks of at most chunk_size times, the 
+    # clearsky methods step in absolute time, so the chunks do as well
+    for chunk_start, chunk_end in time_chunks(start_time, end_time, granularity, chunk_size, timezone=timezone):
+
+        yield get_clearsky_irradiance(start_time=chunk_start, end_time=chunk_end, timezone=timezone, 
+                                      latitude=latitude, longitude=longitude, granularity=granularity, **kwargs)
+
+def get_refraction_correction(elevation_deg: np.ndarray = None, pressure: float = 101325.0, temperature: float = 288.15):
+
+    # array version of pysolar.solar.get_refraction_correction (pressure in pascals, temperature in kelvin)
+    a = pressure * 2.830 * 1.02
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = 1010.0 * temperature * 60.0 * np.tan(np.radians(elevation_deg + (10.3/(elevation_deg + 5.11))))
+
+    return np.where(elevation_deg >= -1.0*(0.26667 + 0.5667), a / b, 0.)
+
+def get_radiation_direct(when: pd.DatetimeIndex = None, altitude_deg: np.ndarray = None):
+
+    # array version of pysolar.radiation.get_radiation_direct (from Masters, p. 412), 
+    # when is a UTC DatetimeIndex and altitude_deg an array of the same length
+    day = when.dayofyear.values
+    flux = 1160 + (75 * np.sin(2 * np.pi / 365 * (day - 275)))
+    optical_depth = 0.174 + (0.035 * np.sin(2 * np.pi / 365 * (day - 100)))
+
+    # the air mass ratio is only meaningful during daytime, night times get zero radiation
+    is_daytime = altitude_deg > 0
+    with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+        air_mass_ratio = 1 / np.sin(np.radians(altitude_deg))
+        radiation = flux * np.exp(-1 * optical_depth * air_mass_ratio)
+
+    return np.where(is_daytime, radiation, 0.0)
+
 def get_clearsky_irradiance(start_time: datetime.datetime = None, end_time: datetime.datetime = None, timezone: pytz.timezone = None, 
                 latitude: float = None, longitude: float = None, sun_zenith: pd.DataFrame = None, 
                 granularity: int = 60, clearsky_estimation_method: str = 'pysolar', 
-                google_api_key: str = None):
+                google_api_key: str = None, elevation: float = None, elevation_provider = None, cache = None):
 
+    # reuse (and extend) the results of previous calls if a clearsky cache was given (see clearsky_cache.py)
+    if (cache != None and sun_zenith is None):
+        return cache.get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=timezone, 
+                        latitude=latitude, longitude=longitude, granularity=granularity, 
+                        clearsky_estimation_method=clearsky_estimation_method, google_api_key=google_api_key, 
+                        elevation=elevation, elevation_provider=elevation_provider)
 
+    # the lau model needs the elevation (in meters) of the site, either given directly, from an 
+    # elevation provider (see elevation.py), or from the google maps elevation api as a fallback
+    elevation_known: bool = (elevation != None or elevation_provider != None or google_api_key != None)
 
-    if (clearsky_estimation_method == 'pysolar' or google_api_key==None):
+    if (clearsky_estimation_method == 'pysolar_reference'):
 
-        ################################################################################## 
-        # 
-        # Pandas .apply based code, but it is slower than while loop
-        # from helpers import granularity_to_freq
-        #       
-        # datetime_series = pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity))
-        # datetime_series_localized = datetime_series.tz_localize(timezone)
-        # data = pd.DataFrame({'time':datetime_series_localized})
-        # data['altitude_deg'] = data['time'].apply(lambda timestamp: pysolar.solar.get_altitude(latitude, longitude, timestamp))
-        # data['clearsky'] = data.apply(lambda row: pysolar.solar.radiation.get_radiation_direct(row['time'], row['altitude_deg']), axis=1)
-        # data['time'] = data['time'].apply(lambda x: x.replace(tzinfo=pytz.utc).replace(tzinfo=None))  
-        ################################################################################## 
+        # reference implementation that calls pysolar for every time step, 
+        # it is much slower than the array based 'pysolar' method below
+        import pysolar
 
         # localizing the datetime based on the timezone
-        start: datetime.datetime = timezone.localize(start_time)
-        end: datetime.datetime = timezone.localize(end_time)
+        start: datetime.datetime = localize(start_time, timezone)
+        end: datetime.datetime = localize(end_time, timezone)
 
         # create arrays to store time and irradiance
         clearsky: List[int] = []
@@ -63,16 +97,49 @@ def get_clearsky_irradiance(start_time: datetime.datetime = None, end_time: date
         # create dataframe from lists
         irradiance: pd.DataFrame = pd.DataFrame({'time':time_,'clearsky':clearsky})
 
-    elif (clearsky_estimation_method == 'lau_model' and google_api_key!=None):
-
-        # use google maps python api to get elevation
-        gmaps = googlemaps.Client(key=google_api_key)
-        elevation_api_response:list = gmaps.elevation((latitude, longitude))
-        elevation_km:float = elevation_api_response[0]['elevation']/1000
-
-        # create a date_range and set it as a time column in a dataframe
-        datetime_series = pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity))
-        # datetime_series_localized = datetime_series.tz_localize(timezone)
+    elif (clearsky_estimation_method == 'pysolar' or not elevation_known):
+
+        # localize the start and end times, and step through them in absolute time so that 
+        # DST transitions are handled the same way as by timezone.normalize in the reference loop
+        datetime_series = pd.date_range(localize(start_time, timezone), localize(end_time, timezone), 
+                                        freq=granularity_to_freq(granularity))
+        datetime_series_utc = datetime_series.tz_convert('UTC')
+
+        # get the altitude degree for the given location from the vectorized sun position, 
+        # with the same atmospheric refraction correction as pysolar.solar.get_altitude
+        _, zenith = Ephemeris(datetime_series_utc).sun_position(latitude, longitude)
+        altitude_deg = 90 - np.rad2deg(zenith)
+        altitude_deg = altitude_deg + get_refraction_correction(altitude_deg)
+
+        # get the clearsky based on the time and altitude, removing the timezone information from the time
+        irradiance = pd.DataFrame({'time':datetime_series.tz_localize(None),
+                                   'clearsky':get_radiation_direct(datetime_series_utc, altitude_deg)})
+
+    elif (clearsky_estimation_method == 'lau_model' and elevation_known):
+
+        # get the elevation from the provider, or use google maps python api to get elevation
+        if (elevation == None):
+            if (elevation_provider == None):
+                elevation_provider = GoogleElevation(google_api_key)
+            elevation = elevation_provider.get_elevation(latitude, longitude)
+            if (elevation == None):
+                raise ValueError('the elevation of ({}, {}) could not be found.'.format(latitude, longitude))
+        elevation_km:float = elevation/1000
+
+        # create a date_range and set it as a time column in a dataframe, the times of a given sun zenith 
+        # are the caller's, otherwise the localized times are stepped in absolute time as by the pysolar 
+        # method, and the sun zenith is computed for the same times
+        if (sun_zenith is None):
+            utc = pytz.timezone('UTC')
+            tzinfo = utc if timezone == None else timezone
+            datetime_series = pd.date_range(localize(start_time, tzinfo), localize(end_time, tzinfo), 
+                                            freq=granularity_to_freq(granularity))
+            sun_zenith = get_sun_position(start_time=datetime_series[0].to_pydatetime().astimezone(utc), 
+                                          end_time=datetime_series[-1].to_pydatetime().astimezone(utc), 
+                                          granularity=granularity, latitude=latitude, longitude=longitude)['sun_zenith']
+            datetime_series = datetime_series.tz_convert(tzinfo).tz_localize(None)
+        else:
+            datetime_series = pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity))
         irradiance = pd.DataFrame({'time':datetime_series})
 
         # based on "E. G. Laue. 1970. The Measurement of Solar Spectral Irradiance at DifferentTerrestrial Elevations.Solar Energy13 (1970)", 
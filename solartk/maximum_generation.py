@@ -5,13 +5,17 @@ import datetime
 import math
 import time
 import sys
+import os
 import pytz
-from tzwhere import tzwhere
 
 from irradiance import get_clearsky_irradiance
 from weather import get_temperature_cloudcover
 from sunpos import get_sun_position
-from helpers import granularity_to_freq
+from sunpos_cache import default_sun_position_cache
+from helpers import granularity_to_freq, time_chunks, pop_option, localize
+from instrumentation import Instrumentation
+from timezones import get_timezone
+from writers import open_writer
 
 
 # maximum generation potential class that provides a function to find the maximum generation 
@@ -53,47 +57,139 @@ class GenerationPotential:
         self.clearsky_source = 'pysolar'
         self.sun_position_source = 'psa'
         self.temperature_source = 'weather_underground'
+        self.weather_archive = None
+
+        # optional shared sun position ephemeris, e.g. when computing many sites over the same horizon
+        self.ephemeris = None
+
+        # persistent sun position table cache (see sunpos_cache.py), only used when enabled
+        self.sun_position_cache = default_sun_position_cache()
+
+        # optional clearsky cache (see clearsky_cache.py), useful when the same instance 
+        # computes overlapping time ranges, e.g. sliding forecast windows
+        self.clearsky_cache = None
+
+        # stage timers (see instrumentation.py)
+        self.instrumentation = Instrumentation()
+
+        # timezone of the site (a name or a pytz timezone), looked up from the location if it is None
+        self.timezone = None
 
     
-    def set_data_sources(self, clearsky_source='pysolar', sun_position_source='psa', temperature_source='darksky'):
+    def set_data_sources(self, clearsky_source='pysolar', sun_position_source='psa', temperature_source='darksky', weather_archive=None):
 
-        # set the parameters based on the specified values
+        # set the parameters based on the specified values, weather_archive is the 
+        # path of the local archive used by the 'archive' temperature source
         self.clearsky_source = clearsky_source
         self.sun_position_source = sun_position_source
         self.temperature_source = temperature_source
+        self.weather_archive = weather_archive
+
+    def set_ephemeris(self, ephemeris=None):
+
+        # use a precomputed (site independent) sun position ephemeris that covers the horizon
+        self.ephemeris = ephemeris
+
+    def set_sun_position_cache(self, cache=None):
+
+        # use the given sun position table cache, or no cache if it is None
+        self.sun_position_cache = cache
+
+    def set_clearsky_cache(self, cache=None):
+
+        # use the given clearsky cache, or no cache if it is None
+        self.clearsky_cache = cache
 
     # a function to compute maximum generation potential for the given system at time t
-    # clearsky method and method for computing sun position are optional arguments
-    def maximum_generation(self, start_time=None, end_time=None, granularity=60):
+    # clearsky method and method for computing sun position are optional arguments, it returns
+    # a dataframe of the times (#time) and the maximum generation (max_generation, watts), and
+    # with a chunk size, the time range is computed in blocks (see iter_maximum_generation)
+    def maximum_generation(self, start_time=None, end_time=None, granularity=60, chunk_size=None):
+
+        self.check_times(start_time, end_time)
+
+        # without a chunk size, compute the whole time range at once
+        if (chunk_size == None):
+            return self.compute_maximum_generation(start_time=start_time, end_time=end_time, 
+                        granularity=granularity, timezone=self.get_timezone())
+
+        return pd.concat(list(self.iter_maximum_generation(start_time=start_time, end_time=end_time, 
+                                granularity=granularity, chunk_size=chunk_size)), ignore_index=True)
+
+    # a function to write the maximum generation of the time range with a writer (see writers.py), 
+    # with a chunk size, each block is written as soon as it is computed
+    def write_maximum_generation(self, writer=None, start_time=None, end_time=None, granularity=60, chunk_size=None):
+
+        self.check_times(start_time, end_time)
+
+        if (chunk_size == None):
+            chunks = [self.compute_maximum_generation(start_time=start_time, end_time=end_time, 
+                        granularity=granularity, timezone=self.get_timezone())]
+        else:
+            chunks = self.iter_maximum_generation(start_time=start_time, end_time=end_time, 
+                        granularity=granularity, chunk_size=chunk_size)
+
+        for max_generation in chunks:
+            with self.instrumentation.stage('output'):
+                writer.write(max_generation)
+
+    def check_times(self, start_time=None, end_time=None):
 
         # if time is not defined or defined as something other than datetime object, raise an error
         if (start_time == None or end_time == None or isinstance(start_time, datetime.datetime) == False or isinstance(end_time, datetime.datetime) == False):
             raise ValueError('please specify the correct start and end times as a datetime object.')
 
-        #calculate the timezone of the given latitude and longitude
-        tz = tzwhere.tzwhere()
-        timezone_str = tz.tzNameAt(self.lat_, self.lon_)
-        timezone = pytz.timezone(timezone_str)
+    # a generator that walks the time range in blocks of at most chunk_size times and 
+    # yields the maximum generation of each block, to keep memory bounded for long ranges
+    def iter_maximum_generation(self, start_time=None, end_time=None, granularity=60, chunk_size=86400):
+
+        # the chunks split the same absolute time grid as the whole range, with aware bounds
+        timezone = self.get_timezone()
+
+        for chunk_start, chunk_end in time_chunks(start_time, end_time, granularity, chunk_size, timezone=timezone):
+            yield self.compute_maximum_generation(start_time=chunk_start, end_time=chunk_end, 
+                                granularity=granularity, timezone=timezone)
+
+    def set_timezone(self, timezone=None):
+
+        # use the given timezone instead of looking it up from the location
+        self.timezone = timezone
+
+    def get_timezone(self):
+
+        #calculate the timezone of the given latitude and longitude (see timezones.py)
+        return get_timezone(self.lat_, self.lon_, self.timezone)
+
+    # a function to compute the maximum generation between two local times (naive, or aware 
+    # as the chunk bounds of iter_maximum_generation), on the grid of the localized times
+    def compute_maximum_generation(self, start_time=None, end_time=None, granularity=60, timezone=None):
 
         # get clearsky using the defined clearsky method
-        clearsky_irradiance = get_clearsky_irradiance(
-                                start_time=start_time, end_time=end_time, timezone=timezone, 
-                                granularity=granularity, latitude=self.lat_, longitude=self.lon_, 
-                                clearsky_source=self.clearsky_source)
+        with self.instrumentation.stage('clearsky'):
+            clearsky_irradiance = get_clearsky_irradiance(
+                                    start_time=start_time, end_time=end_time, timezone=timezone, 
+                                    granularity=granularity, latitude=self.lat_, longitude=self.lon_, 
+                                    clearsky_estimation_method=self.clearsky_source, cache=self.clearsky_cache)
         
         # get sun position
-        sun_position = get_sun_position(
-                            start_time= start_time.replace(tzinfo=timezone).astimezone(pytz.timezone('UTC')), 
-                            end_time=end_time.replace(tzinfo=timezone).astimezone(pytz.timezone('UTC')), 
-                            granularity=granularity, latitude=self.lat_, longitude=self.lon_)
+        with self.instrumentation.stage('sun_position'):
+            sun_position = get_sun_position(
+                                start_time=localize(start_time, timezone).astimezone(pytz.timezone('UTC')), 
+                                end_time=localize(end_time, timezone).astimezone(pytz.timezone('UTC')), 
+                                granularity=granularity, latitude=self.lat_, longitude=self.lon_, 
+                                sun_position_method=self.sun_position_source, ephemeris=self.ephemeris, 
+                                cache=self.sun_position_cache)
 
-        # # get ambient air temperature
-        t_ambient = get_temperature_cloudcover(start_time=start_time, 
-                        end_time=end_time, granularity=granularity, latitude=self.lat_, 
-                        longitude=self.lon_, source='weather_underground', timezone=timezone)
+        # # get ambient air temperature, the weather sources take naive local times
+        with self.instrumentation.stage('weather'):
+            t_ambient = get_temperature_cloudcover(start_time=localize(start_time, timezone).replace(tzinfo=None), 
+                            end_time=localize(end_time, timezone).replace(tzinfo=None), granularity=granularity, latitude=self.lat_, 
+                            longitude=self.lon_, source=self.temperature_source, timezone=timezone, 
+                            archive_path=self.weather_archive)
 
-        # get ambient temperature 
-        t_ambient = clearsky_irradiance.join(t_ambient.set_index('time'), on='time')
+        # get ambient temperature, the weather times are local so the repeated hour at the end of 
+        # daylight saving time is kept once
+        t_ambient = clearsky_irradiance.join(t_ambient.drop_duplicates(subset='time').set_index('time'), on='time')
 
         # compute maximum power generation, reusing clearsky dataframe to get time as well
         clearsky_irradiance['max_power'] = clearsky_irradiance['clearsky'] * self.k * (
@@ -108,14 +204,34 @@ class GenerationPotential:
         max_generation = clearsky_irradiance[['time', 'max_power']]
         max_generation.columns = ['#time', 'max_generation']
 
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None):
-            max_generation.to_csv(sys.stdout, index=False, header='False')
+        return max_generation
 
 
 if __name__ == "__main__":
 
-    # read user input from command line
+    # read user input from command line, an optional "--chunk-size N" streams the output in blocks of N times, 
+    # and "--weather-archive path" reads the weather from a local archive instead of the web
     user_args = sys.argv
+    chunk_size = pop_option(user_args, '--chunk-size')
+    weather_archive = pop_option(user_args, '--weather-archive')
+
+    # "--profile report.json" writes the stage timers and peak memory as JSON ('-' for stderr)
+    profile = pop_option(user_args, '--profile')
+
+    # "--timezone name" skips the timezone lookup of the location
+    timezone = pop_option(user_args, '--timezone')
+
+    # "--output path" writes the maximum generation to a .csv, .parquet or .npy file instead of stdout
+    output = pop_option(user_args, '--output')
+
+    # "--pipe-format binary" (or SOLARTK_PIPE_FORMAT=binary) writes the binary framing of pipe_format.py
+    # to stdout instead of CSV, weather_adjusted.py reads either, a terminal always gets CSV
+    pipe_format = pop_option(user_args, '--pipe-format', os.environ.get('SOLARTK_PIPE_FORMAT', 'csv'))
+    if (pipe_format not in ['csv', 'binary']):
+        raise ValueError('unknown pipe format {}, please use csv or binary.'.format(pipe_format))
+    binary = (pipe_format == 'binary' and not sys.stdout.isatty())
+
+    chunk_size = int(chunk_size) if chunk_size != None else None
     start_time, end_time, resolution = user_args[1], user_args[2], float(user_args[3])
 
     # if user input only 4 arguments, expect arguments from the pipeline
@@ -130,11 +246,20 @@ if __name__ == "__main__":
 
     # create an object of GenerationPotential class
     gen = GenerationPotential(k=k_, tilt=tilt_, orientation=ore_, temperature_coefficient=c_, latitude=lat, longitude=lon, baseline_temperature=tBase_)
+    if (weather_archive != None):
+        gen.set_data_sources(clearsky_source=gen.clearsky_source, sun_position_source=gen.sun_position_source, 
+                             temperature_source='archive', weather_archive=weather_archive)
 
     start_time_ = datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
     end_time_ = datetime.datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
 
-    print("#latitude(°),longitude(°)")
-    print("{},{}".format(lat, lon))
-    
-    gen.maximum_generation(start_time=start_time_, end_time=end_time_, granularity=resolution)
\ No newline at end of file
+    gen.instrumentation = Instrumentation(trace_memory=(profile != None))
+    gen.set_timezone(timezone)
+
+    # the location is written first, as the "#latitude(°),longitude(°)" header of the CSV output
+    with open_writer(output, metadata={'latitude(°)': lat, 'longitude(°)': lon}, binary=binary) as writer:
+        gen.write_maximum_generation(writer=writer, start_time=start_time_, end_time=end_time_, 
+                                     granularity=resolution, chunk_size=chunk_size)
+
+    if (profile != None):
+        gen.instrumentation.write_report(profile)
\ No newline at end of file
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+import os
+import sys
+import math
+import tempfile
+import numpy as np
+
+from parameters import ParameterModeling
+from search import segment_offsets, block_elements
+from helpers import pop_option
+from instrumentation import Instrumentation
+
+
+# incremental (online) parameter estimation: instead of searching the whole history again, each
+# new day of generation data is reduced once to sufficient statistics of the search, so that adding
+# a day costs time proportional to that day, and the search itself does not depend on the history:
+#   - for the rmse, the sums over all times of the plane of array basis products (see search.py)
+#     G = sum(b b^T), h = sum(b solar), sum(solar^2) and the number of times, since for the basis
+#     coefficients c of a (tilt, orientation) the squared error of k is sum(solar^2) - 2k c.h + k^2 c^T G c
+#   - for the upper limit violations (max < solar, i.e. k < solar/(c.b)), for every (tilt, orientation)
+#     of the search grid, the running maximum over the days of the smallest k with at most k_tolerance
+#     violations in the day (the bound of find_K), and the grid_tolerance + 1 largest ratios solar/(c.b)
+#     of all times (the bound of find_ori and find_tilt)
+# the statistics are kept in a state file (.npz) between runs
+class OnlineParameterModeling:
+
+    # a constructor to initialize the location, the state file (loaded if it exists) and the search grids,
+    # which are the grids of ParameterModeling
+    def __init__(self, latitude=None, longitude=None, timezone=None, state_file=None):
+
+        if (latitude is None):
+            raise ValueError('please specify the latitude value.')
+        else:
+            self.lat_ = float(latitude)
+
+        if (longitude is None):
+            raise ValueError('please specify the longitude value.')
+        else:
+            self.lon_ = float(longitude)
+
+        self.timezone = timezone
+        self.state_file = state_file
+
+        # elevation (meters) or DEM file for the clearsky model of the new days, see ParameterModeling.set_elevation
+        self.elevation = None
+        self.dem_file = None
+
+        # violations allowed in each day by find_K, and in total by find_ori and find_tilt
+        self.k_tolerance = 2
+        self.grid_tolerance = 1
+
+        # stage timers (see instrumentation.py), shared with the ParameterModeling of the new days
+        self.instrumentation = Instrumentation()
+
+        self.k_list = np.round(np.arange(0, 1000, 1)*0.1, 10)
+        self.tilt_list = np.arange(math.radians(self.lat_ - 20), math.radians(self.lat_ + 20), math.radians(0.1))
+        self.ori_list = np.arange(0, math.radians(360), math.radians(1))
+
+        # basis coefficients of every (tilt, orientation) of the grid, tilt major
+        tilt, ori = np.meshgrid(self.tilt_list, self.ori_list, indexing='ij')
+        tilt, ori = tilt.ravel(), ori.ravel()
+        self.coefficients = np.stack([np.sin(tilt)*np.cos(ori), np.sin(tilt)*np.sin(ori), np.cos(tilt)], axis=1)
+
+        self.reset()
+        if (state_file is not None and os.path.exists(state_file)):
+            self.load(state_file)
+
+    def reset(self):
+
+        shape = (len(self.tilt_list), len(self.ori_list))
+        self.gram = np.zeros((3, 3))
+        self.moment = np.zeros(3)
+        self.sum_squares = 0.0
+        self.count = 0
+        self.k_bound = np.full(shape, -np.inf)
+        self.top_ratios = np.full((self.grid_tolerance + 1,) + shape, -np.inf)
+        self.days = set()
+
+    def add_data(self, data_file=None, data=None):
+
+        # add the whole days of a generation data file (or dataframe with time and solar columns),
+        # days that were added before are skipped, and the number of added days is returned
+        parameters = ParameterModeling(latitude=self.lat_, longitude=self.lon_, data_file=data_file,
+                                       timezone=self.timezone, data=data)
+        if (self.elevation is not None or self.dem_file is not None):
+            parameters.set_elevation(elevation=self.elevation, dem_file=self.dem_file)
+        parameters.instrumentation = self.instrumentation
+        self.timezone = parameters.timezone
+
+        # the same sun position, clearsky and preprocessing as the batch search, without the weather
+        parameters.get_onetime_data(weather=False)
+        parameters.preprocess_data()
+        basis = parameters.get_basis()
+
+        dates = parameters.data['date'].values
+        offsets = segment_offsets(dates)
+        added = 0
+        with self.instrumentation.stage('add_days'):
+            for first, last in zip(offsets, list(offsets[1:]) + [len(dates)]):
+                day = str(dates[first])
+                if (day in self.days):
+                    continue
+                self.add_day(basis.basis[:, first:last], basis.solar[first:last])
+                self.days.add(day)
+                added += 1
+        self.instrumentation.count('days_added', added)
+
+        return added
+
+    def add_day(self, basis, solar):
+
+        # rmse statistics
+        self.gram += basis @ basis.T
+        self.moment += basis @ solar
+        self.sum_squares += float(solar @ solar)
+        self.count += len(solar)
+
+        # largest ratios solar/(c.b) of the day for every candidate, a time with c.b <= 0 is always a violation
+        rank = max(self.k_tolerance, self.grid_tolerance) + 1
+        k_bound, top_ratios = self.k_bound.reshape(-1), self.top_ratios.reshape(self.grid_tolerance + 1, -1)
+
+        block_size = max(1, block_elements // max(1, len(solar)))
+        for block in range(0, len(self.coefficients), block_size):
+            candidates = slice(block, block + block_size)
+            projection = self.coefficients[candidates] @ basis
+            ratios = np.full(projection.shape, np.inf)
+            np.divide(solar, projection, out=ratios, where=projection > 0)
+
+            # the rank largest ratios of each candidate in decreasing order, padded with -inf for short days
+            if (ratios.shape[1] > rank):
+                ratios = np.partition(ratios, ratios.shape[1] - rank, axis=1)[:, -rank:]
+            ratios = np.concatenate([np.full((ratios.shape[0], max(0, rank - ratios.shape[1])), -np.inf), ratios], axis=1)
+            ratios = -np.sort(-ratios, axis=1)
+
+            # at most k_tolerance violations in the day for k >= the (k_tolerance + 1)-th largest ratio
+            k_bound[candidates] = np.maximum(k_bound[candidates], ratios[:, self.k_tolerance])
+
+            # merge the largest ratios of all times
+            merged = np.concatenate([top_ratios[:, candidates].T, ratios[:, :self.grid_tolerance + 1]], axis=1)
+            top_ratios[:, candidates] = (-np.sort(-merged, axis=1))[:, :self.grid_tolerance + 1].T
+
+    def rmse(self, k, coefficients):
+
+        # rmse of k (array) and basis coefficients (candidates x 3) from the sufficient statistics
+        cross = coefficients @ self.moment
+        quadratic = np.einsum('ij,jk,ik->i', coefficients, self.gram, coefficients)
+        squares = self.sum_squares - 2*k*cross + k**2*quadratic
+        return np.sqrt(np.maximum(squares, 0)/self.count)
+
+    def find_K(self, tilt_index, ori_index):
+
+        # the first minimum, which is k = 0 when no candidate is feasible
+        coefficients = self.coefficients[tilt_index*len(self.ori_list) + ori_index][np.newaxis]
+        rmse_list = self.rmse(self.k_list, coefficients)
+        rmse_list = np.where(self.k_list >= self.k_bound[tilt_index, ori_index], rmse_list, np.inf)
+        return float(self.k_list[np.argmin(rmse_list)])
+
+    def find_ori(self, k_, tilt_index, iter_):
+
+        rmse_list = self.rmse(k_, self.coefficients[tilt_index*len(self.ori_list):(tilt_index + 1)*len(self.ori_list)])
+        if (iter_ >= 1):
+            rmse_list = np.where(self.top_ratios[self.grid_tolerance, tilt_index] <= k_, rmse_list, np.inf)
+
+        # if we could not find the parameters, the initial orientation
+        if (np.isinf(rmse_list).all()):
+            return self.nearest(self.ori_list, math.radians(180))
+        return int(np.argmin(rmse_list))
+
+    def find_tilt(self, k_, ori_index, iter_):
+
+        rmse_list = self.rmse(k_, self.coefficients[ori_index::len(self.ori_list)])
+        if (iter_ >= 1):
+            rmse_list = np.where(self.top_ratios[self.grid_tolerance, :, ori_index] <= k_, rmse_list, np.inf)
+
+        # if we could not find the parameters, the latitude
+        if (np.isinf(rmse_list).all()):
+            return self.nearest(self.tilt_list, math.radians(self.lat_))
+        return int(np.argmin(rmse_list))
+
+    def nearest(self, values, value):
+        return int(np.argmin(np.abs(values - value)))
+
+    def find_parameters(self, max_rounds=10):
+
+        # the coordinate descent of ParameterModeling.find_parameters on the grid indices, a round
+        # that does not change the parameters is a fixed point, so the following rounds are skipped
+        if (self.count == 0):
+            raise ValueError('please add generation data first.')
+
+        best_k = 100
+        tilt_index = self.nearest(self.tilt_list, math.radians(self.lat_))
+        ori_index = self.nearest(self.ori_list, math.radians(180))
+
+        with self.instrumentation.stage('search'):
+            for run in range(max_rounds):
+
+                previous = (best_k, tilt_index, ori_index)
+
+                best_k = self.find_K(tilt_index, ori_index)
+                add_k = 2 if run == 0 else 0
+                ori_index = self.find_ori(best_k + add_k, tilt_index, run)
+                tilt_index = self.find_tilt(best_k + add_k, ori_index, run)
+                self.instrumentation.count('rounds')
+
+                if (run >= 1 and (best_k, tilt_index, ori_index) == previous):
+                    break
+
+        return best_k, math.degrees(self.tilt_list[tilt_index]), math.degrees(self.ori_list[ori_index])
+
+    def save(self, state_file=None):
+
+        # write to a temporary file first so that an interrupted run keeps the previous state
+        state_file = self.state_file if state_file is None else state_file
+        directory = os.path.dirname(os.path.abspath(state_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, latitude=self.lat_, longitude=self.lon_, timezone='' if self.timezone is None else str(self.timezone), gram=self.gram,
+                     moment=self.moment, sum_squares=self.sum_squares, count=self.count, k_bound=self.k_bound,
+                     top_ratios=self.top_ratios, days=np.array(sorted(self.days), dtype=str))
+        os.replace(tmp_path, state_file)
+
+    def load(self, state_file):
+
+        with np.load(state_file) as state:
+            if (float(state['latitude']) != self.lat_ or float(state['longitude']) != self.lon_):
+                raise ValueError('the state file {} belongs to another site.'.format(state_file))
+            if (self.timezone is None and str(state['timezone']) != ''):
+                self.timezone = str(state['timezone'])
+            self.gram, self.moment = state['gram'], state['moment']
+            self.sum_squares, self.count = float(state['sum_squares']), int(state['count'])
+            self.k_bound, self.top_ratios = state['k_bound'], state['top_ratios']
+            self.days = set(state['days'].tolist())
+
+
+if __name__ == "__main__":
+
+    # read user input from command line: the state file, latitude, longitude and the new generation data file,
+    # the site elevation can be given as "--elevation meters" or "--dem raster_file", and "--timezone name"
+    # skips the timezone lookup of the location, "--profile report.json" writes the stage timers and peak 
+    # memory as JSON ('-' for stderr)
+    user_args = sys.argv
+    elevation, dem_file = pop_option(user_args, '--elevation'), pop_option(user_args, '--dem')
+    timezone = pop_option(user_args, '--timezone')
+    profile = pop_option(user_args, '--profile')
+
+    if (len(user_args) < 5):
+        print("Please input the state file, latitude, longitude, and new generation data file.")
+        sys.exit(1)
+    state_file, lat, lon, file_ = user_args[1], user_args[2], user_args[3], user_args[4]
+
+    instrumentation = Instrumentation(trace_memory=(profile is not None))
+    with instrumentation.stage('load'):
+        parameters = OnlineParameterModeling(latitude=lat, longitude=lon, timezone=timezone, state_file=state_file)
+    parameters.elevation, parameters.dem_file = elevation, dem_file
+    parameters.instrumentation = instrumentation
+
+    # add the new days, keep the statistics, and search the parameters of the whole history
+    parameters.add_data(data_file=file_)
+    with instrumentation.stage('save'):
+        parameters.save()
+    k_, tilt_, ori_ = parameters.find_parameters()
+
+    # the same output as parameters.py, with the standard temperature coefficients
+    with instrumentation.stage('output'):
+        print(lat, lon, k_/0.18, tilt_, ori_, 0.005, 0)
+        sys.stdout.flush()
+
+    if (profile is not None):
+        instrumentation.write_report(profile)
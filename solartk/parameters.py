@@ -2,25 +2,27 @@
 import sys
 import pandas as pd
 import pytz
-from tzwhere import tzwhere
 import numpy as np
 import math
-from sklearn import metrics
 
 from irradiance import get_clearsky_irradiance
 from weather import get_temperature_cloudcover
 from sunpos import get_sun_position
-
-
-#debug code 
-import matplotlib.pyplot as plt 
+from sunpos_cache import default_sun_position_cache
+from elevation import ConstantElevation, default_elevation_provider
+from helpers import pop_option, localize
+from timezones import get_timezone
+from instrumentation import Instrumentation
+from search import segment_offsets, plane_of_array, evaluate_k, CompactData, PlaneOfArrayBasis, coarse_to_fine, bisection_search
 
 
 
 class ParameterModeling:
     
-    # a constructor to initialize the values of latitude, logitude, and the file name
-    def __init__(self, latitude=None, longitude=None, data_file=None):  
+    # a constructor to initialize the values of latitude, logitude, and the file name (or a dataframe
+    # with the same time and solar columns), the timezone (a name or a pytz timezone) is looked up 
+    # from the latitude and longitude if it is not given
+    def __init__(self, latitude=None, longitude=None, data_file=None, timezone=None, data=None):  
 
         # set default data sources for clearsky, sun position and temperature
         self.clearsky_estimation_method = 'lau_model'
@@ -29,6 +31,40 @@ class ParameterModeling:
         self.google_api_key = ' '
         self.darksky_api_key = ' '
 
+        # local weather archive (see weather_archive.py), used when temperature_source is 'archive'
+        self.weather_archive = None
+
+        # optional shared sun position ephemeris, e.g. when fitting many sites over the same time window
+        self.ephemeris = None
+
+        # elevation provider for the lau model, or None for the default provider (see get_elevation_provider), 
+        # which is built on first use so that it uses the google api key and DEM file set by then
+        self.elevation_provider = None
+        self.dem_file = None
+        self.default_provider = None
+
+        # persistent sun position table cache (see sunpos_cache.py), only used when enabled
+        self.sun_position_cache = default_sun_position_cache()
+
+        # draw the debug plots of the search (shown by show_plots), matplotlib is only imported when plotting
+        self.show_plots = False
+
+        # stage timers and search event hooks (see instrumentation.py)
+        self.instrumentation = Instrumentation()
+
+        # plane of array basis of the data (see search.py), computed when the search starts
+        self.basis = None
+
+        # compact mode: the search works on float32 copies of its columns with an int32 day index
+        # (see search.CompactData) in preallocated buffers, and does not add the max columns to the data
+        self.compact = False
+        self.columns = None
+
+        # search schedule, and the number of rounds and candidate evaluations of the last search
+        self.set_search_schedule()
+        self.rounds = 0
+        self.evaluations = 0
+
         if (latitude == None):
             raise ValueError('please specify the latitude value.')
         else:
@@ -40,7 +76,7 @@ class ParameterModeling:
             self.lon_ = float(longitude)
 
         try: 
-            self.data = pd.read_csv(data_file)
+            self.data = pd.read_csv(data_file) if data is None else data.copy()
             self.data['time'] = pd.to_datetime(self.data['time'])
             self.data = self.data.sort_values(by=['time'], ascending=True).reset_index(drop=True)
 
@@ -51,69 +87,120 @@ class ParameterModeling:
             # get the resolution of the data as number of seconds between two consecutive timestamps
             self.granularity = (self.data.iloc[1][0] - self.data.iloc[0][0]).seconds
 
-            #calculate the timezone of the given latitude and longitude
-            tz = tzwhere.tzwhere()
-            timezone_str = tz.tzNameAt(self.lat_, self.lon_)
-            self.timezone = pytz.timezone(timezone_str)
+            #calculate the timezone of the given latitude and longitude (see timezones.py)
+            self.timezone = get_timezone(self.lat_, self.lon_, timezone)
 
         except:
             print('The file could not be opened.')
             raise
 
+    def set_ephemeris(self, ephemeris=None):
+
+        # use a precomputed (site independent) sun position ephemeris that covers the data
+        self.ephemeris = ephemeris
+
+    def set_elevation(self, elevation=None, dem_file=None):
+
+        # use an explicit elevation in meters, or look it up in a local DEM raster (see elevation.py)
+        if (elevation != None):
+            self.elevation_provider = ConstantElevation(elevation)
+        else:
+            self.elevation_provider, self.dem_file = None, dem_file
+
+    def get_elevation_provider(self):
+
+        # the elevation provider that was set, or the default one of the current DEM file and google api key, 
+        # past lookups are kept on disk and sea level is used (with a warning) when the elevation is not known
+        if (self.elevation_provider != None):
+            return self.elevation_provider
+
+        key = (self.dem_file, self.google_api_key)
+        if (self.default_provider == None or self.default_provider[0] != key):
+            self.default_provider = (key, default_elevation_provider(dem_file=self.dem_file, google_api_key=self.google_api_key))
+
+        return self.default_provider[1]
+
+    def set_sun_position_cache(self, cache=None):
+
+        # use the given sun position table cache, or no cache if it is None
+        self.sun_position_cache = cache
+
     def upperlimit_violation_count(self, x):
         return len(x[x['max'] < x['solar']])
     
     def root_mean_squared_error(self, prediction, accurate):
+        from sklearn import metrics
         return np.sqrt(metrics.mean_squared_error(accurate, prediction))
 
-    def get_onetime_data(self):
+    def get_onetime_data(self, weather=True):
 
-        # get sun position
-        sun_position = get_sun_position(
-                            start_time=self.start_time.replace(tzinfo=self.timezone).astimezone(pytz.timezone('UTC')), 
-                            end_time=self.end_time.replace(tzinfo=self.timezone).astimezone(pytz.timezone('UTC')), 
-                            granularity=self.granularity, latitude=self.lat_, longitude=self.lon_)
+        # get sun position, the local times of the data are localized as by GenerationPotential, so
+        # that the parameters are fitted on the same time base as the maximum generation is predicted
+        with self.instrumentation.stage('sun_position'):
+            sun_position = get_sun_position(
+                                start_time=localize(self.start_time, self.timezone).astimezone(pytz.timezone('UTC')), 
+                                end_time=localize(self.end_time, self.timezone).astimezone(pytz.timezone('UTC')), 
+                                granularity=self.granularity, latitude=self.lat_, longitude=self.lon_, 
+                                sun_position_method=self.sun_position_source, ephemeris=self.ephemeris, 
+                                cache=self.sun_position_cache)
 
         self.data['sun_azimuth'] = sun_position['sun_azimuth']
         self.data['sun_zenith'] = sun_position['sun_zenith']
 
         # get clearsky using the defined clearsky method
-        clearsky_irradiance = get_clearsky_irradiance(
-                                start_time=self.start_time, end_time=self.end_time, timezone=self.timezone, 
-                                granularity=self.granularity, latitude=self.lat_, longitude=self.lon_, 
-                                clearsky_estimation_method=self.clearsky_estimation_method, sun_zenith=self.data['sun_zenith'], google_api_key=self.google_api_key)
+        with self.instrumentation.stage('clearsky'):
+            clearsky_irradiance = get_clearsky_irradiance(
+                                    start_time=self.start_time, end_time=self.end_time, timezone=self.timezone, 
+                                    granularity=self.granularity, latitude=self.lat_, longitude=self.lon_, 
+                                    clearsky_estimation_method=self.clearsky_estimation_method, sun_zenith=self.data['sun_zenith'], google_api_key=self.google_api_key, 
+                                    elevation_provider=self.get_elevation_provider())
 
         self.data['clearsky'] = clearsky_irradiance['clearsky']
+        self.basis, self.columns = None, None
+
+        # the search itself does not use the temperature, so the weather download can be skipped
+        if (not weather):
+            self.data['temperature'] = np.nan
+            return
         
         # get ambient air temperature
-        t_ambient = get_temperature_cloudcover(start_time=self.start_time, 
-                        end_time=self.end_time, granularity=self.granularity, latitude=self.lat_, 
-                        longitude=self.lon_, source=self.temperature_source, timezone=self.timezone, darksky_api_key=self.darksky_api_key)
-
-        # get ambient temperature 
-        filtered = self.data.join(t_ambient.set_index('time'), on='time')
+        with self.instrumentation.stage('weather'):
+            t_ambient = get_temperature_cloudcover(start_time=self.start_time, 
+                            end_time=self.end_time, granularity=self.granularity, latitude=self.lat_, 
+                            longitude=self.lon_, source=self.temperature_source, timezone=self.timezone, darksky_api_key=self.darksky_api_key, 
+                            archive_path=self.weather_archive)
+
+        # get ambient temperature, the weather times are local so the repeated hour at the end of 
+        # daylight saving time is kept once
+        filtered = self.data.join(t_ambient.drop_duplicates(subset='time').set_index('time'), on='time')
         self.data['temperature'] = filtered['temperature']
+        self.basis, self.columns = None, None
 
     def preprocess_data(self):
 
         # print(self.data)
         
-        # remove all the times when solar power is zero
-        self.data = self.data[self.data.solar > 0]
+        with self.instrumentation.stage('preprocess'):
+            # remove all the times when solar power is zero
+            self.data = self.data[self.data.solar > 0]
 
-        # get the date from the 
-        self.data['date'] = self.data['time'].dt.date
+            # get the date from the 
+            self.data['date'] = self.data['time'].dt.date
 
-        # print(self.data)
+            # print(self.data)
         
-        # delete the first and last hours of the day
-        self.data = self.data.groupby('date', as_index=False).apply(lambda group: group.iloc[2:]).reset_index()
-        self.data = self.data.drop(['level_0', 'level_1'], axis = 1)
-        self.data = self.data.groupby('date', as_index=False).apply(lambda group: group.iloc[:-2]).reset_index()
-        self.data = self.data.drop(['level_0', 'level_1'], axis = 1)
+            # delete the first and last hours of the day
+            self.data = self.data.groupby('date', as_index=False).apply(lambda group: group.iloc[2:]).reset_index()
+            self.data = self.data.drop(['level_0', 'level_1'], axis = 1)
+            self.data = self.data.groupby('date', as_index=False).apply(lambda group: group.iloc[:-2]).reset_index()
+            self.data = self.data.drop(['level_0', 'level_1'], axis = 1)
         
-        # convert kw to watts
-        self.data['solar'] = 1000*self.data['solar']
+            # convert kw to watts
+            self.data['solar'] = 1000*self.data['solar']
+
+            # the data changed, so the plane of array basis and the compact columns are computed again
+            self.basis = None
+            self.columns = None
 
         ### debug comment: keeping date column for later use ###
         # drop the date_only column
@@ -126,8 +213,13 @@ class ParameterModeling:
         best_k = 100
         best_tilt = math.radians(self.lat_)
         best_ori = math.radians(180)
+
+        self.rounds = 0
+        self.evaluations = 0
             
-        for run in range(10):
+        for run in range(self.max_rounds):
+
+            previous = (best_k, best_tilt, best_ori)
 
             # best_k = float(input('Please input k: '))
             # best_tilt = np.deg2rad(int(input('Please input tilt: ')))
@@ -136,15 +228,14 @@ class ParameterModeling:
             # search for best k
             best_k = self.find_K(best_tilt, best_ori, run)
 
-            self.data['max'] = self.data['clearsky'] * best_k * (
-            1 + 0.005*(16 - self.data['temperature'])) *(
-                np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.sin(best_tilt)
-                *np.cos(pd.to_numeric(self.data['sun_azimuth'])-best_ori) 
-                +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.cos(best_tilt))
-
-            print(self.data)
+            if (not self.compact):
+                self.data['max'] = self.data['clearsky'] * best_k * (
+                1 + 0.005*(16 - self.data['temperature'])) *(
+                    np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
+                    *np.sin(best_tilt)
+                    *np.cos(pd.to_numeric(self.data['sun_azimuth'])-best_ori) 
+                    +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
+                    *np.cos(best_tilt))
 
             if run == 0:
                 add_k = 2
@@ -160,7 +251,15 @@ class ParameterModeling:
             best_tilt = self.find_tilt(best_k + add_k, best_ori, self.lat_, run)
             # best_tilt = np.deg2rad(50)
 
-            print(best_k, np.rad2deg(best_ori), np.rad2deg(best_tilt))
+            self.rounds = run + 1
+            self.instrumentation.count('rounds')
+            self.instrumentation.emit('round_finished', round=run, k=best_k, tilt=math.degrees(best_tilt), 
+                                      orientation=math.degrees(best_ori), evaluations=self.evaluations)
+
+            # stop once the parameters do not change anymore (the first round, with the initial 
+            # values and without tolerances for the orientation and tilt, is always followed by another)
+            if (self.search_mode == 'coarse_to_fine' and run >= 1 and self.converged(previous, (best_k, best_tilt, best_ori))):
+                break
             # debug code
             # self.data['max'] = self.data['clearsky'] * best_k * (
             # 1 + 0.005*(25 - self.data['temperature'])) *(
@@ -179,226 +278,183 @@ class ParameterModeling:
 
         return best_k, math.degrees(best_tilt), math.degrees(best_ori)
  
+    def converged(self, previous, current):
+
+        # check if two successive (k, tilt, orientation) results agree within the convergence tolerances
+        ori_change = abs((math.degrees(current[2] - previous[2]) + 180) % 360 - 180)
+        return (abs(current[0] - previous[0]) <= self.k_convergence and 
+                abs(math.degrees(current[1] - previous[1])) <= self.tilt_convergence and 
+                ori_change <= self.ori_convergence)
+
     def find_K(self, tilt_, ori_, iter_):
 
-        # initialize some variables
-        k_ = 0
+        # initialize some variables, the k candidates are rounded to decimal multiples of the resolution
         k_tolerance = 2
-        
-        rmse_list = []
-        k_list = []
+        k_list = np.round(np.arange(0, int(round(self.k_max/self.k_resolution)), 1)*self.k_resolution, 10)
 
         #debug code
         # print(tilt_, ori_)
 
-        for k_ in range(0, 1000, 1):
-            
-            k_ = k_/10
-
-            # compute maximum power generation for the given parameters
-            self.data['max'] = self.data['clearsky'] * k_ * (
-                np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.sin(tilt_)
-                *np.cos(pd.to_numeric(self.data['sun_azimuth'])-ori_) 
-                +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.cos(tilt_))
-
-            # count how many times upperlimit has been violated for each day
-            count = self.data.groupby(['date']).apply(self.upperlimit_violation_count)
-
-            # print(count)
-            # break
-
-            ##########################################################################
-            # debug code
-            # if ((k_ % 3 == 0) and (6<= k_ <= 12) and (iter_ == 1)):
-            #     plt.plot([i for i in range(len(self.data))], self.data['max'], label='Max Solar ({})'.format(k_))
-            #     plt.plot([i for i in range(len(self.data))], self.data['solar'], label='Solar')
-            #     plt.legend()
-            #     plt.title('Graph with K')
-            #     plt.show()  
-            ##########################################################################
-
-            # # check if count > tolerance
-            # if iter_ <0: 
-            #     k_list.append(k_)
-            #     rmse_ = np.sqrt(metrics.mean_squared_error(self.data['solar'], self.data['max']))
-            #     rmse_list.append(rmse_) 
-            #     k_flag = True               
-            # else:
-            # if count <= k_tolerance:
-
-
-            # (count > k_tolerance).any()
-
-            if (count > k_tolerance).any():
-                k_list.append(k_) 
-                rmse_list.append(np.inf)
-                # print(k_, np.inf, any(count))
-            else: 
-                k_list.append(k_)
-                rmse_list.append(self.root_mean_squared_error(self.data['max'], self.data['solar']))
-                # print(k_, self.root_mean_squared_error(self.data['max'], self.data['solar']))
-
-            # if k_ > 10:
-            #     break
-
-        ##### debug code
-        # k_flag = True
-        # print(len(rmse_list))
-        # print(self.data['max'])
-        
-        # if we could find the parameters
-        if any(rmse_list) != np.inf:      
-            minimum_rmse = min(rmse_list)
-            index_min_rmse = rmse_list.index(minimum_rmse)
+        # the maximum power generation is linear in k, so the plane of array term is computed once
+        # and all the candidates are evaluated together, counting the upper limit violations of each 
+        # day over the day offsets of the (time sorted) data, see search.py
+        if (self.compact):
+            columns = self.get_compact_data()
+            clearsky, solar, offsets, workspace = columns.clearsky, columns.solar, columns.offsets, columns.workspace
+            poa = plane_of_array(columns.sun_zenith, columns.sun_azimuth, tilt_, ori_).astype(columns.dtype, copy=False)
         else:
-            return 100
+            clearsky = self.data['clearsky'].to_numpy(dtype=float)
+            solar = self.data['solar'].to_numpy(dtype=float)
+            poa = plane_of_array(pd.to_numeric(self.data['sun_zenith']).to_numpy(dtype=float), 
+                                 pd.to_numeric(self.data['sun_azimuth']).to_numpy(dtype=float), tilt_, ori_)
+            offsets, workspace = segment_offsets(self.data['date'].values), None
 
+        objective = lambda indices: evaluate_k(clearsky, poa, solar, offsets, k_list[indices], k_tolerance, workspace)
+
+        # the first minimum, which is k = 0 when no candidate is feasible
+        index_min_rmse, _ = self.search_grid(objective, k_list, 'k', bisection=(self.k_search == 'bisection'))
 
         ##########################################################################
         # print(k_list[index_min_rmse])
 
         # debug code
-        self.data['max'] = self.data['clearsky'] * k_list[index_min_rmse] * (
-            np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-            *np.sin(tilt_)
-            *np.cos(pd.to_numeric(self.data['sun_azimuth'])-ori_) 
-            +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-            *np.cos(tilt_))
+        if (not self.compact or self.show_plots):
+            self.data['max'] = clearsky * k_list[index_min_rmse] * poa
         
-        # debug code
-        plt.plot([i for i in range(len(self.data))], self.data['max'], label='Max Solar ({})'.format(k_list[index_min_rmse]))
-        plt.plot([i for i in range(len(self.data))], self.data['solar'], label='Solar')
-        plt.legend()
-        plt.title('Graph with K')
-        plt.show()  
+        # debug code, plots are only drawn when asked for, and shown by show_figures after the search
+        if (self.show_plots):
+            import matplotlib.pyplot as plt
+            plt.figure()
+            plt.plot([i for i in range(len(self.data))], self.data['max'], label='Max Solar ({})'.format(k_list[index_min_rmse]))
+            plt.plot([i for i in range(len(self.data))], self.data['solar'], label='Solar')
+            plt.legend()
+            plt.title('Graph with K')
         ##########################################################################
 
-        return k_list[index_min_rmse]
+        return float(k_list[index_min_rmse])
+
+    def set_search_schedule(self, search_mode='exhaustive', max_rounds=10, k_convergence=0.05, 
+                            tilt_convergence=0.05, ori_convergence=0.5, coarse=10, 
+                            k_search='grid', k_resolution=0.1, k_max=100):
+
+        # 'exhaustive' sweeps every k, orientation and tilt of the grids for max_rounds rounds, 
+        # 'coarse_to_fine' sweeps every coarse-th candidate and then only the candidates around the 
+        # best one, and stops once two successive rounds agree within the convergence tolerances
+        # (k, and degrees for tilt and orientation). The k candidates are the multiples of k_resolution 
+        # below k_max, 'grid' searches them with the search mode, while 'bisection' finds the smallest 
+        # feasible k by bisection and then the best rmse above it
+        if (search_mode not in ['exhaustive', 'coarse_to_fine']):
+            raise ValueError('unknown search mode {}.'.format(search_mode))
+        if (k_search not in ['grid', 'bisection']):
+            raise ValueError('unknown k search {}.'.format(k_search))
+
+        self.search_mode = search_mode
+        self.max_rounds = max_rounds
+        self.k_convergence = k_convergence
+        self.tilt_convergence = tilt_convergence
+        self.ori_convergence = ori_convergence
+        self.search_coarse = coarse
+        self.k_search = k_search
+        self.k_resolution = k_resolution
+        self.k_max = k_max
+
+    def search_grid(self, objective, candidates, parameter, cyclic=False, bisection=False):
+
+        # index and value of the best (first minimum) candidate of a grid, the objective returns the
+        # rmse of an array of candidate indices, the evaluations are counted and reported to the 
+        # candidate_evaluated hooks, and the search is timed as the <parameter>_search stage
+        def evaluate(indices):
+            values = objective(indices)
+            self.instrumentation.emit('candidate_evaluated', parameter=parameter, candidates=candidates[indices], values=values)
+            return values
+
+        with self.instrumentation.stage(parameter + '_search'):
+            if (bisection):
+                index, value, evaluations = bisection_search(evaluate, len(candidates))
+            elif (self.search_mode == 'coarse_to_fine'):
+                index, value, evaluations = coarse_to_fine(evaluate, len(candidates), coarse=self.search_coarse, cyclic=cyclic)
+            else:
+                values = evaluate(np.arange(len(candidates)))
+                index, value, evaluations = int(np.argmin(values)), np.min(values), len(candidates)
+
+        self.evaluations += evaluations
+        self.instrumentation.count(parameter + '_evaluations', evaluations)
+        return index, value
+
+    def get_compact_data(self):
+
+        # float32 columns of the (preprocessed) data for the compact mode, copied once
+        if (self.columns == None):
+            self.columns = CompactData(self.data)
+        return self.columns
+
+    def get_basis(self):
+
+        # plane of array basis of the (preprocessed) data, computed once and shared by the searches
+        if (self.basis == None and self.compact):
+            columns = self.get_compact_data()
+            self.basis = PlaneOfArrayBasis(clearsky=columns.clearsky, sun_zenith=columns.sun_zenith,
+                            sun_azimuth=columns.sun_azimuth, solar=columns.solar, dtype=columns.dtype, 
+                            workspace=columns.workspace)
+        elif (self.basis == None):
+            self.basis = PlaneOfArrayBasis(clearsky=self.data['clearsky'], 
+                            sun_zenith=pd.to_numeric(self.data['sun_zenith']), 
+                            sun_azimuth=pd.to_numeric(self.data['sun_azimuth']), solar=self.data['solar'])
+        return self.basis
 
     def find_ori(self, k_, tilt_, iter_):
 
         # initialize
-        ori_flag = False
-        rmse_list = []
-        ori_list = []
         ori_tolerance = 1
-        
-        for ori_ in np.arange(0, math.radians(360), math.radians(1)):
-
-            # compute maximum power generation for the given parameters
-            self.data['max'] = self.data['clearsky'] * k_ * (
-                np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.sin(tilt_)
-                *np.cos(pd.to_numeric(self.data['sun_azimuth'])-ori_) 
-                +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.cos(tilt_))
+        ori_list = np.arange(0, math.radians(360), math.radians(1))
 
-            # count the times when max is less than solar
-            count = len(self.data[self.data['max'] < self.data['solar']])
-
-            ##########################################################################
-            # debug code
-            # if ((ori_ % math.radians(40) == 0)):
-            #     plt.plot([i for i in range(len(self.data))], self.data['max'], label='Max Solar')
-            #     plt.plot([i for i in range(len(self.data))], self.data['solar'], label='Solar')
-            #     plt.legend()
-            #     plt.show()  
-            ##########################################################################
+        # count the times when max is less than solar, and the rmse, of the orientations at once
+        def objective(indices):
+            count, rmse_list = self.get_basis().evaluate(k_, tilt_, ori_list[indices])
 
             # check if count > tolerance
-            if iter_ < 1: 
-                ori_list.append(ori_)
-                rmse_ = np.sqrt(metrics.mean_squared_error(self.data['solar'], self.data['max']))
-                rmse_list.append(rmse_)
-                ori_flag = True
-            else: 
-                if count <= ori_tolerance:
-                    ori_list.append(ori_)
-                    rmse_ = np.sqrt(metrics.mean_squared_error(self.data['solar'], self.data['max']))
-                    rmse_list.append(rmse_)
-                    ori_flag = True
-                    ### debug code 
-                    # print("Ori: ", ori_, ", RMSE: ", rmse_) 
-                else: 
-                    ori_list.append(ori_)
-                    rmse_list.append(np.inf)
-                    ### debug code 
-                    # print("Ori: ", ori_, ", RMSE: ", np.inf) 
+            if iter_ >= 1: 
+                rmse_list = np.where(count <= ori_tolerance, rmse_list, np.inf)
+            return rmse_list
+
+        index_min_rmse, minimum_rmse = self.search_grid(objective, ori_list, 'ori', cyclic=True)
             
         # if we could find the parameters
-        if(ori_flag == True):      
-            minimum_rmse = min(rmse_list)
-            index_min_rmse = rmse_list.index(minimum_rmse)
-        else:
+        if (minimum_rmse == np.inf):
             return math.radians(180)
-
-        ##########################################################################
-        # print(k_list[index_min_rmse])
-
-        # # debug code
-        # self.data['max'] = self.data['clearsky'] * k_ *(
-        #     np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-        #     *np.sin(tilt_)
-        #     *np.cos(pd.to_numeric(self.data['sun_azimuth'])-ori_list[index_min_rmse]) 
-        #     +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-        #     *np.cos(tilt_))
-        
-        # ## debug code
-        # plt.plot([i for i in range(len(self.data))], self.data['max'], label='Max Solar (Ori)')
-        # plt.plot([i for i in range(len(self.data))], self.data['solar'], label='Solar')
-        # plt.show()  
-        ##########################################################################
             
         return ori_list[index_min_rmse]
 
     def find_tilt(self, k_, ori_, latitude, iter_):
 
         # initialize
-        tilt_flag = False
-        rmse_list = []
-        tilt_list = []
         tilt_tolerance = 1
-        
-        for tilt_ in np.arange(math.radians(latitude - 20), math.radians(latitude + 20), math.radians(0.1)):
+        tilt_list = np.arange(math.radians(latitude - 20), math.radians(latitude + 20), math.radians(0.1))
 
-            # compute maximum power generation for the given parameters
-            self.data['max'] = self.data['clearsky'] * k_ *(
-                np.cos(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.sin(tilt_)
-                *np.cos(pd.to_numeric(self.data['sun_azimuth'])-ori_) 
-                +np.sin(math.radians(90)-pd.to_numeric(self.data['sun_zenith']))
-                *np.cos(tilt_))
-
-            # count the times when max is less than solar
-            count = len(self.data[self.data['max'] < self.data['solar']])
+        # count the times when max is less than solar, and the rmse, of the tilts at once
+        def objective(indices):
+            count, rmse_list = self.get_basis().evaluate(k_, tilt_list[indices], ori_)
 
             # check if count > tolerance
-            if iter_ < 1:
-                tilt_list.append(tilt_)
-                rmse_ = np.sqrt(metrics.mean_squared_error(self.data['solar'], self.data['max']))
-                rmse_list.append(rmse_)
-                tilt_flag = True
-            else:
-                if count <= tilt_tolerance:
-                    tilt_list.append(tilt_)
-                    rmse_ = np.sqrt(metrics.mean_squared_error(self.data['solar'], self.data['max']))
-                    rmse_list.append(rmse_)
-                    tilt_flag = True
-                else: 
-                    tilt_list.append(tilt_)
-                    rmse_list.append(np.inf)
+            if iter_ >= 1:
+                rmse_list = np.where(count <= tilt_tolerance, rmse_list, np.inf)
+            return rmse_list
+
+        index_min_rmse, minimum_rmse = self.search_grid(objective, tilt_list, 'tilt')
             
         # if we could find the parameters
-        if(tilt_flag == True):      
-            minimum_rmse = min(rmse_list)
-            index_min_rmse = rmse_list.index(minimum_rmse)
-        else:
+        if (minimum_rmse == np.inf):
             return math.radians(latitude)
         
         return tilt_list[index_min_rmse]
 
+    def show_figures(self):
+
+        # show the debug plots drawn during the search, if any
+        if (self.show_plots):
+            import matplotlib.pyplot as plt
+            plt.show()
+
     def find_temp_coefficients(self, k_, tilt_, ori_):
         
         # to be implemented in the future release
@@ -407,8 +463,33 @@ class ParameterModeling:
 
 if __name__ == "__main__":
 
-    # read user input from command line
+    # read user input from command line, the site elevation can be given as "--elevation meters" or "--dem raster_file",
+    # and "--weather-archive path" reads the weather from a local archive instead of the web
     user_args = sys.argv
+    elevation, dem_file = pop_option(user_args, '--elevation'), pop_option(user_args, '--dem')
+    weather_archive = pop_option(user_args, '--weather-archive')
+
+    # "--search coarse_to_fine" refines the parameters coarse to fine and stops once they converge
+    search_mode = pop_option(user_args, '--search', 'exhaustive')
+
+    # "--k-search bisection" finds k by bisection, and "--k-resolution step" sets the k step (default 0.1)
+    k_search = pop_option(user_args, '--k-search', 'grid')
+    k_resolution = float(pop_option(user_args, '--k-resolution', 0.1))
+
+    # "--profile report.json" writes the stage timers and peak memory as JSON ('-' for stderr), 
+    # and "--plot" shows the debug plots of the search once it is done
+    profile = pop_option(user_args, '--profile')
+
+    # "--timezone name" skips the timezone lookup of the location
+    timezone = pop_option(user_args, '--timezone')
+    plot = '--plot' in user_args
+    if (plot):
+        user_args.remove('--plot')
+
+    # "--compact" runs the search on float32 columns in preallocated buffers, to reduce the memory
+    compact = '--compact' in user_args
+    if (compact):
+        user_args.remove('--compact')
 
     # if user input only 4 arguments, expect arguments from the pipeline
     if (len(user_args) >= 4):
@@ -417,7 +498,15 @@ if __name__ == "__main__":
         print("Please input latitude, longitude, and historical generation data file.")
 
     # initialize the file name, latitude, and longitude
-    parameters = ParameterModeling(latitude=lat, longitude=lon, data_file=file_)
+    parameters = ParameterModeling(latitude=lat, longitude=lon, data_file=file_, timezone=timezone)
+    if (elevation != None or dem_file != None):
+        parameters.set_elevation(elevation=elevation, dem_file=dem_file)
+    if (weather_archive != None):
+        parameters.temperature_source, parameters.weather_archive = 'archive', weather_archive
+    parameters.set_search_schedule(search_mode=search_mode, k_search=k_search, k_resolution=k_resolution)
+    parameters.instrumentation = Instrumentation(trace_memory=(profile != None))
+    parameters.show_plots = plot
+    parameters.compact = compact
 
     # gather sun position, clearsky, and temperature data at the start
     parameters.get_onetime_data()
@@ -439,4 +528,10 @@ if __name__ == "__main__":
 
     t_base, c_ = parameters.find_temp_coefficients(k_, tilt_, ori_)
 
-    print(lat, lon, k_/0.18, tilt_, ori_, c_, t_base)
\ No newline at end of file
+    with parameters.instrumentation.stage('output'):
+        print(lat, lon, k_/0.18, tilt_, ori_, c_, t_base)
+        sys.stdout.flush()
+
+    if (profile != None):
+        parameters.instrumentation.write_report(profile)
+    parameters.show_figures()
\ No newline at end of file
@@ -0,0 +1,110 @@
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+
+# binary framing of the tables passed between the solar-tk scripts through a pipe (e.g. from
+# maximum_generation.py to weather_adjusted.py), instead of the CSV text: the stream starts with
+# the magic bytes and a stream header, then each chunk of the table is a frame
+#   stream header  MAGIC, uint32 length, JSON {"version": 1, "metadata": {...}} (e.g. the site location)
+#   frame          uint32 length, JSON {"rows": n, "columns": [{"name": ..., "dtype": ...}, ...]},
+#                  then the raw little-endian values of each column (n values at a time)
+# and it ends with the end of the stream. Timezone aware times are written as UTC datetime64[ns]
+# (like the .npy writer), and readers tell the binary stream from CSV text by the magic bytes
+
+MAGIC = b'\x93SOLARTK'
+VERSION = 1
+
+
+# function to check whether the first bytes of a stream are the magic bytes of the binary framing
+def is_pipe_format(prefix):
+    return prefix[:len(MAGIC)] == MAGIC
+
+
+def write_header(stream, header):
+    header = json.dumps(header).encode()
+    stream.write(struct.pack('<I', len(header)))
+    stream.write(header)
+
+
+def read_header(stream):
+
+    # the next JSON header of the stream, or None at the end of the stream
+    length = stream.read(4)
+    if (len(length) == 0):
+        return None
+    if (len(length) < 4):
+        raise ValueError('the binary stream ends in the middle of a frame.')
+
+    header = read_exactly(stream, struct.unpack('<I', length)[0])
+    return json.loads(header.decode())
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if (len(data) < size):
+        raise ValueError('the binary stream ends in the middle of a frame.')
+    return data
+
+
+# writer of the binary framing, with the interface of the writers of writers.py
+class PipeWriter:
+
+    # a constructor to write the stream header to a binary file object (e.g. sys.stdout.buffer)
+    def __init__(self, stream=None, metadata=None):
+
+        self.stream = stream
+        self.stream.write(MAGIC)
+        write_header(self.stream, {'version': VERSION, 'metadata': {} if metadata is None else metadata})
+        self.stream.flush()
+
+    def write(self, chunk):
+
+        columns = []
+        for name in chunk.columns:
+            values = chunk[name]
+            if (isinstance(values.dtype, pd.DatetimeTZDtype)):
+                values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+            values = values.to_numpy()
+            columns.append((str(name), values.astype(values.dtype.newbyteorder('<'), copy=False)))
+
+        write_header(self.stream, {'rows': len(chunk), 'columns': [{'name': name, 'dtype': np.lib.format.dtype_to_descr(values.dtype)}
+                                                                  for name, values in columns]})
+        for _, values in columns:
+            self.stream.write(np.ascontiguousarray(values).tobytes())
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# function to read a binary stream whose magic bytes were already read, it returns the metadata
+# and the dataframe of all the frames
+def read_pipe(stream):
+
+    header = read_header(stream)
+    if (header is None or header.get('version') != VERSION):
+        raise ValueError('unsupported binary stream version.')
+    metadata = header['metadata']
+
+    frames = []
+    while (True):
+        header = read_header(stream)
+        if (header is None):
+            break
+        rows = header['rows']
+        frame = {}
+        for column in header['columns']:
+            dtype = np.lib.format.descr_to_dtype(column['dtype'])
+            frame[column['name']] = np.frombuffer(read_exactly(stream, rows * dtype.itemsize), dtype=dtype)
+        frames.append(pd.DataFrame(frame))
+
+    data = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame()
+    return metadata, data
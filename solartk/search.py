@@ -0,0 +1,253 @@
+import math
+import numpy as np
+import pandas as pd
+
+
+# vectorized kernels of the parameter search in parameters.py: instead of rebuilding the
+# maximum generation column and grouping it by day for every candidate, the candidates are
+# evaluated together on numpy arrays, a block of candidates at a time
+
+# number of (candidate, time) values evaluated at once, which bounds the memory of a block
+block_elements = 2**22
+
+
+# function to get the offsets of the runs of equal consecutive keys, e.g. the
+# days of a time series sorted by time, as used by np.add.reduceat
+def segment_offsets(keys):
+
+    keys = np.asarray(keys)
+    if (len(keys) == 0):
+        return np.array([], dtype=np.int64)
+
+    return np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])).astype(np.int64)
+
+
+# function to compute the plane of array term of the maximum generation model for the
+# given tilt and orientation (radians), same expression as the one in parameters.py
+def plane_of_array(sun_zenith, sun_azimuth, tilt, ori):
+    return (np.cos(math.radians(90)-sun_zenith)
+            *np.sin(tilt)
+            *np.cos(sun_azimuth-ori)
+            +np.sin(math.radians(90)-sun_zenith)
+            *np.cos(tilt))
+
+
+# scratch buffers of the kernels, preallocated once and reused by every block and every call
+# (a buffer is only reallocated when a larger one or another dtype is needed)
+class Workspace:
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype):
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if (buffer is None or buffer.dtype != dtype or buffer.size < size):
+            buffer = self.buffers[name] = np.empty(size, dtype)
+        return buffer[:size].reshape(shape)
+
+
+# compact columnar copy of the search columns of a (preprocessed, time sorted) dataframe: contiguous
+# float32 arrays of clearsky, solar, sun zenith and azimuth and temperature, an int32 day index
+# (0 for the first day) with the offsets of the days, and the workspace of the kernels
+class CompactData:
+
+    # a constructor to copy the columns of a dataframe with date, clearsky, solar, sun_zenith, sun_azimuth and temperature
+    def __init__(self, data, dtype=np.float32):
+
+        self.dtype = np.dtype(dtype)
+        self.clearsky = np.ascontiguousarray(data['clearsky'], dtype=self.dtype)
+        self.solar = np.ascontiguousarray(data['solar'], dtype=self.dtype)
+        self.sun_zenith = np.ascontiguousarray(pd.to_numeric(data['sun_zenith']), dtype=self.dtype)
+        self.sun_azimuth = np.ascontiguousarray(pd.to_numeric(data['sun_azimuth']), dtype=self.dtype)
+        self.temperature = np.ascontiguousarray(data['temperature'], dtype=self.dtype)
+
+        offsets = segment_offsets(data['date'].values)
+        self.day = np.zeros(len(self.solar), dtype=np.int32)
+        self.day[offsets[1:]] = 1
+        self.day = np.cumsum(self.day, dtype=np.int32)
+        self.offsets = offsets
+
+        self.workspace = Workspace()
+
+    def __len__(self):
+        return len(self.solar)
+
+    def nbytes(self):
+        return sum(array.nbytes for array in [self.clearsky, self.solar, self.sun_zenith, self.sun_azimuth,
+                                              self.temperature, self.day, self.offsets])
+
+
+# function to evaluate the candidate capacities k of the model max = clearsky * k * poa, it
+# counts the upper limit violations (max < solar) of each segment (day) and returns, for each
+# candidate, the rmse between max and solar if no segment has more violations than the
+# tolerance, and inf otherwise. The values are computed in the dtype of the arrays (float32 arrays
+# stay float32, the squared errors are summed in float64) in the buffers of the workspace
+def evaluate_k(clearsky, poa, solar, offsets, k_values, tolerance, workspace=None):
+
+    clearsky, poa, solar = np.asarray(clearsky), np.asarray(poa), np.asarray(solar)
+    dtype = np.promote_types(np.result_type(clearsky, poa, solar), np.float32)
+    clearsky, poa, solar = clearsky.astype(dtype, copy=False), poa.astype(dtype, copy=False), solar.astype(dtype, copy=False)
+    k_values = np.asarray(k_values, dtype)
+    workspace = Workspace() if workspace is None else workspace
+    rmse = np.empty(len(k_values))
+
+    # reduceat casts the whole block of violations to the count type, so the narrowest integer
+    # type that holds the longest segment is used
+    longest = np.max(np.diff(np.append(offsets, len(solar)))) if len(offsets) > 0 else 0
+    count_dtype = np.int16 if longest < 2**15 else np.int64
+
+    block_size = max(1, block_elements // max(1, len(solar)))
+    for block in range(0, len(k_values), block_size):
+        k_ = k_values[block:block+block_size, np.newaxis]
+
+        # maximum generation of every candidate of the block, in the order (clearsky * k) * poa
+        maximum = workspace.get('maximum', (len(k_), len(solar)), dtype)
+        np.multiply(clearsky, k_, out=maximum)
+        maximum *= poa
+
+        # violations of each day
+        violations = np.less(maximum, solar, out=workspace.get('violations', maximum.shape, bool))
+        count = np.add.reduceat(violations, offsets, axis=1, dtype=count_dtype)
+
+        # rmse of the candidates, the maximum buffer is reused for the squared errors
+        error = np.subtract(solar, maximum, out=maximum)
+        error = np.sqrt(np.mean(np.square(error, out=error), axis=1, dtype=np.float64))
+
+        rmse[block:block+block_size] = np.where((count > tolerance).any(axis=1), np.inf, error)
+
+    return rmse
+
+
+# plane of array kernel of the tilt and orientation search: since cos(azimuth - ori) expands to
+# cos(azimuth)cos(ori) + sin(azimuth)sin(ori), the clearsky weighted plane of array term is a
+# linear combination of three basis columns that only depend on the site and the times,
+#   clearsky * poa = sin(tilt)cos(ori) * B1 + sin(tilt)sin(ori) * B2 + cos(tilt) * B3
+# with B1 = clearsky cos(90-zenith)cos(azimuth), B2 = clearsky cos(90-zenith)sin(azimuth) and
+# B3 = clearsky sin(90-zenith), so a batch of candidates is evaluated as one matrix product
+class PlaneOfArrayBasis:
+
+    # a constructor to precompute the basis columns (3 x times) of a site, in float64 or, for the
+    # compact mode, float32 (the columns are computed in float64 first), and the workspace of its buffers
+    def __init__(self, clearsky=None, sun_zenith=None, sun_azimuth=None, solar=None, dtype=float, workspace=None):
+
+        clearsky, solar = np.asarray(clearsky, float), np.asarray(solar, float)
+        sun_zenith, sun_azimuth = np.asarray(sun_zenith, float), np.asarray(sun_azimuth, float)
+
+        horizontal = clearsky * np.cos(math.radians(90)-sun_zenith)
+        self.basis = np.vstack([horizontal * np.cos(sun_azimuth),
+                                horizontal * np.sin(sun_azimuth),
+                                clearsky * np.sin(math.radians(90)-sun_zenith)]).astype(dtype, copy=False)
+        self.solar = solar.astype(dtype, copy=False)
+        self.workspace = Workspace() if workspace is None else workspace
+
+    def __len__(self):
+        return len(self.solar)
+
+    # function to get the basis coefficients (candidates x 3) of the given tilts and orientations (radians)
+    def coefficients(self, tilt, ori):
+        tilt, ori = np.broadcast_arrays(np.atleast_1d(np.asarray(tilt, float)), np.atleast_1d(np.asarray(ori, float)))
+        return np.stack([np.sin(tilt)*np.cos(ori), np.sin(tilt)*np.sin(ori), np.cos(tilt)], axis=1)
+
+    # function to compute the maximum generation (candidates x times) of the given k, tilts and orientations
+    def maximum(self, k, tilt, ori):
+        k = np.asarray(k, float)
+        return np.atleast_1d(k)[:, np.newaxis] * (self.coefficients(tilt, ori) @ self.basis)
+
+    # function to evaluate a batch of (k, tilt, orientation) candidates, the arguments are broadcast
+    # together, and return, for every candidate, the number of upper limit violations (max < solar)
+    # and the rmse between max and solar, computed in the buffers of the basis workspace
+    def evaluate(self, k, tilt, ori):
+
+        k, tilt, ori = np.broadcast_arrays(np.atleast_1d(np.asarray(k, float)), np.atleast_1d(np.asarray(tilt, float)),
+                                           np.atleast_1d(np.asarray(ori, float)))
+        count = np.empty(len(k), dtype=np.int64)
+        rmse = np.empty(len(k))
+        dtype = self.basis.dtype
+
+        block_size = max(1, block_elements // max(1, len(self.solar)))
+        for block in range(0, len(k), block_size):
+            candidates = slice(block, block+block_size)
+
+            # maximum generation k * (coefficients @ basis) of the candidates of the block
+            coefficients = self.coefficients(tilt[candidates], ori[candidates]).astype(dtype, copy=False)
+            maximum = self.workspace.get('maximum', (len(coefficients), len(self.solar)), dtype)
+            np.matmul(coefficients, self.basis, out=maximum)
+            maximum *= k[candidates].astype(dtype, copy=False)[:, np.newaxis]
+
+            violations = np.less(maximum, self.solar, out=self.workspace.get('violations', maximum.shape, bool))
+            count[candidates] = np.count_nonzero(violations, axis=1)
+
+            error = np.subtract(self.solar, maximum, out=maximum)
+            rmse[candidates] = np.sqrt(np.mean(np.square(error, out=error), axis=1, dtype=np.float64))
+
+        return count, rmse
+
+
+# function to search a grid of candidates coarse to fine: the objective (a function of an array of
+# candidate indices that returns their values, inf for infeasible candidates) is evaluated on every
+# coarse-th candidate, then on the candidates within one coarse step of the best one (wrapping around
+# for cyclic grids, e.g. orientations), and the index and value of the best candidate and the 
+# number of evaluations are returned. The grid is evaluated exhaustively when no coarse candidate is feasible
+def coarse_to_fine(objective, size, coarse=10, cyclic=False):
+
+    indices = np.arange(0, size, max(1, coarse))
+    values = objective(indices)
+
+    if (np.isinf(values).all()):
+        indices = np.arange(size)
+        values = objective(indices)
+        return int(np.argmin(values)), np.min(values), len(indices)
+
+    best = indices[np.argmin(values)]
+    fine = np.arange(best - coarse + 1, best + coarse)
+    fine = np.unique(fine % size) if cyclic else fine[(fine >= 0) & (fine < size)]
+    fine = np.setdiff1d(fine, indices)
+
+    # the best of all the evaluated candidates, the first one (lowest index) on ties
+    indices = np.concatenate([indices, fine])
+    values = np.concatenate([values, objective(fine)])
+    order = np.lexsort((indices, values))
+
+    return int(indices[order[0]]), values[order[0]], len(indices)
+
+
+# function to search a grid of candidates whose feasibility is monotone (infeasible candidates
+# first, then feasible ones, as for k since the maximum generation grows with it) and whose
+# objective is convex over the feasible ones (the rmse is quadratic in k), the objective is a
+# function of an array of candidate indices that returns their values, inf for infeasible ones.
+# The feasibility boundary is found by bisection, then the first minimum above it by bisection
+# on the sign of the differences, in O(log size) evaluations. It returns the index and value of
+# the best candidate, the first one (with an inf value) if none is feasible, and the number of evaluations
+def bisection_search(objective, size):
+
+    values = {}
+    def value(indices):
+        missing = [index for index in indices if index not in values]
+        if (len(missing) > 0):
+            values.update(zip(missing, objective(np.array(missing))))
+        return [values[index] for index in indices]
+
+    # first feasible candidate
+    lower, upper = 0, size
+    while (lower < upper):
+        middle = (lower + upper) // 2
+        if (np.isinf(value([middle])[0])):
+            lower = middle + 1
+        else:
+            upper = middle
+
+    if (lower == size):
+        return 0, value([0])[0], len(values)
+
+    # first candidate above the boundary that is not larger than its successor
+    upper = size - 1
+    while (lower < upper):
+        middle = (lower + upper) // 2
+        current, following = value([middle, middle + 1])
+        if (following >= current):
+            upper = middle
+        else:
+            lower = middle + 1
+
+    return lower, value([lower])[0], len(values)
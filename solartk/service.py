@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+import collections
+import socketserver
+import http.server
+import concurrent.futures
+import pytz
+import numpy as np
+import pandas as pd
+
+from parameters import ParameterModeling
+from maximum_generation import GenerationPotential
+from fleet_generation import FleetGenerationPotential
+from weather_adjusted import WeatherAdjustedGeneration
+from sunpos import Ephemeris
+from sunpos_cache import SunPositionCache, default_sun_position_cache
+from clearsky_cache import ClearskyCache
+from elevation import ConstantElevation, default_elevation_provider
+from timezones import get_resolver
+from helpers import granularity_to_freq, localize
+
+
+# long-running local service: one process keeps the scientific stack imported and its state warm
+# (timezone resolver, sun position tables, clearsky cache, ephemerides, weather archive index,
+# elevation lookups) and answers JSON requests over HTTP, on a TCP port or a Unix socket:
+#   POST /maximum_generation  site parameters (or arrays of them for a fleet) and a time range
+#   POST /weather_adjusted    location and maximum generation times and values
+#   POST /parameters          location and generation data (time and solar arrays, or a csv path in --data-dir)
+#   GET  /stats               request counts and latencies of each endpoint, and cache statistics
+#   GET  /health
+# the requests are computed by a pool of worker threads that share the warm state
+
+
+# clearsky cache shared by the worker threads, its segments are only used under a lock
+class SharedClearskyCache(ClearskyCache):
+
+    def __init__(self, max_points=10**7, decimals=4):
+        ClearskyCache.__init__(self, max_points=max_points, decimals=decimals)
+        self.lock = threading.RLock()
+
+    def get_clearsky_irradiance(self, **kwargs):
+        with self.lock:
+            return ClearskyCache.get_clearsky_irradiance(self, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return ClearskyCache.stats(self)
+
+
+# request counts and latencies (milliseconds) of each endpoint, the percentiles are computed over
+# the last window requests
+class LatencyStats:
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.endpoints = collections.OrderedDict()
+
+    def record(self, endpoint, seconds, error=False):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {'requests': 0, 'errors': 0, 'total_ms': 0.0,
+                                                         'latencies': collections.deque(maxlen=self.window)})
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['total_ms'] += seconds * 1000
+            stats['latencies'].append(seconds * 1000)
+
+    def report(self):
+        with self.lock:
+            report = collections.OrderedDict()
+            for endpoint, stats in self.endpoints.items():
+                latencies = np.array(stats['latencies'])
+                report[endpoint] = {'requests': stats['requests'], 'errors': stats['errors'],
+                                    'mean_ms': stats['total_ms'] / stats['requests'],
+                                    'p50_ms': float(np.percentile(latencies, 50)),
+                                    'p95_ms': float(np.percentile(latencies, 95)),
+                                    'p99_ms': float(np.percentile(latencies, 99)),
+                                    'max_ms': float(np.max(latencies))}
+            return report
+
+
+# error of a request that the client has to fix (400), the other errors are server errors (500), 
+# so the request fields are checked and converted where they are read
+class RequestError(ValueError):
+    pass
+
+
+# function to convert an array to a JSON list, with null for nan
+def json_list(values):
+    values = np.asarray(values, dtype=float)
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+# function to format times as JSON strings, the same format as the CSV output
+def json_times(times):
+    return [str(time) for time in pd.DatetimeIndex(times)]
+
+# function to read a "%Y-%m-%d %H:%M:%S" time of a request
+def parse_time(request, name):
+    try:
+        return datetime.datetime.strptime(request[name], "%Y-%m-%d %H:%M:%S")
+    except KeyError:
+        raise RequestError('the request has no {}.'.format(name))
+    except (TypeError, ValueError):
+        raise RequestError('{} must be a "%Y-%m-%d %H:%M:%S" time.'.format(name))
+
+# function to read a required field of a request
+def field(request, name):
+    if (name not in request):
+        raise RequestError('the request has no {}.'.format(name))
+    return request[name]
+
+# function to read a number of a request, a required one if there is no default
+def number(request, name, default=None, type=float):
+    value = field(request, name) if default is None else request.get(name, default)
+    try:
+        return type(value)
+    except (TypeError, ValueError):
+        raise RequestError('{} must be a number.'.format(name))
+
+# function to read a number or an array of numbers (one per site) of a request
+def numbers(request, name, default=None):
+    value = field(request, name) if default is None else request.get(name, default)
+    try:
+        return np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        raise RequestError('{} must be a number or an array of numbers.'.format(name))
+
+# function to read the timezone name of a request, None if it is looked up from the location
+def timezone_name(request):
+    name = request.get('timezone')
+    if (name is None):
+        return None
+    try:
+        pytz.timezone(name)
+    except (pytz.UnknownTimeZoneError, AttributeError):
+        raise RequestError('unknown timezone {}.'.format(name))
+    return name
+
+# function to call a setter or constructor of a model, its explicit validation errors 
+# (the 'please specify' ValueErrors) are errors of the request
+def validated(function, *args, **kwargs):
+    try:
+        return function(*args, **kwargs)
+    except ValueError as e:
+        raise RequestError(str(e))
+
+# function to read the time array and the values array of the given name of a request, as a
+# data frame of time and the values
+def time_series(request, name):
+    times, values = field(request, 'time'), field(request, name)
+    if (not isinstance(times, list) or not isinstance(values, list) or len(times) != len(values) or len(times) < 2):
+        raise RequestError('time and {} must be arrays of the same length, of at least 2.'.format(name))
+    try:
+        return pd.DataFrame({'time': pd.to_datetime(times), name: np.asarray(values, dtype=float)})
+    except (TypeError, ValueError):
+        raise RequestError('time must be an array of times and {} an array of numbers.'.format(name))
+
+
+class SolarService:
+
+    # a constructor to initialize the warm state shared by the requests and the worker pool
+    def __init__(self, workers=4, weather_archive=None, elevation=None, dem_file=None, cache_dir=None, max_ephemerides=32,
+                 data_dir=None):
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        self.started = time.time()
+
+        # weather from a local archive (see weather_archive.py), or from the web sources
+        self.weather_archive = weather_archive
+        self.temperature_source = 'darksky' if weather_archive is None else 'archive'
+
+        # directory of the csv files that /parameters requests may name, no csv files are read without it
+        self.data_dir = None if data_dir is None else os.path.realpath(data_dir)
+
+        self.timezone_resolver = get_resolver()
+        if (cache_dir is not None):
+            self.sun_position_cache = SunPositionCache(directory=cache_dir)
+        else:
+            self.sun_position_cache = default_sun_position_cache()
+        self.clearsky_cache = SharedClearskyCache()
+        if (elevation is not None):
+            self.elevation_provider = ConstantElevation(elevation)
+        else:
+            self.elevation_provider = default_elevation_provider(dem_file=dem_file)
+
+        # ephemerides of the recent fleet time grids, least recently used first
+        self.ephemerides = collections.OrderedDict()
+        self.max_ephemerides = max_ephemerides
+        self.ephemerides_lock = threading.Lock()
+
+        self.stats = LatencyStats()
+        self.endpoints = {'/maximum_generation': self.maximum_generation, '/weather_adjusted': self.weather_adjusted,
+                          '/parameters': self.parameters}
+
+    def handle(self, path, request):
+
+        # compute a request in the worker pool, and return the HTTP status and the JSON response,
+        # the latency includes the time spent waiting for a worker
+        start = time.perf_counter()
+        status = 200
+        try:
+            if (path == '/stats'):
+                response = self.report()
+            elif (path == '/health'):
+                response = {'status': 'ok'}
+            elif (path in self.endpoints):
+                response = self.executor.submit(self.endpoints[path], request).result()
+            else:
+                status, response = 404, {'error': 'unknown endpoint {}.'.format(path)}
+        except RequestError as e:
+            status, response = 400, {'error': '{}: {}'.format(type(e).__name__, e)}
+        except Exception as e:
+            status, response = 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+
+        if (path in self.endpoints):
+            self.stats.record(path, time.perf_counter() - start, error=(status != 200))
+
+        return status, response
+
+    def report(self):
+        return {'endpoints': self.stats.report(), 'clearsky_cache': self.clearsky_cache.stats(),
+                'ephemerides': len(self.ephemerides), 'workers': self.workers,
+                'uptime_seconds': time.time() - self.started}
+
+    def get_ephemeris(self, start_time, end_time, granularity, timezone):
+
+        # ephemeris of a local time grid, reused by the requests over the same grid
+        key = (str(timezone), start_time, end_time, granularity)
+        with self.ephemerides_lock:
+            if (key in self.ephemerides):
+                self.ephemerides.move_to_end(key)
+                return self.ephemerides[key]
+
+        start_utc, end_utc = localize(start_time, timezone).astimezone(datetime.timezone.utc), localize(end_time, timezone).astimezone(datetime.timezone.utc)
+        ephemeris = Ephemeris(pd.date_range(start_utc, end_utc, freq=granularity_to_freq(granularity)))
+
+        with self.ephemerides_lock:
+            self.ephemerides[key] = ephemeris
+            while (len(self.ephemerides) > self.max_ephemerides):
+                self.ephemerides.popitem(last=False)
+
+        return ephemeris
+
+    def maximum_generation(self, request):
+
+        start_time, end_time = parse_time(request, 'start_time'), parse_time(request, 'end_time')
+        granularity = number(request, 'granularity', 3600)
+        if (granularity <= 0 or end_time < start_time):
+            raise RequestError('please specify a positive granularity, and an end time after the start time.')
+
+        # arrays of site parameters are computed as a fleet (see fleet_generation.py)
+        if (isinstance(field(request, 'latitude'), list)):
+            fleet = validated(FleetGenerationPotential, k=numbers(request, 'k'), tilt=numbers(request, 'tilt'),
+                        orientation=numbers(request, 'orientation'), latitude=numbers(request, 'latitude'),
+                        longitude=numbers(request, 'longitude'), baseline_temperature=numbers(request, 'baseline_temperature', 25),
+                        temperature_coefficient=numbers(request, 'temperature_coefficient', 0.5),
+                        site_ids=request.get('site_ids'), decimals=number(request, 'decimals', 2, type=int))
+            fleet.set_data_sources(clearsky_source=fleet.clearsky_source, temperature_source=self.temperature_source,
+                                   weather_archive=self.weather_archive)
+            fleet.set_timezone(timezone_name(request))
+            timezone = validated(fleet.get_timezone)
+            fleet.set_ephemeris(self.get_ephemeris(start_time, end_time, granularity, timezone))
+            times, max_generation = fleet.maximum_generation(start_time=start_time, end_time=end_time, granularity=granularity)
+
+            return {'site_ids': fleet.site_ids, 'time': json_times(times),
+                    'max_generation': [json_list(row) for row in max_generation]}
+
+        latitude, longitude = number(request, 'latitude'), number(request, 'longitude')
+        gen = validated(GenerationPotential, k=number(request, 'k'), tilt=number(request, 'tilt'),
+                    orientation=number(request, 'orientation'), latitude=latitude, longitude=longitude,
+                    baseline_temperature=number(request, 'baseline_temperature', 25),
+                    temperature_coefficient=number(request, 'temperature_coefficient', 0.5))
+        gen.set_data_sources(clearsky_source=gen.clearsky_source, sun_position_source=gen.sun_position_source,
+                             temperature_source=self.temperature_source, weather_archive=self.weather_archive)
+        gen.set_sun_position_cache(self.sun_position_cache)
+        gen.set_clearsky_cache(self.clearsky_cache)
+        gen.set_timezone(timezone_name(request))
+        max_generation = gen.maximum_generation(start_time=start_time, end_time=end_time, granularity=granularity)
+
+        return {'latitude': latitude, 'longitude': longitude, 'time': json_times(max_generation['#time']),
+                'max_generation': json_list(max_generation['max_generation'])}
+
+    def weather_adjusted(self, request):
+
+        max_generation = time_series(request, 'max_generation')
+
+        weather = validated(WeatherAdjustedGeneration, latitude=number(request, 'latitude'), longitude=number(request, 'longitude'))
+        weather.set_data_sources(weather_source=self.temperature_source, weather_archive=self.weather_archive)
+        if (request.get('seed') is not None):
+            weather.set_seed(number(request, 'seed', type=int))
+
+        adjusted = weather.compute_adjusted_generation(max_generation=max_generation)
+
+        return {'time': json_times(adjusted['#time']), 'adjusted_generation': json_list(adjusted['adjusted_generation'])}
+
+    def parameters(self, request):
+
+        # generation data as time and solar arrays, or the path of a csv file in the data directory
+        if ('csv' in request):
+            data_file, data = self.data_file(request['csv']), None
+        else:
+            data_file, data = None, time_series(request, 'solar')
+
+        parameters = validated(ParameterModeling, latitude=number(request, 'latitude'), longitude=number(request, 'longitude'),
+                               data_file=data_file, timezone=timezone_name(request), data=data)
+        parameters.elevation_provider = self.elevation_provider
+        parameters.set_sun_position_cache(self.sun_position_cache)
+        parameters.temperature_source, parameters.weather_archive = self.temperature_source, self.weather_archive
+        validated(parameters.set_search_schedule, search_mode=request.get('search', 'exhaustive'), k_search=request.get('k_search', 'grid'))
+        parameters.compact = bool(request.get('compact', False))
+
+        # without a weather archive the weather is not fetched from the web (the search itself does not use 
+        # the temperature), and the temperature coefficients are not fitted (null in the response)
+        weather = (self.weather_archive is not None)
+        parameters.get_onetime_data(weather=weather)
+        parameters.preprocess_data()
+        k_, tilt_, ori_ = parameters.find_parameters()
+        t_base, c_ = parameters.find_temp_coefficients(k_, tilt_, ori_) if weather else (None, None)
+
+        # k in the same units as the parameters.py output
+        return {'latitude': parameters.lat_, 'longitude': parameters.lon_, 'k': k_/0.18, 'tilt': tilt_,
+                'orientation': ori_, 'temperature_coefficient': c_, 'baseline_temperature': t_base,
+                'rounds': parameters.rounds, 'evaluations': parameters.evaluations}
+
+    def data_file(self, path):
+
+        # the csv path is relative to the data directory, and must resolve (links included) inside it
+        if (self.data_dir is None):
+            raise RequestError('csv files are not accepted, please start the service with --data-dir.')
+        if (not isinstance(path, str)):
+            raise RequestError('csv must be a path.')
+
+        data_file = os.path.realpath(os.path.join(self.data_dir, path))
+        if (os.path.commonpath([self.data_dir, data_file]) != self.data_dir or not os.path.isfile(data_file)):
+            raise RequestError('{} is not a file of the data directory.'.format(path))
+
+        return data_file
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # the service is set on the server
+    def do_GET(self):
+        self.respond(*self.server.service.handle(self.path.split('?')[0], {}))
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if (not isinstance(request, dict)):
+                raise ValueError('the request must be a JSON object.')
+        except ValueError as e:
+            self.respond(400, {'error': 'invalid request: {}'.format(e)})
+            return
+        self.respond(*self.server.service.handle(self.path.split('?')[0], request))
+
+    def respond(self, status, response):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if (self.server.verbose):
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service, host='127.0.0.1', port=8642, unix_socket=None, verbose=False):
+
+    # serve until interrupted, on the unix socket if one is given and on the TCP port otherwise
+    if (unix_socket is not None):
+        if (os.path.exists(unix_socket)):
+            os.remove(unix_socket)
+        server = UnixServer(unix_socket, RequestHandler)
+        address = unix_socket
+    else:
+        server = TCPServer((host, port), RequestHandler)
+        address = 'http://{}:{}'.format(*server.server_address[:2])
+
+    server.service, server.verbose = service, verbose
+    print('serving on {}'.format(address), file=sys.stderr)
+    sys.stderr.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if (unix_socket is not None and os.path.exists(unix_socket)):
+            os.remove(unix_socket)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Serve maximum generation, weather adjusted generation and parameter requests.')
+    parser.add_argument('--host', default='127.0.0.1', help='TCP host (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8642, help='TCP port (default: 8642)')
+    parser.add_argument('--unix-socket', default=None, help='serve on this unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads (default: 4)')
+    parser.add_argument('--weather-archive', default=None, help='local weather archive instead of the web')
+    parser.add_argument('--elevation', type=float, default=None, help='elevation in meters of all the sites')
+    parser.add_argument('--dem', default=None, help='DEM raster file to look up the site elevations')
+    parser.add_argument('--cache-dir', default=None, help='sun position cache directory, enables the sun position tables (see sunpos_cache.py)')
+    parser.add_argument('--data-dir', default=None, help='directory of the csv files that /parameters requests may name')
+    parser.add_argument('--verbose', action='store_true', help='log every request on stderr')
+    args = parser.parse_args()
+
+    service = SolarService(workers=args.workers, weather_archive=args.weather_archive, elevation=args.elevation,
+                           dem_file=args.dem, cache_dir=args.cache_dir, data_dir=args.data_dir)
+    serve(service, host=args.host, port=args.port, unix_socket=args.unix_socket, verbose=args.verbose)
@@ -1,6 +1,6 @@
 import datetime
 import pandas as pd 
-from helpers import granularity_to_freq
+from helpers import granularity_to_freq, time_chunks
 import time
 import numpy as np 
 
@@ -8,26 +8,177 @@ rad = np.pi/180
 dEarthMeanRadius = 6371.01
 dAstronomicalUnit = 149597890
 
-def get_sun_position(start_time=None, end_time=None, granularity=None, latitude=None, longitude=None, sun_position_method='psa'):
+def get_sun_position(start_time=None, end_time=None, granularity=None, latitude=None, longitude=None, sun_position_method='psa', ephemeris=None, cache=None):
 
-    if (sun_position_method=='psa'):
+    # read the sun position from the on-disk table cache if one was given (see sunpos_cache.py)
+    if (cache is not None and ephemeris is None and sun_position_method=='psa'):
+        return cache.get_sun_position(start_time=start_time, end_time=end_time, granularity=granularity, 
+                                      latitude=latitude, longitude=longitude)
+
+    if (sun_position_method=='psa' or sun_position_method=='psa_reference'):
 
         # create a pandas datetimeindex 
         df = pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity))
 
+        # reuse the time-only part of a shared ephemeris if it was given
+        if (ephemeris is not None and sun_position_method=='psa'):
+            ephemeris = ephemeris.between(start_time, end_time)
+            if (not ephemeris.time.equals(df if df.tz is None else df.tz_convert('UTC'))):
+                raise ValueError('the ephemeris times do not match the requested time range and granularity.')
+
         # convert it into a simple dataframe and rename the column
         df = df.to_frame(index=False)
         df.columns = ['time']
 
-        # call sunpos function for each time to get sun azimuth and zenith angles
-        df[['sun_azimuth', 'sun_zenith']] = df['time'].apply(lambda x: sunpos(x, latitude, longitude))
+        if (sun_position_method=='psa'):
+            # compute sun azimuth and zenith angles for all times in one pass
+            if (ephemeris is None):
+                ephemeris = Ephemeris(df['time'])
+            df['sun_azimuth'], df['sun_zenith'] = ephemeris.sun_position(latitude, longitude)
+        else:
+            # call sunpos function for each time to get sun azimuth and zenith angles
+            df[['sun_azimuth', 'sun_zenith']] = df['time'].apply(lambda x: sunpos(x, latitude, longitude))
         
         return df
 
     else: 
         raise ValueError('Invalid argument for sun_position_method variable.')
 
+def iter_sun_position(start_time=None, end_time=None, granularity=None, latitude=None, longitude=None, chunk_size=86400, **kwargs):
+
+    # generate the sun position in consecutive blocks of at most chunk_size times
+    for chunk_start, chunk_end in time_chunks(start_time, end_time, granularity, chunk_size):
+        yield get_sun_position(start_time=chunk_start, end_time=chunk_end, granularity=granularity, 
+                               latitude=latitude, longitude=longitude, **kwargs)
+
+def get_sun_position_multisite(start_time=None, end_time=None, granularity=None, latitudes=None, longitudes=None, ephemeris=None):
+
+    # compute (or reuse) the site-independent part of the algorithm once for all sites
+    if (ephemeris is None):
+        ephemeris = Ephemeris(pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity)))
+    else:
+        ephemeris = ephemeris.between(start_time, end_time)
+
+    # sun azimuth and zenith angles as (sites x times) matrices
+    azimuth, zenith = ephemeris.sun_position(np.asarray(latitudes, dtype=float).reshape(-1, 1), 
+                                             np.asarray(longitudes, dtype=float).reshape(-1, 1))
+
+    return ephemeris.time, azimuth, zenith
+
+def sunpos_array(times, latitude, longitude):
+        # Array version of sunpos below, it evaluates the same PSA algorithm for a whole 
+        # DatetimeIndex (or Series, or integer UTC epoch seconds) and returns the sun 
+        # azimuth and zenith angles in radians as numpy arrays
+        return Ephemeris(times).sun_position(latitude, longitude)
+
+class Ephemeris:
+
+    # the part of the PSA algorithm that only depends on time (julian day, ecliptic and 
+    # celestial coordinates, sidereal time), computed once and shared between sites, the
+    # times are naive UTC, aware (converted to UTC) or integer UTC epoch seconds
+    def __init__(self, times):
+
+        if (not hasattr(times, 'dtype')):
+            times = np.asarray(times)
+        if (pd.api.types.is_integer_dtype(times.dtype)):
+            times = pd.to_datetime(np.asarray(times), unit='s')
+        self.time = pd.DatetimeIndex(times)
+        if (self.time.tz is not None):
+            self.time = self.time.tz_convert('UTC')
+
+        # Calculate time of the day in UT decimal hours
+        dDecimalHours = self.time.hour.values + (self.time.minute.values + self.time.second.values/60)/60
+        # Calculate current Julian Day
+        year = self.time.year.values
+        month = self.time.month.values
+        liAux1 =(month-14)/12
+        liAux2=(1461*(year + 4800 + liAux1))/4 + (367*(month 
+                - 2-12*liAux1))/12- (3*((year + 4900 + liAux1)/100))/4+self.time.day.values-32075
+        dJulianDate=(liAux2)-0.5+dDecimalHours/24.0
+        # Calculate difference between current Julian Day and JD 2451545.0 
+        dElapsedJulianDays = dJulianDate-2451545.0
+
+        # Calculate ecliptic coordinates (ecliptic longitude and obliquity of the 
+        # ecliptic in radians but without limiting the angle to be less than 2*Pi 
+        # (i.e., the result may be greater than 2*Pi)
+        dOmega=2.1429-0.0010394594*dElapsedJulianDays
+        dMeanLongitude = 4.8950630+ 0.017202791698*dElapsedJulianDays # Radians
+        dMeanAnomaly = 6.2400600+ 0.0172019699*dElapsedJulianDays
+        dEclipticLongitude = (dMeanLongitude + 0.03341607*np.sin(dMeanAnomaly) 
+                            + 0.00034894*np.sin(2*dMeanAnomaly)
+                            -0.0001134 -0.0000203*np.sin(dOmega))
+        dEclipticObliquity = 0.4090928 - 6.2140e-9*dElapsedJulianDays+0.0000396*np.cos(dOmega)
+
+        # Calculate celestial coordinates ( right ascension and declination ) in radians 
+        # but without limiting the angle to be less than 2*Pi (i.e., the result may be 
+        # greater than 2*Pi)
+        dSin_EclipticLongitude= np.sin(dEclipticLongitude)
+        dY = np.cos(dEclipticObliquity) * dSin_EclipticLongitude
+        dX = np.cos(dEclipticLongitude)
+        dRightAscension = np.arctan2(dY,dX)
+        self.right_ascension = np.where(dRightAscension < 0.0, dRightAscension + 2*np.pi, dRightAscension)
+        dDeclination = np.arcsin( np.sin( dEclipticObliquity )*dSin_EclipticLongitude )
+        self.cos_declination = np.cos(dDeclination)
+        self.sin_declination = np.sin(dDeclination)
+        self.tan_declination = np.tan(dDeclination)
+
+        # Greenwich mean sidereal time in hours
+        self.greenwich_sidereal_time = 6.6974243242 + 0.0657098283*dElapsedJulianDays + dDecimalHours
+
+    def __len__(self):
+        return len(self.time)
+
+    def between(self, start_time, end_time):
+
+        # align the timezone of the bounds with the timezone of the ephemeris times
+        start_time, end_time = pd.Timestamp(start_time), pd.Timestamp(end_time)
+        if (self.time.tz is None and start_time.tz is not None):
+            start_time, end_time = start_time.tz_convert('UTC').tz_localize(None), end_time.tz_convert('UTC').tz_localize(None)
+        elif (self.time.tz is not None and start_time.tz is None):
+            start_time, end_time = start_time.tz_localize('UTC'), end_time.tz_localize('UTC')
+
+        if (start_time < self.time[0] or end_time > self.time[-1]):
+            raise ValueError('the ephemeris does not cover the requested time range.')
+
+        # select the covered times, sharing the underlying arrays
+        selection = self.time.slice_indexer(start_time, end_time)
+        ephemeris = Ephemeris.__new__(Ephemeris)
+        ephemeris.time = self.time[selection]
+        for name in ['right_ascension', 'cos_declination', 'sin_declination', 'tan_declination', 'greenwich_sidereal_time']:
+            setattr(ephemeris, name, getattr(self, name)[selection])
+
+        return ephemeris
+
+    def sun_position(self, latitude, longitude):
+
+        # latitude and longitude can be scalars, or (sites x 1) arrays to get (sites x times) results
+        # Calculate local coordinates ( azimuth and zenith angle ) in degrees
+        dLocalMeanSiderealTime = (self.greenwich_sidereal_time*15 
+            + longitude)*rad
+        dHourAngle = dLocalMeanSiderealTime - self.right_ascension
+        dLatitudeInRadians = np.radians(latitude)
+        dCos_Latitude = np.cos(dLatitudeInRadians)
+        dSin_Latitude = np.sin(dLatitudeInRadians)
+        dCos_HourAngle= np.cos(dHourAngle)
+        ZenithAngle = (np.arccos(dCos_Latitude*dCos_HourAngle* self.cos_declination + self.sin_declination*dSin_Latitude))
+        dY = -np.sin(dHourAngle)
+        dX = self.tan_declination*dCos_Latitude - dSin_Latitude*dCos_HourAngle
+        Azimuth = np.arctan2(dY,dX)
+        Azimuth = np.where(Azimuth < 0.0, Azimuth + 2*np.pi, Azimuth)
+        Azimuth = Azimuth/rad
+        # Parallax Correction
+        dParallax=(dEarthMeanRadius/dAstronomicalUnit)*np.sin(ZenithAngle)
+        ZenithAngle=(ZenithAngle + dParallax)/rad
+
+        return np.radians(Azimuth), np.radians(ZenithAngle)
+
 def sunpos(udtTime, latitude, longitude):
+        # Scalar reference implementation of the PSA algorithm for a single timestamp, 
+        # kept to validate sunpos_array above (use sun_position_method='psa_reference'), 
+        # an aware timestamp is converted to UTC
+        if (udtTime.tzinfo is not None):
+            udtTime = udtTime.astimezone(datetime.timezone.utc)
+
         # Calculate difference in days between the current Julian Day 
         # and JD 2451545.0, which is noon 1 January 2000 Universal Time
 
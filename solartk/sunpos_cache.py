@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+import os
+import glob
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+from helpers import granularity_to_freq, freq_to_seconds, cache_directory
+from sunpos import Ephemeris
+
+
+# on-disk cache of precomputed sun position tables, one memory-mappable .npy file per
+# (latitude, longitude, year, granularity, phase), holding the sun azimuth and zenith angles 
+# (radians) for every time of the year in UTC on the granularity grid. A table is keyed by the
+# exact coordinates, so its values are the same as the direct computation. Building a table
+# costs a whole year of the grid (e.g. 500 MB and seconds at 1 s granularity), so the cache only
+# pays off when the same sites are queried many times, and it is not used unless enabled (see
+# default_sun_position_cache)
+class SunPositionCache:
+
+    # a constructor to initialize the cache directory and its size cap
+    def __init__(self, directory=None, max_bytes=2*1024**3):
+
+        self.directory = cache_directory('sunpos') if directory is None else directory
+        self.max_bytes = max_bytes
+
+        # number of times computed at once when a table is built
+        self.block_size = 2**20
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def table_path(self, latitude, longitude, year, granularity, phase):
+        return os.path.join(self.directory, 'sunpos_{!r}_{!r}_{}_{}_{}.npy'.format(
+                            float(latitude), float(longitude), year, granularity, phase))
+
+    def table_start(self, year, granularity, phase):
+
+        # first time of the year (UTC) that falls on the granularity grid with the given phase
+        year_start = pd.Timestamp(year=year, month=1, day=1, tz='UTC')
+        offset = (phase - year_start.value // 10**9) % granularity
+        return year_start + pd.Timedelta(seconds=offset)
+
+    def table(self, latitude, longitude, year, granularity, phase=0):
+
+        path = self.table_path(latitude, longitude, year, granularity, phase)
+
+        # map the table if it was computed before, and mark it as recently used
+        if (os.path.exists(path)):
+            try:
+                table = np.load(path, mmap_mode='r')
+                os.utime(path)
+                return table
+            except (OSError, ValueError):
+                # a damaged table is recomputed below
+                pass
+
+        # compute the table for the whole year, a block of times 
+        # at a time, directly into a temporary file so that concurrent readers never see a partial table
+        times = pd.date_range(self.table_start(year, granularity, phase), 
+                              pd.Timestamp(year=year+1, month=1, day=1, tz='UTC') - pd.Timedelta(nanoseconds=1), 
+                              freq='{}S'.format(granularity))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(2, len(times)))
+        for block in range(0, len(times), self.block_size):
+            ephemeris = Ephemeris(times[block:block+self.block_size])
+            table[0, block:block+self.block_size], table[1, block:block+self.block_size] = ephemeris.sun_position(
+                                            float(latitude), float(longitude))
+        table.flush()
+        del table
+        os.replace(tmp_path, path)
+
+        self.evict(keep=path)
+
+        return np.load(path, mmap_mode='r')
+
+    def evict(self, keep=None):
+
+        # remove least recently used tables until the cache fits in its size cap
+        tables = [(os.path.getmtime(path), os.path.getsize(path), path) for path in glob.glob(os.path.join(self.directory, 'sunpos_*.npy'))]
+        total = sum(size for _, size, _ in tables)
+
+        for _, size, path in sorted(tables):
+            if (total <= self.max_bytes):
+                break
+            if (path == keep):
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def get_sun_position(self, start_time=None, end_time=None, granularity=None, latitude=None, longitude=None):
+
+        # create a pandas datetimeindex, same as sunpos.get_sun_position
+        freq = granularity_to_freq(granularity)
+        times = pd.date_range(start_time, end_time, freq=freq)
+        df = times.to_frame(index=False)
+        df.columns = ['time']
+
+        if (len(times) == 0):
+            df['sun_azimuth'], df['sun_zenith'] = np.array([]), np.array([])
+            return df
+
+        # position of the requested times on the granularity grid
+        step = freq_to_seconds(freq)
+        utc = times.tz_convert('UTC') if times.tz is not None else times.tz_localize('UTC')
+        start, end = utc[0], utc[-1]
+        phase = (start.value // 10**9) % step
+
+        # read the covered part of each year table
+        parts = []
+        for year in range(start.year, end.year + 1):
+            table = self.table(latitude, longitude, year, step, phase)
+            table_start = self.table_start(year, step, phase)
+            first = max(0, (start - table_start).value // (step * 10**9))
+            last = min(table.shape[1] - 1, (end - table_start).value // (step * 10**9))
+            parts.append(table[:, first:last+1])
+
+        table = np.hstack(parts)
+        df['sun_azimuth'], df['sun_zenith'] = table[0], table[1]
+
+        return df
+
+
+# function to get the sun position cache used by default, which is no cache unless the
+# SOLARTK_SUNPOS_CACHE environment variable is set (to anything but 0)
+def default_sun_position_cache():
+    if (os.environ.get('SOLARTK_SUNPOS_CACHE', '0') in ['', '0']):
+        return None
+    return SunPositionCache()
+
+
+if __name__ == "__main__":
+
+    # pre-warm the cache for a list of sites and years
+    parser = argparse.ArgumentParser(description='Pre-compute sun position tables for a list of sites and years.')
+    parser.add_argument('sites', help='CSV file with latitude and longitude columns')
+    parser.add_argument('years', type=int, nargs='+', help='years to pre-compute')
+    parser.add_argument('--granularity', type=int, default=60, help='time resolution in seconds (default: 60)')
+    parser.add_argument('--phase', type=int, default=0, help='offset of the time grid in seconds (default: 0)')
+    parser.add_argument('--cache-dir', default=None, help='cache directory (default: $SOLARTK_CACHE_DIR/sunpos)')
+    parser.add_argument('--max-bytes', type=int, default=2*1024**3, help='cache size cap in bytes')
+    args = parser.parse_args()
+
+    cache = SunPositionCache(directory=args.cache_dir, max_bytes=args.max_bytes)
+    sites = pd.read_csv(args.sites)
+    step = freq_to_seconds(granularity_to_freq(args.granularity))
+
+    for _, site in sites.iterrows():
+        for year in args.years:
+            cache.table(site['latitude'], site['longitude'], year, step, args.phase % step)
+            print(site['latitude'], site['longitude'], year)
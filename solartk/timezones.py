@@ -0,0 +1,100 @@
+import os
+import json
+import tempfile
+import threading
+import pytz
+
+from helpers import cache_directory
+
+
+# timezone lookup of latitude/longitude locations: the timezone polygons (tzwhere) take seconds
+# and a lot of memory to load, so they are loaded once per process and only when a location is
+# not known yet, lookups are memoized and kept in a persistent key-value store (a JSON file)
+# keyed by the rounded latitude and longitude. A resolver can be shared by threads (e.g. the
+# service workers), the cache is only changed and saved under its lock, and the processes that
+# share the file (e.g. the fleet workers) merge their lookups with the saved ones
+class TimezoneResolver:
+
+    # a constructor to initialize the cache file and the coordinate rounding
+    def __init__(self, cache_file=None, decimals=4):
+
+        self.cache_file = os.path.join(cache_directory(), 'timezones.json') if cache_file is None else cache_file
+        self.decimals = decimals
+        self.tzwhere = None
+        self.lock = threading.Lock()
+
+        self.cache = self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def timezone_name(self, latitude, longitude):
+
+        latitude, longitude = float(latitude), float(longitude)
+        key = '{:.{d}f},{:.{d}f}'.format(round(latitude, self.decimals), round(longitude, self.decimals), d=self.decimals)
+
+        if (key in self.cache):
+            return self.cache[key]
+
+        with self.lock:
+            # another thread may have looked it up while this one was waiting
+            if (key in self.cache):
+                return self.cache[key]
+
+            if (self.tzwhere is None):
+                from tzwhere import tzwhere
+                self.tzwhere = tzwhere.tzwhere()
+            timezone_name = self.tzwhere.tzNameAt(latitude, longitude)
+
+            if (timezone_name is None):
+                raise ValueError('no timezone was found at {}, {}, please specify the timezone.'.format(latitude, longitude))
+
+            self.cache[key] = timezone_name
+            self.save()
+
+        return timezone_name
+
+    def get_timezone(self, latitude=None, longitude=None, timezone=None):
+
+        # the given timezone (a name or a pytz timezone) is used as is, without any lookup
+        if (timezone is None):
+            timezone = self.timezone_name(latitude, longitude)
+
+        return pytz.timezone(timezone) if isinstance(timezone, str) else timezone
+
+    def save(self):
+
+        # called with the lock held, the lookups saved by other processes are kept, and the file is 
+        # written to a temporary file first so that concurrent readers never see a partial file
+        try:
+            cache = self.load()
+            cache.update(self.cache)
+            self.cache = cache
+
+            directory = os.path.dirname(os.path.abspath(self.cache_file))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError:
+            # the lookups are still memoized in memory
+            pass
+
+
+# resolver shared by the whole process
+resolver = None
+
+def get_resolver():
+    global resolver
+    if (resolver is None):
+        resolver = TimezoneResolver()
+    return resolver
+
+# function to get the pytz timezone of a location, or the given timezone (name or pytz timezone)
+def get_timezone(latitude=None, longitude=None, timezone=None):
+    return get_resolver().get_timezone(latitude=latitude, longitude=longitude, timezone=timezone)
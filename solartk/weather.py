@@ -1,15 +1,169 @@
+import os
 import datetime
 import time
 import pytz
 import pandas as pd
 import json
-import urllib.request
-import requests
+import threading
+import warnings
+import concurrent.futures
 # from tzwhere import tzwhere
 # from darksky import forecast
 import numpy as np
 
-from helpers import okta_to_percent, granularity_to_freq
+from helpers import okta_to_percent_array, granularity_to_freq, localize
+from weather_store import WeatherStore
+from weather_archive import get_archive
+
+# api endpoints, formatted with the location and day (module level so that they can be pointed to a local server)
+WEATHER_UNDERGROUND_URL = "https://api.weather.com/v1/geocode/{}/{}/observations/historical.json?apiKey=e1f10a1e78da46f5b10a1e78da96f525&startDate={}&endDate={}&units=e"
+DARKSKY_URL = "https://api.darksky.net/forecast/{}/{},{},{}?exclude=currently,daily,flags"
+
+
+# fetches many api pages concurrently over a pooled http session, with a bounded number of
+# workers, an optional rate limit (requests per second), and retries with exponential backoff
+class WeatherFetcher:
+
+    def __init__(self, concurrency=8, rate_limit=None, retries=3, backoff_factor=0.5, timeout=30):
+
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+
+        # requests is only imported when the weather is fetched from the web
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.request_errors = (requests.RequestException, ValueError)
+
+        # one session, with a connection pool as large as the number of workers, retrying 
+        # connection errors, rate limiting and server errors with exponential backoff
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'], respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.lock = threading.Lock()
+        self.next_request = 0.0
+
+    def wait_for_slot(self):
+
+        # space the requests of all workers at least 1/rate_limit seconds apart
+        if (self.rate_limit == None):
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next_request - now)
+            self.next_request = max(now, self.next_request) + 1.0/self.rate_limit
+        if (wait > 0):
+            time.sleep(wait)
+
+    def get_json(self, url):
+        self.wait_for_slot()
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch(self, urls, skip_errors=False):
+
+        # fetch all urls with a bounded pool of workers, the results keep the order of the urls, 
+        # and failed pages are None when skip_errors is set (e.g. days without observations)
+        results = [None]*len(urls)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.get_json, url): i for i, url in enumerate(urls)}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except self.request_errors as e:
+                    if (not skip_errors):
+                        raise
+                    warnings.warn('could not fetch weather data: {}'.format(e))
+
+        return results
+
+
+# a fetcher and a store shared by all calls, so that connections are reused between calls
+default_fetcher = None
+default_store = None
+
+def get_default_fetcher():
+    global default_fetcher
+    if (default_fetcher == None):
+        default_fetcher = WeatherFetcher()
+    return default_fetcher
+
+def get_default_store():
+    global default_store
+    if (default_store == None):
+        default_store = WeatherStore()
+    return default_store
+
+
+# function to get the pages of the given days ('YYYYMMDD'), from the store when they are there
+# and from the api urls otherwise, storing the newly fetched pages
+def fetch_days(source, latitude, longitude, days, urls, fetcher, store, skip_errors=False):
+
+    stored = store.get_many(source, latitude, longitude, days) if store else {}
+    missing = [i for i, day in enumerate(days) if day not in stored]
+
+    fetched = fetcher.fetch([urls[i] for i in missing], skip_errors=skip_errors)
+    fetched = {days[i]: page for i, page in zip(missing, fetched) if page != None}
+    if store and len(fetched) > 0:
+        store.put_many(source, latitude, longitude, fetched)
+
+    stored.update(fetched)
+    return [stored.get(day) for day in days]
+
+
+# function to convert raw observations (time in UTC epoch seconds, temperature in Fahrenheit and
+# clds cloud cover codes) to the desired granularity, local time, Celsius and cloud cover percent, 
+# the cloud cover percent is sampled from the given numpy random generator (or seed)
+def normalize_observations(temp_cloud_df, granularity, timezone, rng=None):
+
+    # convert to datetime and set the correct timezone
+    temp_cloud_df["time"] = (
+        pd.to_datetime(temp_cloud_df["time"], unit="s")
+        .dt.tz_localize("utc")
+        .dt.tz_convert(timezone)
+    )
+    # temp_cloud_df['time'] = temp_cloud_df['time'].dt.round("H")
+
+    # resample the data to desired granularity
+    temp_cloud_df = temp_cloud_df[["time", "temperature", "clds"]].set_index("time")
+    temp_cloud_df = temp_cloud_df.resample(granularity_to_freq(granularity)).ffill()
+    temp_cloud_df = temp_cloud_df.reset_index()
+
+    # chnage to C from F, in place on the column array
+    temperature = temp_cloud_df["temperature"].to_numpy(dtype=np.float64, copy=True)
+    temperature -= 32
+    temperature *= 5
+    temperature /= 9
+    temp_cloud_df["temperature"] = temperature
+
+    # cloud okta code to percent, with all samples drawn at once from the random generator
+    temp_cloud_df["clouds"] = okta_to_percent_array(temp_cloud_df["clds"].values, rng)
+
+    # keep only relevant columns
+    temp_cloud_df = temp_cloud_df[["time", "temperature", "clouds", "clds"]]
+
+    ######################### future release ############################
+    # # create a pandas datetimeindex
+    # df = pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity), tz=timezone)
+
+    # # convert it into a simple dataframe and rename the column
+    # df = df.to_frame(index=False)
+    # df.columns = ['time']
+
+    # # combine both df and temperature_df
+    # temp_cloud_df = df.join(temp_cloud_df.set_index('time'), on='time')
+    ####################################################################
+
+    # temp_cloud_df['time'] = temp_cloud_df['time'].dt.tz_localize('utc').dt.tz_convert(timezone)
+    temp_cloud_df["time"] = temp_cloud_df["time"].dt.tz_localize(None)
+
+    return temp_cloud_df
 
 
 def get_temperature_cloudcover(
@@ -21,8 +175,40 @@ def get_temperature_cloudcover(
     source="weather_underground",
     timezone="US/Eastern",
     darksky_api_key=None,
+    fetcher=None,
+    store=None,
+    archive_path=None,
+    seed=None,
 ):
-    if source == "weather_underground" or darksky_api_key == None:
+    # the api pages are fetched concurrently, by the given fetcher or by a shared default one, 
+    # and kept in the given store, or in a shared default one (store=False disables it), the 
+    # defaults are only created for the web sources
+    if source != "archive" and fetcher == None:
+        fetcher = get_default_fetcher()
+    if source != "archive" and store == None:
+        store = get_default_store()
+
+    if source == "archive":
+        # read the observations from a local archive (see weather_archive.py), from the day before 
+        # the start time, so that the first times can be forward filled
+        if archive_path == None:
+            archive_path = os.environ.get("SOLARTK_WEATHER_ARCHIVE")
+        archive = get_archive(archive_path)
+
+        # the bounds are localized as by GenerationPotential (so a bound in the repeated or the skipped 
+        # hour of a DST change is read in standard time) and padded in absolute time
+        tz = pytz.timezone(timezone) if isinstance(timezone, str) else timezone
+        start_utc = pd.Timestamp(localize(start_time, tz)).tz_convert("UTC") - pd.Timedelta(hours=24)
+        end_utc = pd.Timestamp(localize(end_time, tz)).tz_convert("UTC") + pd.Timedelta(hours=24)
+        temp_cloud_df = archive.query(latitude=latitude, longitude=longitude, start_time=start_utc.value // 10**9, 
+                                      end_time=end_utc.value // 10**9, columns=["time", "temperature", "clds"])
+
+        if len(temp_cloud_df) == 0:
+            raise ValueError("the weather archive has no observations between {} and {}.".format(start_time, end_time))
+
+        temp_cloud_df = normalize_observations(temp_cloud_df, granularity, timezone, rng=seed)
+
+    elif source == "weather_underground" or darksky_api_key == None:
         # create a pandas datetimeindex
         df = pd.date_range(start_time - datetime.timedelta(days=1), end_time, freq="D")
 
@@ -33,64 +219,26 @@ def get_temperature_cloudcover(
         # convert it into required format for weather underground
         df["time"] = df["time"].dt.strftime("%Y%m%d")
 
-        temp_cloud_df = pd.DataFrame()
-
-        for _, row in df.iterrows():
-            # print(row['time'])
-            try:
-                url = "https://api.weather.com/v1/geocode/{}/{}/observations/historical.json?apiKey=e1f10a1e78da46f5b10a1e78da96f525&startDate={}&endDate={}&units=e".format(
-                    latitude, longitude, row["time"], row["time"]
-                )
-                data = urllib.request.urlopen(url).read()
-                output = json.loads(data)
-                output = pd.DataFrame(output["observations"])
-                output = output[["valid_time_gmt", "temp", "clds", "wx_phrase"]]
-                output.columns = ["time", "temperature", "clds", "wx_phrase"]
-                temp_cloud_df = pd.concat([temp_cloud_df, output], ignore_index=True)
-            except urllib.error.HTTPError as e:
-                pass
-            # time.sleep(0.01)
-
-        # convert to datetime and set the correct timezone
-        temp_cloud_df["time_s"] = temp_cloud_df["time"]
-        temp_cloud_df["time"] = (
-            pd.to_datetime(temp_cloud_df["time"], unit="s")
-            .dt.tz_localize("utc")
-            .dt.tz_convert(timezone)
-        )
-        # temp_cloud_df['time'] = temp_cloud_df['time'].dt.round("H")
-
-        # resample the data to desired granularity
-        temp_cloud_df = temp_cloud_df.set_index(temp_cloud_df["time"])
-        temp_cloud_df = temp_cloud_df.resample(granularity_to_freq(granularity)).ffill()
-        temp_cloud_df = temp_cloud_df[["temperature", "clds"]]
-        temp_cloud_df = temp_cloud_df.reset_index()
-
-        # chnage to C from F
-        temp_cloud_df["temperature"] = (temp_cloud_df["temperature"] - 32) * 5 / 9
-
-        # cloud okta code to percent
-        temp_cloud_df["clouds"] = pd.to_numeric(
-            temp_cloud_df["clds"].apply(lambda x: okta_to_percent(x))
-        )
-
-        # keep only relevant columns
-        temp_cloud_df = temp_cloud_df[["time", "temperature", "clouds", "clds"]]
-
-        ######################### future release ############################
-        # # create a pandas datetimeindex
-        # df = pd.date_range(start_time, end_time, freq=granularity_to_freq(granularity), tz=timezone)
+        # fetch all days that are not stored concurrently, days without observations are skipped
+        days = list(df["time"])
+        urls = [WEATHER_UNDERGROUND_URL.format(latitude, longitude, day, day) for day in days]
+        pages = fetch_days("weather_underground", latitude, longitude, days, urls, fetcher, store, skip_errors=True)
 
-        # # convert it into a simple dataframe and rename the column
-        # df = df.to_frame(index=False)
-        # df.columns = ['time']
+        # keep the relevant columns of each day and concatenate them once
+        frames = []
+        for output in pages:
+            if output == None or len(output.get("observations", [])) == 0:
+                continue
+            output = pd.DataFrame(output["observations"])
+            output = output[["valid_time_gmt", "temp", "clds", "wx_phrase"]]
+            output.columns = ["time", "temperature", "clds", "wx_phrase"]
+            frames.append(output)
 
-        # # combine both df and temperature_df
-        # temp_cloud_df = df.join(temp_cloud_df.set_index('time'), on='time')
-        ####################################################################
+        if len(frames) == 0:
+            raise ValueError("no weather observations could be fetched between {} and {}.".format(start_time, end_time))
+        temp_cloud_df = pd.concat(frames, ignore_index=True)
 
-        # temp_cloud_df['time'] = temp_cloud_df['time'].dt.tz_localize('utc').dt.tz_convert(timezone)
-        temp_cloud_df["time"] = temp_cloud_df["time"].dt.tz_localize(None)
+        temp_cloud_df = normalize_observations(temp_cloud_df, granularity, timezone, rng=seed)
 
         # print(temp_cloud_df)
 
@@ -104,16 +252,17 @@ def get_temperature_cloudcover(
         start: datetime.datetime = timezone.localize(start_time)
         end: datetime.datetime = timezone.localize(end_time)
 
+        # fetch all days that are not stored concurrently
+        days = []
+        urls = []
         while start <= end:
             day = int(start.timestamp())
+            days.append(start.strftime("%Y%m%d"))
             start = start + datetime.timedelta(days=1)
+            urls.append(DARKSKY_URL.format(darksky_api_key, latitude, longitude, day))
 
-            response = urllib.request.urlopen(
-                "https://api.darksky.net/forecast/{}/{},{},{}?exclude=currently,daily,flags".format(
-                    darksky_api_key, latitude, longitude, day
-                )
-            ).read()
-            output = json.loads(response)["hourly"]["data"]
+        for page in fetch_days("darksky", latitude, longitude, days, urls, fetcher, store):
+            output = page["hourly"]["data"]
 
             for item in output:
                 time.append(item["time"])
@@ -135,7 +284,11 @@ def get_temperature_cloudcover(
             .dt.tz_convert(timezone)
             .dt.tz_localize(None)
         )
-        temp_cloud_df["temperature"] = (temp_cloud_df["temperature"] - 32) * 5 / 9
+        temperature = temp_cloud_df["temperature"].to_numpy(dtype=np.float64, copy=True)
+        temperature -= 32
+        temperature *= 5
+        temperature /= 9
+        temp_cloud_df["temperature"] = temperature
 
     else:
         print("Sorry, {} source has not been implemented yet.".format(source))
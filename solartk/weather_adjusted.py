@@ -6,12 +6,13 @@ import math
 import time
 import sys
 import pytz
-from tzwhere import tzwhere
 import csv
+import io
 
-from irradiance import get_clearsky_irradiance
 from weather import get_temperature_cloudcover
-from sunpos import get_sun_position
+from helpers import pop_option
+from instrumentation import Instrumentation
+from pipe_format import MAGIC, is_pipe_format, read_pipe
 
 # weather adjusted generation potential class that provides a function to compute
 # weather adjusted generation
@@ -32,17 +33,40 @@ class WeatherAdjustedGeneration:
 
         # set default data sources for clearsky, sun position and temperature
         self.weather_source = 'weather_underground'
+        self.weather_archive = None
+
+        # seed of the random generator that samples cloud cover percents (None is unseeded)
+        self.seed = None
+
+        # stage timers (see instrumentation.py)
+        self.instrumentation = Instrumentation()
 
     
-    def set_data_sources(self, weather_source='weather_underground'):
+    def set_data_sources(self, weather_source='weather_underground', weather_archive=None):
 
-        # set the parameters based on the specified values
+        # set the parameters based on the specified values, weather_archive is the 
+        # path of the local archive used by the 'archive' weather source
         self.weather_source = weather_source
+        self.weather_archive = weather_archive
+
+    # a function to set the seed of the cloud cover sampling, so that the output is reproducible
+    def set_seed(self, seed=None):
+        self.seed = seed
 
     # a function to compute maximum generation potential for the given system at time t
     # clearsky method and method for computing sun position are optional arguments
     def adjusted_weather_generation(self, max_generation=None):
 
+        adjusted_generation = self.compute_adjusted_generation(max_generation=max_generation)
+
+        with self.instrumentation.stage('output'):
+            with pd.option_context('display.max_rows', None, 'display.max_columns', None):
+                adjusted_generation.to_csv(sys.stdout, index=False, header='False')
+
+    # a function to compute the weather adjusted generation of a dataframe of times (time) and maximum 
+    # generation (max_generation), it returns a dataframe of the times (#time) and the adjusted generation
+    def compute_adjusted_generation(self, max_generation=None):
+
         # extract the start and end times from the data
         start_time = max_generation.iloc[0][0]
         end_time = max_generation.iloc[-1][0]
@@ -51,9 +75,11 @@ class WeatherAdjustedGeneration:
         granularity = (max_generation.iloc[1][0] - max_generation.iloc[0][0]).seconds
 
         # get weather data
-        temp_cloudcover = get_temperature_cloudcover(start_time=start_time, 
-                            end_time=end_time, granularity=granularity, latitude=self.lat_, 
-                            longitude=self.lon_, source=self.weather_source)
+        with self.instrumentation.stage('weather'):
+            temp_cloudcover = get_temperature_cloudcover(start_time=start_time, 
+                                end_time=end_time, granularity=granularity, latitude=self.lat_, 
+                                longitude=self.lon_, source=self.weather_source, archive_path=self.weather_archive,
+                                seed=self.seed)
 
         # print(temp_cloudcover)
 
@@ -68,30 +94,50 @@ class WeatherAdjustedGeneration:
         adjusted_generation = adjusted_generation[['time', 'adjusted_generation']]
         adjusted_generation.columns = ['#time', 'adjusted_generation']
 
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None):
-            adjusted_generation.to_csv(sys.stdout, index=False, header='False')
+        return adjusted_generation
 
 
 if __name__ == "__main__":
 
-    # read data from stdin, split by line, and split each line by comma
-    data = pd.DataFrame([line for line in csv.reader(sys.stdin)])
+    # "--weather-archive path" reads the weather from a local archive instead of the web
+    weather_archive = pop_option(sys.argv, '--weather-archive')
 
-    # get latitude and longitude
-    lat, lon = data.iloc[1][0], data.iloc[1][1]
+    # "--seed n" makes the sampled cloud cover percents (and the output) reproducible
+    seed = pop_option(sys.argv, '--seed')
 
-    # remove the first two rows
-    data = data[2:].reset_index(drop=True)
+    # "--profile report.json" writes the stage timers and peak memory as JSON ('-' for stderr)
+    profile = pop_option(sys.argv, '--profile')
 
-    # set first row as column which contain #time, max_generation
-    data.columns = data.iloc[0]
-    data = data.reindex(data.index.drop(0)).reset_index(drop=True)
-    data.columns.name = None
-    data = data.replace(to_replace='None', value=np.nan).dropna()
+    # read the maximum generation from stdin, the binary framing of pipe_format.py is recognized
+    # by its magic bytes, and CSV text is read otherwise
+    prefix = sys.stdin.buffer.read(len(MAGIC))
 
-    # convert time column to datetime
-    data['time'] = pd.to_datetime(data['#time'])
-    data = data[['time', 'max_generation']]
+    if (is_pipe_format(prefix)):
+        metadata, data = read_pipe(sys.stdin.buffer)
+        lat, lon = metadata['latitude(°)'], metadata['longitude(°)']
+        data['time'] = data['#time']
+        data = data[['time', 'max_generation']]
+
+    else:
+        # read data from stdin, split by line, and split each line by comma
+        stdin = io.StringIO((prefix + sys.stdin.buffer.read()).decode(sys.stdin.encoding))
+        data = pd.DataFrame([line for line in csv.reader(stdin)])
+
+        # get latitude and longitude
+        lat, lon = data.iloc[1][0], data.iloc[1][1]
+
+        # remove the first two rows
+        data = data[2:].reset_index(drop=True)
+
+        # set first row as column which contain #time, max_generation
+        data.columns = data.iloc[0]
+        data = data.reindex(data.index.drop(0)).reset_index(drop=True)
+        data.columns.name = None
+        data = data.replace(to_replace='None', value=np.nan).dropna()
+
+        # convert time column to datetime
+        data['time'] = pd.to_datetime(data['#time'])
+        data = data[['time', 'max_generation']]
 
     ##################### for future release #######################
     # # read user input from command line
@@ -101,6 +147,14 @@ if __name__ == "__main__":
 
     # create an object of GenerationPotential class    
     weather = WeatherAdjustedGeneration(latitude=lat, longitude=lon)
+    if (weather_archive != None):
+        weather.set_data_sources(weather_source='archive', weather_archive=weather_archive)
+    if (seed != None):
+        weather.set_seed(int(seed))
 
     # compute weather adjusted generation
-    weather.adjusted_weather_generation(max_generation=data)
\ No newline at end of file
+    weather.instrumentation = Instrumentation(trace_memory=(profile != None))
+    weather.adjusted_weather_generation(max_generation=data)
+
+    if (profile != None):
+        weather.instrumentation.write_report(profile)
\ No newline at end of file
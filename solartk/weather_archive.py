@@ -0,0 +1,174 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+from helpers import cache_directory
+
+
+# local weather archive, built from bulk CSV dumps (a file or a directory of files) of station
+# observations with the columns station, latitude, longitude, time (UTC, epoch seconds or a
+# date string), temperature (Fahrenheit, as weather underground reports it) and clds (cloud cover
+# code: CLR, FEW, SCT, BKN, OVC). The dumps are indexed once into columnar .npy files sorted by
+# station and time, which are then memory mapped to answer range queries with a binary search,
+# reading only the requested columns. Each version of the dumps (their paths, sizes and modification
+# times) has its own index directory, which is built in a temporary directory and renamed into place,
+# so that concurrent processes never read a partial index
+class WeatherArchive:
+
+    columns = ['time', 'temperature', 'clds']
+
+    # a constructor to initialize the archive and its index (built on first use, or when the dumps change),
+    # the index directories of the versions are kept in index_path
+    def __init__(self, archive_path=None, index_path=None):
+
+        if (archive_path is None):
+            raise ValueError('please specify the weather archive path.')
+
+        self.archive_path = os.path.abspath(archive_path)
+        self.files = archive_files(self.archive_path)
+        if (len(self.files) == 0):
+            raise ValueError('the weather archive {} has no csv files.'.format(self.archive_path))
+        self.signature = source_signature(self.files)
+
+        if (index_path is None):
+            index_path = cache_directory(os.path.join('archive', hashlib.sha1(self.archive_path.encode()).hexdigest()[:16]))
+        self.index_root = index_path
+        self.index_path = os.path.join(index_path, hashlib.sha1(json.dumps(self.signature).encode()).hexdigest()[:16])
+
+        if (not self.index_is_current()):
+            self.build_index()
+
+        # station table and the offsets of each station's rows in the columns
+        with open(os.path.join(self.index_path, 'stations.json')) as f:
+            index = json.load(f)
+        self.stations = index['stations']
+        # missing cloud codes (-1) index the trailing None
+        self.clds_categories = np.array(index['clds_categories'] + [None], dtype=object)
+        self.station_latitudes = np.array([station['latitude'] for station in self.stations])
+        self.station_longitudes = np.array([station['longitude'] for station in self.stations])
+        self.offsets = np.load(os.path.join(self.index_path, 'offsets.npy'))
+
+        # columns are memory mapped, so only the rows of a query are read
+        self.data = {column: np.load(os.path.join(self.index_path, column + '.npy'), mmap_mode='r') for column in self.columns}
+
+    def index_is_current(self):
+        try:
+            with open(os.path.join(self.index_path, 'stations.json')) as f:
+                return json.load(f)['source'] == self.signature
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def build_index(self):
+
+        # read all dumps, keeping only the indexed columns
+        dumps = [pd.read_csv(path, usecols=['station', 'latitude', 'longitude'] + self.columns) for path in self.files]
+        archive = pd.concat(dumps, ignore_index=True)
+
+        if (pd.api.types.is_numeric_dtype(archive['time'])):
+            archive['time'] = archive['time'].astype(np.int64)
+        else:
+            archive['time'] = pd.to_datetime(archive['time'], utc=True).astype(np.int64) // 10**9
+
+        archive['station'] = archive['station'].astype(str)
+        archive = archive.sort_values(by=['station', 'time'], kind='mergesort').reset_index(drop=True)
+
+        # station table with the first row of each station
+        stations = archive.groupby('station', sort=True).agg(latitude=('latitude', 'first'), longitude=('longitude', 'first'),
+                                                              rows=('time', 'size'))
+        offsets = np.concatenate([[0], np.cumsum(stations['rows'].values)]).astype(np.int64)
+
+        # cloud codes are stored as small integer codes, -1 for missing values
+        clds = pd.Categorical(archive['clds'])
+
+        # the index is written to a temporary directory, and renamed into place once it is complete
+        os.makedirs(self.index_root, exist_ok=True)
+        build_path = tempfile.mkdtemp(dir=self.index_root, prefix='.build-')
+        np.save(os.path.join(build_path, 'time.npy'), archive['time'].values.astype(np.int64))
+        np.save(os.path.join(build_path, 'temperature.npy'), archive['temperature'].values.astype(np.float64))
+        np.save(os.path.join(build_path, 'clds.npy'), clds.codes.astype(np.int16))
+        np.save(os.path.join(build_path, 'offsets.npy'), offsets)
+        with open(os.path.join(build_path, 'stations.json'), 'w') as f:
+            json.dump({'source': self.signature,
+                       'clds_categories': [str(category) for category in clds.categories],
+                       'stations': [{'station': station, 'latitude': float(row['latitude']), 'longitude': float(row['longitude'])}
+                                    for station, row in stations.iterrows()]}, f)
+
+        try:
+            os.rename(build_path, self.index_path)
+        except OSError:
+            # another process built the same version first (or left a damaged one, which is replaced)
+            if (not self.index_is_current()):
+                shutil.rmtree(self.index_path, ignore_errors=True)
+                os.rename(build_path, self.index_path)
+            else:
+                shutil.rmtree(build_path, ignore_errors=True)
+
+        # the indexes of the previous versions (and the files of the former single index) are no longer needed
+        for path in glob.glob(os.path.join(self.index_root, '*')):
+            if (os.path.isdir(path) and path != self.index_path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif (os.path.isfile(path)):
+                os.remove(path)
+
+    def nearest_station(self, latitude, longitude):
+
+        # equirectangular distance is enough to pick the closest station
+        latitude, longitude = float(latitude), float(longitude)
+        dlat = self.station_latitudes - latitude
+        dlon = (self.station_longitudes - longitude) * np.cos(np.radians(latitude))
+        return int(np.argmin(dlat**2 + dlon**2))
+
+    def query(self, latitude=None, longitude=None, start_time=None, end_time=None, columns=None, station=None):
+
+        # rows of the given station (or the nearest one) between start_time and end_time (UTC epoch seconds)
+        if (station is None):
+            station = self.nearest_station(latitude, longitude)
+        elif (not isinstance(station, (int, np.integer))):
+            station = [s['station'] for s in self.stations].index(str(station))
+
+        first, last = self.offsets[station], self.offsets[station + 1]
+        times = self.data['time'][first:last]
+        lower = first + np.searchsorted(times, start_time, side='left')
+        upper = first + np.searchsorted(times, end_time, side='right')
+
+        result = {}
+        for column in (columns or self.columns):
+            values = np.array(self.data[column][lower:upper])
+            if (column == 'clds'):
+                values = self.clds_categories[values]
+            result[column] = values
+
+        return pd.DataFrame(result)
+
+
+# function to list the dump files of an archive path (a file or a directory of files)
+def archive_files(archive_path):
+    if (os.path.isdir(archive_path)):
+        return sorted(glob.glob(os.path.join(archive_path, '*.csv')))
+    return [archive_path]
+
+# function to get the version of the dump files, as their paths, sizes and modification times
+def source_signature(files):
+    return [[path, os.path.getsize(path), os.path.getmtime(path)] for path in files]
+
+
+# archives opened in this process, so that each index is only loaded once, an archive is 
+# opened again (and its index rebuilt) when its dump files change
+archives = {}
+
+def get_archive(archive_path):
+
+    if (archive_path is None or archive_path == ''):
+        raise ValueError('please specify the weather archive path, with the weather_archive option '
+                         '(--weather-archive) or the SOLARTK_WEATHER_ARCHIVE environment variable.')
+
+    archive_path = os.path.abspath(archive_path)
+    signature = source_signature(archive_files(archive_path))
+    if (archive_path not in archives or archives[archive_path].signature != signature):
+        archives[archive_path] = WeatherArchive(archive_path)
+    return archives[archive_path]
@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+import contextlib
+
+from helpers import cache_directory
+
+
+# persistent store (SQLite) of the raw weather api pages, one per (source, location, day), so that
+# days that were fetched before are not downloaded again. Recent days can still be revised by the
+# sources, so they expire after a time to live, while historical days never expire
+class WeatherStore:
+
+    # a constructor to initialize the database file, what counts as a recent day, their time to live (seconds), and the coordinate rounding
+    def __init__(self, path=None, recent_days=3, ttl=6*3600, decimals=4):
+
+        self.path = os.path.join(cache_directory(), 'weather.sqlite') if path is None else path
+        self.recent_days = recent_days
+        self.ttl = ttl
+        self.decimals = decimals
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS observations (source TEXT, location TEXT, day TEXT, '
+                               'fetched_at REAL, payload TEXT, PRIMARY KEY (source, location, day))')
+
+    @contextlib.contextmanager
+    def connect(self):
+
+        # a connection for the enclosed block, committed (or rolled back on an error) and closed at its end
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def location_key(self, latitude, longitude):
+        return '{:.{d}f},{:.{d}f}'.format(round(float(latitude), self.decimals), round(float(longitude), self.decimals), d=self.decimals)
+
+    def is_recent(self, day):
+        # days are 'YYYYMMDD' strings
+        first_recent = datetime.datetime.utcnow().date() - datetime.timedelta(days=self.recent_days)
+        return day >= first_recent.strftime('%Y%m%d')
+
+    def get_many(self, source, latitude, longitude, days):
+
+        # return the stored pages of the given days that have not expired, as a dictionary day -> page
+        location = self.location_key(latitude, longitude)
+        pages = {}
+        now = time.time()
+
+        with self.connect() as connection:
+            for i in range(0, len(days), 500):
+                chunk = days[i:i+500]
+                rows = connection.execute('SELECT day, fetched_at, payload FROM observations WHERE source = ? AND location = ? '
+                                          'AND day IN ({})'.format(','.join('?'*len(chunk))), [source, location] + list(chunk))
+                for day, fetched_at, payload in rows:
+                    if (self.is_recent(day) and now - fetched_at > self.ttl):
+                        continue
+                    pages[day] = json.loads(payload)
+
+        return pages
+
+    def put_many(self, source, latitude, longitude, pages):
+
+        # store the pages of a dictionary day -> page
+        location = self.location_key(latitude, longitude)
+        now = time.time()
+
+        with self.connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?)',
+                                   [(source, location, day, now, json.dumps(page)) for day, page in pages.items()])
+
+    def purge(self):
+
+        # remove the recent days whose time to live has passed
+        first_recent = (datetime.datetime.utcnow().date() - datetime.timedelta(days=self.recent_days)).strftime('%Y%m%d')
+        with self.connect() as connection:
+            connection.execute('DELETE FROM observations WHERE day >= ? AND fetched_at < ?', (first_recent, time.time() - self.ttl))
@@ -0,0 +1,181 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from pipe_format import PipeWriter
+
+
+# chunked writers of the solar-tk tables (e.g. the maximum generation of GenerationPotential):
+# each chunk (a dataframe, all with the same columns) is written as soon as it is computed, so
+# the whole table is never formatted or held in memory at once. A writer is opened with
+# open_writer, written with write(chunk), and closed with close() (or used in a with statement).
+# The metadata (e.g. the site location) is a dictionary of values written with the table
+
+
+# CSV writer, the same text as DataFrame.to_csv: the metadata is written first as a commented
+# line of keys and a line of values, e.g. "#latitude(°),longitude(°)" and "42,-72", then the
+# column names and the rows of every chunk. The times are always written with their time of day,
+# which to_csv leaves out of a chunk whose times are all midnight
+class CSVWriter:
+
+    # a constructor to open the file (a path, or a file object, stdout by default) and write the metadata
+    def __init__(self, file=None, metadata=None):
+
+        self.close_file = isinstance(file, str)
+        if (file is None):
+            self.file = sys.stdout
+        elif (self.close_file):
+            self.file = open(file, 'w', newline='')
+        else:
+            self.file = file
+        self.header = True
+
+        # the metadata is written right away, so readers of a pipe get it before the first chunk
+        if (metadata is not None and len(metadata) > 0):
+            self.file.write('#' + ','.join(str(key) for key in metadata.keys()) + '\n')
+            self.file.write(','.join('{}'.format(value) for value in metadata.values()) + '\n')
+            self.file.flush()
+
+    def write(self, chunk):
+        chunk.to_csv(self.file, index=False, header=self.header, date_format='%Y-%m-%d %H:%M:%S')
+        self.file.flush()
+        self.header = False
+
+    def close(self):
+        if (self.close_file):
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# parquet writer, one row group per chunk, the metadata is kept as key-value metadata of the schema,
+# pyarrow is only imported when a parquet file is written
+class ParquetWriter:
+
+    def __init__(self, path, metadata=None):
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('writing parquet files requires pyarrow, or use a .csv or .npy output file.')
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.metadata = {} if metadata is None else metadata
+        self.writer = None
+
+    def write(self, chunk):
+
+        table = self.pyarrow.Table.from_pandas(chunk, preserve_index=False)
+
+        # the schema (and the file) is created with the first chunk
+        if (self.writer is None):
+            metadata = dict(table.schema.metadata or {})
+            metadata.update({str(key).encode(): str(value).encode() for key, value in self.metadata.items()})
+            self.schema = table.schema.with_metadata(metadata)
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        if (self.writer is not None):
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# numpy writer, the chunks are written as one .npy file of records (a structured array with a field
+# per column, timezone aware times as UTC datetime64[ns]) that np.load reads back, the array header
+# is written with room for any number of rows and rewritten with the final shape on close. The .npy
+# format has no place for the metadata, so it is not written
+class NumpyWriter:
+
+    def __init__(self, path, metadata=None):
+
+        self.file = open(path, 'wb')
+        self.dtype = None
+        self.rows = 0
+
+    def records(self, chunk):
+
+        # structured array of the columns of a chunk
+        columns = []
+        for name in chunk.columns:
+            values = chunk[name]
+            if (isinstance(values.dtype, pd.DatetimeTZDtype)):
+                values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+            columns.append((str(name), values.to_numpy()))
+
+        records = np.empty(len(chunk), dtype=[(name, values.dtype) for name, values in columns])
+        for name, values in columns:
+            records[name] = values
+
+        return records
+
+    def write_header(self, rows):
+
+        # version 1.0 header, padded to the size of the header of the largest shape
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(
+                    np.lib.format.dtype_to_descr(self.dtype), rows)
+        largest = len(header) - len(str(rows)) + 20
+        size = -(-(len(np.lib.format.magic(1, 0)) + 2 + largest + 1) // 64) * 64
+        header = header.ljust(size - len(np.lib.format.magic(1, 0)) - 2 - 1) + '\n'
+
+        self.file.seek(0)
+        self.file.write(np.lib.format.magic(1, 0))
+        self.file.write(np.array(len(header), dtype='<u2').tobytes())
+        self.file.write(header.encode('latin1'))
+
+    def write(self, chunk):
+
+        records = self.records(chunk)
+        if (self.dtype is None):
+            self.dtype = records.dtype
+            self.write_header(0)
+
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(records.astype(self.dtype, copy=False).tobytes())
+        self.rows += len(records)
+
+    def close(self):
+
+        if (self.file.closed):
+            return
+        if (self.dtype is None):
+            # no chunk was written, an empty array
+            self.dtype = np.dtype(float)
+        self.write_header(self.rows)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# function to open the writer of an output path: parquet for .parquet files, numpy for .npy files,
+# CSV otherwise, and CSV on stdout if the path is None or '-', or with binary, the binary framing
+# of pipe_format.py on stdout, which the next script of a pipe reads instead of the CSV text
+def open_writer(path=None, metadata=None, binary=False):
+
+    if ((path is None or path == '-') and binary):
+        return PipeWriter(sys.stdout.buffer, metadata=metadata)
+    elif (path is None or path == '-'):
+        return CSVWriter(sys.stdout, metadata=metadata)
+    elif (path.endswith('.parquet')):
+        return ParquetWriter(path, metadata=metadata)
+    elif (path.endswith('.npy')):
+        return NumpyWriter(path, metadata=metadata)
+    else:
+        return CSVWriter(path, metadata=metadata)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the solar-tk modules import each other as top level modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'solartk')))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # keep the on-disk caches (timezones, elevation, weather, archive index) out of the home directory
+    monkeypatch.setenv('SOLARTK_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.delenv('SOLARTK_SUNPOS_CACHE', raising=False)
+    monkeypatch.delenv('SOLARTK_WEATHER_ARCHIVE', raising=False)
+    return tmp_path / 'cache'
+
+
+@pytest.fixture
+def weather_archive(tmp_path):
+    # a weather archive dump with hourly observations of one station near (42, -72) over 2015
+    times = pd.date_range('2015-01-01', '2016-01-01', freq='H', tz='UTC')
+    rng = np.random.default_rng(0)
+    dump = pd.DataFrame({'station': 'A', 'latitude': 42.1, 'longitude': -72.1,
+                         'time': times.astype(np.int64) // 10**9,
+                         'temperature': 50 + 20*rng.random(len(times)),
+                         'clds': rng.choice(['CLR', 'FEW', 'SCT', 'BKN', 'OVC'], len(times))})
+    path = tmp_path / 'archive.csv'
+    dump.to_csv(path, index=False)
+    return str(path)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pandas as pd
+import pytest
+import pytz
+
+from clearsky_cache import ClearskyCache
+from irradiance import get_clearsky_irradiance
+
+TIMEZONE = pytz.timezone('US/Eastern')
+
+# the spring DST change (02:00 -> 03:00 on 2015-03-08), and days without one
+DST_START = datetime.datetime(2015, 3, 7, 0)
+START = datetime.datetime(2015, 6, 1, 0)
+
+
+def hours(n, start=START):
+    return start + datetime.timedelta(hours=n)
+
+
+def uncached(start_time, end_time, latitude=42, longitude=-72, **kwargs):
+    return get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=TIMEZONE, latitude=latitude,
+                                   longitude=longitude, granularity=1800, **kwargs)
+
+
+def cached(cache, start_time, end_time, latitude=42, longitude=-72, **kwargs):
+    return cache.get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=TIMEZONE, latitude=latitude,
+                                         longitude=longitude, granularity=1800, **kwargs)
+
+
+@pytest.mark.parametrize('kwargs', [{'clearsky_estimation_method': 'pysolar'},
+                                    {'clearsky_estimation_method': 'lau_model', 'elevation': 100}])
+def test_matches_uncached(kwargs):
+    # overlapping windows across the spring DST change, each the same as without the cache
+    cache = ClearskyCache()
+    for start, end in [(0, 48), (24, 72), (60, 80), (10, 30), (0, 80)]:
+        pd.testing.assert_frame_equal(cached(cache, hours(start, DST_START), hours(end, DST_START), **kwargs),
+                                      uncached(hours(start, DST_START), hours(end, DST_START), **kwargs))
+
+
+def test_partial_overlap_is_spliced():
+    cache = ClearskyCache()
+    cached(cache, hours(0), hours(48))
+    assert cache.stats() == {'requests': 1, 'hits': 0, 'misses': 97, 'points': 97, 'keys': 1}
+
+    # only the 48 times after the first window are computed, and the segments are spliced into one
+    cached(cache, hours(24), hours(72))
+    assert cache.stats() == {'requests': 2, 'hits': 49, 'misses': 145, 'points': 145, 'keys': 1}
+    assert [segment[:2] for segment in list(cache.segments.values())[0]] == [
+        [pd.Timestamp(TIMEZONE.localize(hours(0))).value, pd.Timestamp(TIMEZONE.localize(hours(72))).value]]
+
+    # a disjoint window is a second segment, and a window over the gap joins them
+    cached(cache, hours(100), hours(110))
+    assert len(list(cache.segments.values())[0]) == 2
+    result = cached(cache, hours(70), hours(105))
+    assert len(list(cache.segments.values())[0]) == 1
+    assert cache.stats() == {'requests': 4, 'hits': 49 + 5 + 11, 'misses': 145 + 21 + 55, 'points': 221, 'keys': 1}
+    pd.testing.assert_frame_equal(result, uncached(hours(70), hours(105)))
+
+    # a window inside the cached segment is only served from the cache
+    cached(cache, hours(80), hours(90))
+    assert cache.stats()['hits'] == 65 + 21 and cache.stats()['misses'] == 221
+
+
+def test_least_recently_used_site_is_evicted():
+    # room for two sites of 49 times each
+    cache = ClearskyCache(max_points=100)
+    for longitude in [-72, -73]:
+        cached(cache, hours(0), hours(24), longitude=longitude)
+
+    # the first site is used again, so the second one is evicted for a third one
+    cached(cache, hours(0), hours(24), longitude=-72)
+    cached(cache, hours(0), hours(24), longitude=-74)
+    assert [key[1] for key in cache.segments] == [-72, -74]
+    assert cache.size() == 98
+
+    # the evicted site is computed again
+    misses = cache.stats()['misses']
+    cached(cache, hours(0), hours(24), longitude=-73)
+    assert cache.stats()['misses'] == misses + 49
+    assert [key[1] for key in cache.segments] == [-74, -73]
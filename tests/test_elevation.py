@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from elevation import CachedElevation, ConstantElevation, GoogleElevation, default_elevation_provider
+from parameters import ParameterModeling
+
+
+def parameter_modeling():
+    data = pd.DataFrame({'time': pd.date_range('2015-06-01', periods=48, freq='H'), 'solar': 0.0})
+    return ParameterModeling(latitude=42, longitude=-72, timezone='US/Eastern', data=data)
+
+
+def providers(chain):
+    # the providers behind the persistent cache of a default provider
+    return chain.providers[0].provider.providers
+
+
+def test_google_api_key_set_after_the_constructor():
+    parameters = parameter_modeling()
+    parameters.google_api_key = 'key'
+    provider = parameters.get_elevation_provider()
+    assert any(isinstance(p, GoogleElevation) and p.google_api_key == 'key' for p in providers(provider))
+
+    # a new key builds a new provider
+    parameters.google_api_key = 'other'
+    assert [p.google_api_key for p in providers(parameters.get_elevation_provider())] == ['other']
+
+
+def test_explicit_elevation():
+    parameters = parameter_modeling()
+    parameters.set_elevation(elevation=250)
+    assert isinstance(parameters.get_elevation_provider(), ConstantElevation)
+    assert parameters.get_elevation_provider().get_elevation(42, -72) == 250
+
+
+def test_sea_level_fallback_warns():
+    with pytest.warns(UserWarning, match='sea level'):
+        assert default_elevation_provider().get_elevation(42, -72) == 0.0
+
+
+class SlowElevation:
+
+    # stands in for a web elevation api
+    def get_elevation(self, latitude, longitude):
+        time.sleep(0.001)
+        return latitude + longitude
+
+
+def test_threads_share_a_cached_provider(tmp_path):
+    shared = CachedElevation(SlowElevation(), cache_file=str(tmp_path / 'elevation.json'))
+    locations = [(40 + i*0.01, -70 - i*0.1) for i in range(200)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        elevations = list(executor.map(lambda location: shared.get_elevation(*location), locations*2))
+
+    assert elevations[:200] == elevations[200:] == pytest.approx([latitude + longitude for latitude, longitude in locations])
+    with open(tmp_path / 'elevation.json') as f:
+        assert len(json.load(f)) == 200
+
+
+def test_cached_providers_merge_their_lookups(tmp_path):
+    # two processes with the same cache file keep each other's lookups
+    first = CachedElevation(SlowElevation(), cache_file=str(tmp_path / 'elevation.json'))
+    second = CachedElevation(SlowElevation(), cache_file=str(tmp_path / 'elevation.json'))
+    assert first.get_elevation(42, -72) == -30
+    assert second.get_elevation(37, -100) == -63
+
+    with open(tmp_path / 'elevation.json') as f:
+        assert json.load(f) == {'42.0000,-72.0000': -30.0, '37.0000,-100.0000': -63.0}
+    assert CachedElevation(None, cache_file=str(tmp_path / 'elevation.json')).get_elevation(42, -72) == -30
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+from fleet_generation import FleetGenerationPotential
+from irradiance import get_clearsky_irradiance
+from maximum_generation import GenerationPotential
+
+WINDOWS = [
+    # no DST change, the spring DST change (02:00 -> 03:00 on 2015-03-08), and the repeated
+    # hour at the end of DST (01:00 -> 02:00 on 2015-11-01)
+    (datetime.datetime(2015, 6, 1, 0), datetime.datetime(2015, 6, 3, 0)),
+    (datetime.datetime(2015, 3, 7, 20), datetime.datetime(2015, 3, 8, 12)),
+    (datetime.datetime(2015, 10, 31, 22), datetime.datetime(2015, 11, 1, 12)),
+]
+
+
+def generation_potential(weather_archive, clearsky_source):
+    gen = GenerationPotential(k=42.2, tilt=42.5, orientation=188, latitude=42, longitude=-72,
+                              baseline_temperature=0, temperature_coefficient=0.005)
+    gen.set_data_sources(clearsky_source=clearsky_source, sun_position_source=gen.sun_position_source,
+                         temperature_source='archive', weather_archive=weather_archive)
+    gen.set_timezone('US/Eastern')
+    return gen
+
+
+def fleet(weather_archive, clearsky_source):
+    fleet = FleetGenerationPotential(k=42.2, tilt=42.5, orientation=188, latitude=42, longitude=-72,
+                                     baseline_temperature=0, temperature_coefficient=0.005)
+    fleet.set_data_sources(clearsky_source=clearsky_source, temperature_source='archive', weather_archive=weather_archive)
+    fleet.set_timezone('US/Eastern')
+    return fleet
+
+
+@pytest.mark.parametrize('start_time, end_time', WINDOWS)
+def test_single_site_fleet_matches_generation_potential(weather_archive, start_time, end_time):
+    expected = generation_potential(weather_archive, 'pysolar').maximum_generation(
+                    start_time=start_time, end_time=end_time, granularity=1800)
+    time, matrix = fleet(weather_archive, 'pysolar').maximum_generation(
+                    start_time=start_time, end_time=end_time, granularity=1800)
+
+    assert (time == expected['#time']).all()
+    np.testing.assert_allclose(matrix[0], expected['max_generation'].to_numpy(), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('start_time, end_time', WINDOWS)
+@pytest.mark.parametrize('chunk_size', [1, 7])
+def test_chunked_matches_unchunked(weather_archive, start_time, end_time, chunk_size):
+    sites = fleet(weather_archive, 'pysolar')
+    time, matrix = sites.maximum_generation(start_time=start_time, end_time=end_time, granularity=1800)
+    chunked_time, chunked_matrix = sites.maximum_generation(start_time=start_time, end_time=end_time,
+                                                            granularity=1800, chunk_size=chunk_size)
+
+    assert (chunked_time == time).all()
+    np.testing.assert_array_equal(chunked_matrix, matrix)
+
+
+@pytest.mark.parametrize('start_time, end_time', WINDOWS[1:])
+def test_lau_model_grid(start_time, end_time):
+    # the lau model frames are on the same absolute time grid as the pysolar ones, and
+    # give the same frames for the naive local and the aware UTC bounds of the fleet
+    timezone = pytz.timezone('US/Eastern')
+    pysolar = get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=timezone,
+                                      latitude=42, longitude=-72, granularity=1800)
+    lau = get_clearsky_irradiance(start_time=start_time, end_time=end_time, timezone=timezone, latitude=42,
+                                  longitude=-72, granularity=1800, clearsky_estimation_method='lau_model', elevation=100)
+    lau_utc = get_clearsky_irradiance(start_time=timezone.localize(start_time).astimezone(pytz.utc),
+                                      end_time=timezone.localize(end_time).astimezone(pytz.utc), timezone=timezone,
+                                      latitude=42, longitude=-72, granularity=1800,
+                                      clearsky_estimation_method='lau_model', elevation=100)
+
+    assert (lau['time'] == pysolar['time']).all()
+    pd.testing.assert_frame_equal(lau_utc, lau)
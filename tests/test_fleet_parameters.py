@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pandas as pd
+
+from fleet_generation import read_fleet
+from fleet_parameters import fit_fleet, fit_site, init_worker, read_manifest, write_results
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+def write_sites(tmp_path):
+    # a site with the example data, and one whose generation is shifted by 12 hours into the night,
+    # for which no capacity is feasible
+    data = pd.read_csv(os.path.join(DATA, 'example_home_days.csv'))
+    data.to_csv(tmp_path / 'day.csv', index=False)
+    data['time'] = pd.to_datetime(data['time']) + pd.Timedelta(hours=12)
+    data.to_csv(tmp_path / 'night.csv', index=False)
+
+    manifest = pd.DataFrame({'site_id': ['day', 'night'], 'latitude': 42, 'longitude': -72,
+                             'csv': ['day.csv', 'night.csv'], 'timezone': 'US/Eastern'})
+    manifest.to_csv(tmp_path / 'manifest.csv', index=False)
+    return str(tmp_path / 'manifest.csv')
+
+
+def test_infeasible_site_is_an_error(tmp_path):
+    init_worker({'elevation': 0})
+    day, night = read_manifest(write_sites(tmp_path)).to_dict('records')
+
+    result = fit_site(day)
+    assert result['status'] == 'ok' and result['k'] > 0
+
+    result = fit_site(night)
+    assert result['status'] == 'error'
+    assert 'no capacity k is feasible' in result['error']
+    assert 'k' not in result
+
+
+def test_fleet_skips_the_failed_sites(tmp_path):
+    results = fit_fleet(read_manifest(write_sites(tmp_path)), workers=2, options={'elevation': 0})
+    assert results['status'].tolist() == ['ok', 'error']
+
+    write_results(results, str(tmp_path / 'parameters.csv'))
+    fleet = read_fleet(str(tmp_path / 'parameters.csv'))
+    assert list(fleet.site_ids) == ['day']
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers import okta_to_percent, okta_to_percent_array
+
+CODES = ['CLR', 'FEW', 'SCT', 'BKN', 'OVC']
+RANGES = {'CLR': (0, 12), 'FEW': (13, 37), 'SCT': (38, 62), 'BKN': (62, 87), 'OVC': (88, 100)}
+
+
+def random_codes(size=10000, seed=0):
+    # the known codes, and unknown codes, missing values and lowercase codes
+    return np.random.default_rng(seed).choice(CODES + ['VV', '', None, 'clr'], size)
+
+
+@pytest.mark.parametrize('x', [random_codes(), pd.Series(random_codes(seed=1)), list(random_codes(seed=2))])
+def test_categorical_mapping(x):
+    percent = okta_to_percent_array(x, rng=0)
+    codes = pd.Series(x).to_numpy()
+    assert len(percent) == len(codes)
+
+    # each known code is drawn within its range and over most of it, the other codes are nan
+    for code, (lower, upper) in RANGES.items():
+        samples = percent[codes == code]
+        assert len(samples) > 0
+        assert ((samples >= lower) & (samples <= upper)).all()
+        assert samples.max() - samples.min() > 0.9 * (upper - lower)
+    assert np.isnan(percent[~np.isin(codes, CODES)]).all()
+
+
+def test_same_ranges_as_okta_to_percent():
+    np.random.seed(0)
+    for code in CODES + ['VV']:
+        scalar = [okta_to_percent(code) for _ in range(200)]
+        array = okta_to_percent_array([code]*200, rng=0)
+        if (code in RANGES):
+            assert min(scalar) >= RANGES[code][0] and max(scalar) <= RANGES[code][1]
+            assert min(array) >= RANGES[code][0] and max(array) <= RANGES[code][1]
+        else:
+            assert np.isnan(scalar).all() and np.isnan(array).all()
+
+
+def test_seeded_draws_are_reproducible():
+    x = random_codes()
+    np.testing.assert_array_equal(okta_to_percent_array(x, rng=42), okta_to_percent_array(x, rng=42))
+    np.testing.assert_array_equal(okta_to_percent_array(x, rng=np.random.default_rng(42)), okta_to_percent_array(x, rng=42))
+    assert not np.array_equal(okta_to_percent_array(x, rng=42), okta_to_percent_array(x, rng=43), equal_nan=True)
+
+    # a shared generator continues its stream, so consecutive calls draw different samples
+    rng = np.random.default_rng(42)
+    first, second = okta_to_percent_array(x, rng=rng), okta_to_percent_array(x, rng=rng)
+    assert not np.array_equal(first, second, equal_nan=True)
+    np.testing.assert_array_equal(np.concatenate([first, second]), okta_to_percent_array(np.concatenate([x, x]), rng=42))
+
+
+def test_empty():
+    assert len(okta_to_percent_array([], rng=0)) == 0
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fleet_parameters import fit_fleet
+from instrumentation import Instrumentation
+from online_parameters import OnlineParameterModeling
+
+SOLARTK = os.path.join(os.path.dirname(__file__), '..', 'solartk')
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+def test_stages_are_timed_and_accumulated():
+    instrumentation = Instrumentation()
+    for _ in range(3):
+        with instrumentation.stage('outer'):
+            time.sleep(0.01)
+            with instrumentation.stage('inner'):
+                time.sleep(0.02)
+
+    stages = instrumentation.report()['stages']
+    assert list(stages) == ['inner', 'outer']
+    assert stages['inner']['calls'] == 3 and stages['outer']['calls'] == 3
+    assert stages['inner']['seconds'] >= 0.06
+    assert stages['outer']['seconds'] >= stages['inner']['seconds'] + 0.03
+    assert 'peak_bytes' not in stages['outer']
+
+
+def test_stage_is_timed_on_an_error():
+    instrumentation = Instrumentation()
+    with pytest.raises(ValueError):
+        with instrumentation.stage('failing'):
+            raise ValueError('failed')
+    assert instrumentation.report()['stages']['failing']['calls'] == 1
+
+
+@pytest.fixture
+def stop_tracing():
+    # the instrumentation starts tracemalloc, which would slow down the following tests
+    yield
+    tracemalloc.stop()
+
+
+def test_nested_peak_memory(stop_tracing):
+    # the peak of an inner stage is part of the peak of the enclosing one, but not of a later sibling
+    instrumentation = Instrumentation(trace_memory=True)
+    with instrumentation.stage('outer'):
+        with instrumentation.stage('large'):
+            block = np.ones(10**6)
+            del block
+        with instrumentation.stage('small'):
+            block = np.ones(10)
+
+    stages = instrumentation.report()['stages']
+    assert stages['large']['peak_bytes'] >= 8*10**6
+    assert stages['small']['peak_bytes'] < 8*10**6
+    assert stages['outer']['peak_bytes'] >= stages['large']['peak_bytes']
+    assert instrumentation.running == []
+
+
+def test_counters_and_hooks():
+    instrumentation = Instrumentation()
+    events = []
+    instrumentation.add_hook('round_finished', lambda **details: events.append(details))
+    instrumentation.add_hook('round_finished', lambda round, **details: events.append(round))
+
+    instrumentation.count('rounds')
+    instrumentation.count('rounds')
+    instrumentation.count('k_evaluations', 1000)
+    instrumentation.emit('round_finished', round=1, k=7.5)
+    instrumentation.emit('candidate_evaluated', parameter='k')
+
+    assert instrumentation.report()['counters'] == {'rounds': 2, 'k_evaluations': 1000}
+    assert events == [{'round': 1, 'k': 7.5}, 1]
+
+
+def test_merge():
+    instrumentation = Instrumentation()
+    instrumentation.merge({'stages': {'search': {'calls': 2, 'seconds': 1.0, 'peak_bytes': 10}}, 'counters': {'rounds': 2}})
+    instrumentation.merge({'stages': {'search': {'calls': 1, 'seconds': 0.5, 'peak_bytes': 5},
+                                      'output': {'calls': 1, 'seconds': 0.1}}, 'counters': {'rounds': 1}})
+    assert instrumentation.report() == {'stages': {'search': {'calls': 3, 'seconds': 1.5, 'peak_bytes': 10},
+                                                   'output': {'calls': 1, 'seconds': 0.1}},
+                                        'counters': {'rounds': 3}}
+
+
+def test_write_report(tmp_path, capsys):
+    instrumentation = Instrumentation()
+    with instrumentation.stage('output'):
+        instrumentation.count('sites', 2)
+
+    instrumentation.write_report(str(tmp_path / 'report.json'))
+    with open(tmp_path / 'report.json') as f:
+        report = json.load(f)
+    assert report['counters'] == {'sites': 2} and report['stages']['output']['calls'] == 1
+
+    instrumentation.write_report('-')
+    assert json.loads(capsys.readouterr().err) == report
+
+
+def test_fleet_reports_are_merged(tmp_path):
+    manifest = pd.DataFrame({'site_id': ['a', 'b', 'missing'], 'latitude': 42, 'longitude': -72, 'timezone': 'US/Eastern',
+                             'csv': [os.path.join(DATA, 'example_home_days.csv')]*2 + [str(tmp_path / 'missing.csv')]})
+    instrumentation = Instrumentation()
+    results = fit_fleet(manifest, workers=2, options={'elevation': 0, 'profile': True}, instrumentation=instrumentation)
+
+    report = instrumentation.report()
+    assert 'report' not in results.columns
+    assert report['counters']['sites'] == 3 and report['counters']['failed_sites'] == 1
+    assert report['counters']['rounds'] == results['rounds'].sum()
+    assert report['stages']['k_search']['calls'] == results['rounds'].sum()
+    assert report['stages']['temperature_coefficients']['calls'] == 2
+    assert report['stages']['sun_position']['peak_bytes'] > 0
+
+
+def test_online_stages():
+    parameters = OnlineParameterModeling(latitude=42, longitude=-72, timezone='US/Eastern')
+    parameters.elevation = 0
+    parameters.add_data(data_file=os.path.join(DATA, 'example_home_days.csv'))
+    parameters.find_parameters()
+
+    report = parameters.instrumentation.report()
+    assert list(report['stages']) == ['sun_position', 'clearsky', 'preprocess', 'add_days', 'search']
+    assert report['counters']['days_added'] == len(parameters.days)
+    assert report['counters']['rounds'] >= 2
+
+
+@pytest.mark.parametrize('script, args', [
+    ('online_parameters.py', ['state.npz', '42', '-72', os.path.join(DATA, 'example_home_days.csv'),
+                              '--elevation', '0', '--timezone', 'US/Eastern']),
+    ('fleet_parameters.py', ['manifest.csv', '--elevation', '0', '--workers', '1']),
+])
+def test_profile_option(tmp_path, script, args):
+    pd.DataFrame({'site_id': ['a'], 'latitude': [42], 'longitude': [-72], 'timezone': ['US/Eastern'],
+                  'csv': [os.path.abspath(os.path.join(DATA, 'example_home_days.csv'))]}).to_csv(tmp_path / 'manifest.csv', index=False)
+    subprocess.run([sys.executable, os.path.abspath(os.path.join(SOLARTK, script))] + args + ['--profile', 'report.json'],
+                   cwd=str(tmp_path), check=True, capture_output=True)
+
+    with open(tmp_path / 'report.json') as f:
+        report = json.load(f)
+    assert report['counters']['rounds'] >= 2
+    assert {'sun_position', 'clearsky', 'output'} <= set(report['stages'])
+    assert all(stage['peak_bytes'] > 0 for stage in report['stages'].values())
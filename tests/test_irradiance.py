@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pysolar
+import pytest
+import pytz
+
+from irradiance import get_clearsky_irradiance, get_refraction_correction, get_radiation_direct
+
+
+def test_array_versions_match_pysolar():
+    # below the horizon, around the refraction cutoff at -0.83 degrees, and up to the zenith
+    altitude_deg = np.concatenate([np.linspace(-5, 90, 951), [-0.83367, -0.8336, 0.0]])
+    when = pd.date_range('2015-01-01', periods=len(altitude_deg), freq='9H', tz='UTC')
+
+    refraction = [pysolar.solar.get_refraction_correction(101325.0, 288.15, altitude) for altitude in altitude_deg]
+    np.testing.assert_allclose(get_refraction_correction(altitude_deg), refraction, rtol=1e-12)
+
+    radiation = [pysolar.radiation.get_radiation_direct(time.to_pydatetime(), altitude)
+                 for time, altitude in zip(when, altitude_deg)]
+    np.testing.assert_allclose(get_radiation_direct(when, altitude_deg), radiation, rtol=1e-12)
+
+
+@pytest.mark.parametrize('day', [
+    # summer and winter days, and the spring and fall DST changes in US/Eastern
+    datetime.datetime(2015, 6, 1), datetime.datetime(2015, 12, 21),
+    datetime.datetime(2015, 3, 8), datetime.datetime(2015, 11, 1),
+])
+def test_pysolar_matches_reference(day):
+    # the array method uses the PSA sun position instead of the one of pysolar, which differ
+    # by up to about 0.8 degrees, so the clearsky is compared within a tolerance
+    kwargs = dict(start_time=day, end_time=day + datetime.timedelta(days=1), timezone=pytz.timezone('US/Eastern'),
+                  latitude=42, longitude=-72, granularity=300)
+    reference = get_clearsky_irradiance(clearsky_estimation_method='pysolar_reference', **kwargs)
+    irradiance = get_clearsky_irradiance(clearsky_estimation_method='pysolar', **kwargs)
+
+    assert (irradiance['time'] == reference['time']).all()
+
+    # sunrise and sunset are at most one step apart, and the clearsky is close over the day
+    assert ((irradiance['clearsky'] > 0) != (reference['clearsky'] > 0)).sum() <= 2
+    assert irradiance['clearsky'].sum() == pytest.approx(reference['clearsky'].sum(), rel=0.02)
+    assert np.abs(irradiance['clearsky'] - reference['clearsky']).max() < 0.05 * reference['clearsky'].max()
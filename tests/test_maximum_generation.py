@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pandas as pd
+import pytest
+
+from maximum_generation import GenerationPotential
+
+
+def generation_potential(weather_archive):
+    gen = GenerationPotential(k=42.2, tilt=42.5, orientation=188, latitude=42, longitude=-72,
+                              baseline_temperature=0, temperature_coefficient=0.005)
+    gen.set_data_sources(clearsky_source=gen.clearsky_source, sun_position_source=gen.sun_position_source,
+                         temperature_source='archive', weather_archive=weather_archive)
+    gen.set_timezone('US/Eastern')
+    return gen
+
+
+@pytest.mark.parametrize('start_time, end_time', [
+    # no DST change, and the spring DST change (02:00 -> 03:00 on 2015-03-08)
+    (datetime.datetime(2015, 1, 2, 0), datetime.datetime(2015, 1, 3, 23)),
+    (datetime.datetime(2015, 3, 7, 20), datetime.datetime(2015, 3, 8, 12)),
+])
+@pytest.mark.parametrize('chunk_size', [1, 7, 100])
+def test_chunked_matches_unchunked(weather_archive, start_time, end_time, chunk_size):
+    gen = generation_potential(weather_archive)
+    whole = gen.maximum_generation(start_time=start_time, end_time=end_time, granularity=1800)
+    chunked = gen.maximum_generation(start_time=start_time, end_time=end_time, granularity=1800, chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(chunked, whole)
+
+
+def test_spring_dst_grid(weather_archive):
+    # the grid steps in absolute time, so the skipped hour is not in the output
+    gen = generation_potential(weather_archive)
+    max_generation = gen.maximum_generation(start_time=datetime.datetime(2015, 3, 7, 20),
+                                            end_time=datetime.datetime(2015, 3, 8, 12), granularity=1800, chunk_size=7)
+    times = max_generation['#time']
+    assert len(times) == 31
+    assert times.is_unique and times.is_monotonic_increasing
+    assert not ((times >= '2015-03-08 02:00') & (times < '2015-03-08 03:00')).any()
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 7])
+def test_fall_dst_repeated_hour(weather_archive, chunk_size):
+    # the hour from 01:00 to 02:00 is repeated on 2015-11-01, its local times appear twice
+    gen = generation_potential(weather_archive)
+    max_generation = gen.maximum_generation(start_time=datetime.datetime(2015, 10, 31, 22),
+                                            end_time=datetime.datetime(2015, 11, 1, 4), granularity=1800, chunk_size=chunk_size)
+    assert len(max_generation) == 15
+    assert max_generation['#time'].dt.strftime('%H:%M').tolist()[6:12] == ['01:00', '01:30', '01:00', '01:30', '02:00', '02:30']
+    if (chunk_size != None):
+        whole = gen.maximum_generation(start_time=datetime.datetime(2015, 10, 31, 22),
+                                       end_time=datetime.datetime(2015, 11, 1, 4), granularity=1800)
+        pd.testing.assert_frame_equal(max_generation, whole)
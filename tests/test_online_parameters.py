@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from online_parameters import OnlineParameterModeling
+from parameters import ParameterModeling
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+def example_month():
+    # june of the example year
+    data = pd.read_csv(os.path.join(DATA, 'example_home_year.csv'))
+    data['time'] = pd.to_datetime(data['time'])
+    return data[(data['time'] >= '2015-06-01') & (data['time'] < '2015-07-01')].reset_index(drop=True)
+
+
+def batch_parameters(data):
+    parameters = ParameterModeling(latitude=42, longitude=-72, timezone='US/Eastern', data=data)
+    parameters.set_elevation(elevation=0)
+    parameters.get_onetime_data(weather=False)
+    parameters.preprocess_data()
+    return parameters.find_parameters()
+
+
+def online_parameters(state_file=None):
+    parameters = OnlineParameterModeling(latitude=42, longitude=-72, timezone='US/Eastern', state_file=state_file)
+    parameters.elevation = 0
+    return parameters
+
+
+def test_days_match_the_batch_fit():
+    data = pd.read_csv(os.path.join(DATA, 'example_home_days.csv'))
+    parameters = online_parameters()
+    parameters.add_data(data=data)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert parameters.find_parameters() == pytest.approx(batch_parameters(data))
+
+
+def test_incremental_fit_with_saved_state_matches_the_batch_fit(tmp_path):
+    data = example_month()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = batch_parameters(data)
+
+    # the days are added ten at a time in reverse order, with the state saved and loaded in between
+    state_file = str(tmp_path / 'state.npz')
+    batches = (data['time'].dt.day - 1) // 10
+    for batch in [2, 1, 0]:
+        parameters = online_parameters(state_file)
+        assert parameters.add_data(data=data[batches == batch]) == 10
+        parameters.save()
+
+    parameters = online_parameters(state_file)
+    assert len(parameters.days) == data['time'].dt.date.nunique()
+    assert parameters.find_parameters() == pytest.approx(expected)
+
+    # the statistics are the same as those of all the data added at once
+    whole = online_parameters()
+    whole.add_data(data=data)
+    np.testing.assert_allclose(parameters.gram, whole.gram, rtol=1e-9)
+    np.testing.assert_allclose(parameters.moment, whole.moment, rtol=1e-9)
+    np.testing.assert_array_equal(parameters.k_bound, whole.k_bound)
+    np.testing.assert_array_equal(parameters.top_ratios, whole.top_ratios)
+    assert parameters.count == whole.count and parameters.days == whole.days
+
+
+def test_added_days_are_skipped(tmp_path):
+    data = pd.read_csv(os.path.join(DATA, 'example_home_days.csv'))
+    parameters = online_parameters(str(tmp_path / 'state.npz'))
+    added = parameters.add_data(data=data)
+    parameters.save()
+
+    parameters = online_parameters(str(tmp_path / 'state.npz'))
+    count, gram = parameters.count, parameters.gram.copy()
+    assert added > 0 and parameters.add_data(data=data) == 0
+    assert parameters.count == count
+    np.testing.assert_array_equal(parameters.gram, gram)
+
+
+def test_state_of_another_site(tmp_path):
+    parameters = online_parameters(str(tmp_path / 'state.npz'))
+    parameters.add_data(data=pd.read_csv(os.path.join(DATA, 'example_home_days.csv')))
+    parameters.save()
+    with pytest.raises(ValueError):
+        OnlineParameterModeling(latitude=37, longitude=-100, state_file=str(tmp_path / 'state.npz'))
+
+
+def test_no_data():
+    with pytest.raises(ValueError):
+        online_parameters().find_parameters()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from parameters import ParameterModeling
+from sunpos import sunpos
+
+
+@pytest.mark.parametrize('start_time, offset', [('2015-01-10 00:00', 5), ('2015-07-10 00:00', 4)])
+def test_sun_position_of_local_times(start_time, offset):
+    # the local times of the data are localized in US/Eastern (not stamped with its LMT offset),
+    # in standard time in winter and in daylight saving time in summer
+    times = pd.date_range(start_time, periods=24, freq='H')
+    parameters = ParameterModeling(latitude=42, longitude=-72, timezone='US/Eastern',
+                                   data=pd.DataFrame({'time': times, 'solar': 0.0}))
+    parameters.set_elevation(elevation=0)
+    parameters.sun_position_source = 'psa_reference'
+    parameters.get_onetime_data(weather=False)
+
+    expected = np.array([sunpos(time, 42, -72) for time in times + pd.Timedelta(hours=offset)]).T
+    np.testing.assert_allclose(parameters.data['sun_azimuth'], expected[0], rtol=1e-9)
+    np.testing.assert_allclose(parameters.data['sun_zenith'], expected[1], rtol=1e-9)
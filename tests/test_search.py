@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn import metrics
+
+import parameters
+from parameters import ParameterModeling
+from search import (segment_offsets, plane_of_array, evaluate_k, PlaneOfArrayBasis, CompactData,
+                    coarse_to_fine, bisection_search)
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+schedules = [(search_mode, k_search, compact) for search_mode in ['exhaustive', 'coarse_to_fine']
+             for k_search in ['grid', 'bisection'] for compact in [False, True]]
+
+
+def random_site(seed=0, days=8, hours=10):
+    # a site of the given days of daytime hours, with a 7.5 k, 40 degrees tilt and 185 degrees
+    # orientation under clouds, and a few readings above the clearsky model
+    rng = np.random.default_rng(seed)
+    size = days * hours
+    data = pd.DataFrame({'date': np.repeat(pd.date_range('2015-05-01', periods=days).date, hours),
+                         'clearsky': rng.uniform(600, 1000, size), 'sun_zenith': rng.uniform(0.2, 1.3, size),
+                         'sun_azimuth': rng.uniform(1.6, 4.7, size)})
+    poa = plane_of_array(data['sun_zenith'], data['sun_azimuth'], math.radians(40), math.radians(185))
+    data['solar'] = data['clearsky'] * 7.5 * np.clip(poa, 0, None) * rng.uniform(0.5, 1.0, size)
+    data.loc[rng.choice(size, 4, replace=False), 'solar'] *= 1.5
+    return data
+
+
+def poa_of(data, tilt_, ori_):
+    return (np.cos(math.radians(90)-pd.to_numeric(data['sun_zenith']))
+            *np.sin(tilt_)
+            *np.cos(pd.to_numeric(data['sun_azimuth'])-ori_)
+            +np.sin(math.radians(90)-pd.to_numeric(data['sun_zenith']))
+            *np.cos(tilt_))
+
+
+def loop_find_K(data, tilt_, ori_, k_values, k_tolerance=2):
+    # the per-k loop of find_K that evaluate_k replaced
+    rmse_list = []
+    for k_ in k_values:
+        data['max'] = data['clearsky'] * k_ * poa_of(data, tilt_, ori_)
+        count = data.groupby(['date']).apply(lambda x: len(x[x['max'] < x['solar']]))
+        if (count > k_tolerance).any():
+            rmse_list.append(np.inf)
+        else:
+            rmse_list.append(np.sqrt(metrics.mean_squared_error(data['max'], data['solar'])))
+    return np.array(rmse_list)
+
+
+def loop_counts(data, k_, candidates):
+    # the per-candidate loop of find_ori and find_tilt that PlaneOfArrayBasis replaced,
+    # the violation count and rmse of each (tilt, orientation) candidate
+    counts, rmse_list = [], []
+    for tilt_, ori_ in candidates:
+        data['max'] = data['clearsky'] * k_ * poa_of(data, tilt_, ori_)
+        counts.append(len(data[data['max'] < data['solar']]))
+        rmse_list.append(np.sqrt(metrics.mean_squared_error(data['solar'], data['max'])))
+    return np.array(counts), np.array(rmse_list)
+
+
+def site_columns(data, tilt_=math.radians(40), ori_=math.radians(180)):
+    poa = plane_of_array(data['sun_zenith'].to_numpy(), data['sun_azimuth'].to_numpy(), tilt_, ori_)
+    return data['clearsky'].to_numpy(), poa, data['solar'].to_numpy(), segment_offsets(data['date'].values)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_evaluate_k_matches_the_loop(seed):
+    data = random_site(seed)
+    k_values = np.arange(0, 1000, 1)/10
+    clearsky, poa, solar, offsets = site_columns(data)
+
+    rmse = evaluate_k(clearsky, poa, solar, offsets, k_values, 2)
+    np.testing.assert_array_equal(rmse, loop_find_K(data, math.radians(40), math.radians(180), k_values))
+
+
+def test_evaluate_k_long_segments():
+    # days longer than the int16 counts, with more violations than int16 holds for small k
+    rng = np.random.default_rng(3)
+    lengths = [2**15 - 1, 40000, 5]
+    data = pd.DataFrame({'date': np.repeat([1, 2, 3], lengths), 'clearsky': rng.uniform(600, 1000, sum(lengths)),
+                         'sun_zenith': rng.uniform(0.2, 1.3, sum(lengths)), 'sun_azimuth': rng.uniform(1.6, 4.7, sum(lengths))})
+    data['solar'] = data['clearsky'] * 5 * np.clip(poa_of(data, 0.7, math.pi), 0, None) * rng.uniform(0.5, 1.0, len(data))
+    k_values = np.array([0, 0.5, 2, 4, 5, 6, 8])
+    clearsky, poa, solar, offsets = site_columns(data, 0.7, math.pi)
+
+    rmse = evaluate_k(clearsky, poa, solar, offsets, k_values, 2)
+    np.testing.assert_array_equal(rmse, loop_find_K(data, 0.7, math.pi, k_values))
+    assert np.isinf(rmse[:4]).all() and np.isfinite(rmse[-1])
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_evaluate_k_float32(seed):
+    # the compact columns give the same feasible candidates and rmse within float32 precision
+    data = random_site(seed)
+    k_values = np.arange(0, 1000, 1)/10
+    compact = CompactData(data.assign(temperature=np.nan))
+    poa = plane_of_array(compact.sun_zenith, compact.sun_azimuth, np.float32(math.radians(40)), np.float32(math.radians(180)))
+
+    rmse = evaluate_k(*site_columns(data)[:3], compact.offsets, k_values, 2)
+    rmse32 = evaluate_k(compact.clearsky, poa, compact.solar, compact.offsets, k_values, 2, workspace=compact.workspace)
+    assert (np.isinf(rmse32) == np.isinf(rmse)).all()
+    np.testing.assert_allclose(rmse32[np.isfinite(rmse)], rmse[np.isfinite(rmse)], rtol=1e-4)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_plane_of_array_basis_matches_the_loops(seed):
+    data = random_site(seed)
+    basis = PlaneOfArrayBasis(clearsky=data['clearsky'], sun_zenith=data['sun_zenith'],
+                              sun_azimuth=data['sun_azimuth'], solar=data['solar'])
+
+    # the orientation grid of find_ori and the tilt grid of find_tilt
+    ori_list = np.arange(0, math.radians(360), math.radians(1))
+    tilt_list = np.arange(math.radians(42 - 20), math.radians(42 + 20), math.radians(0.1))
+    for k_, tilt, ori in [(7.5, math.radians(40), ori_list), (7.5, tilt_list, math.radians(185))]:
+        count, rmse = basis.evaluate(k_, tilt, ori)
+        expected_count, expected_rmse = loop_counts(data, k_, zip(*np.broadcast_arrays(tilt, ori)))
+
+        np.testing.assert_array_equal(count, expected_count)
+        np.testing.assert_allclose(rmse, expected_rmse, rtol=1e-9)
+        assert np.argmin(np.where(count <= 1, rmse, np.inf)) == np.argmin(np.where(expected_count <= 1, expected_rmse, np.inf))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_coarse_to_fine_matches_the_grid(seed):
+    data = random_site(seed)
+    clearsky, poa, solar, offsets = site_columns(data)
+    basis = PlaneOfArrayBasis(clearsky=clearsky, sun_zenith=data['sun_zenith'], sun_azimuth=data['sun_azimuth'], solar=solar)
+
+    # the k grid, the cyclic orientation grid and the tilt grid
+    k_values = np.arange(0, 1000, 1)/10
+    ori_list = np.arange(0, math.radians(360), math.radians(1))
+    tilt_list = np.arange(math.radians(42 - 20), math.radians(42 + 20), math.radians(0.1))
+    objectives = [(lambda indices: evaluate_k(clearsky, poa, solar, offsets, k_values[indices], 2), len(k_values), False),
+                  (lambda indices: basis.evaluate(7.5, math.radians(40), ori_list[indices])[1], len(ori_list), True),
+                  (lambda indices: basis.evaluate(7.5, tilt_list[indices], math.radians(185))[1], len(tilt_list), False)]
+
+    for objective, size, cyclic in objectives:
+        values = objective(np.arange(size))
+        index, value, evaluations = coarse_to_fine(objective, size, coarse=10, cyclic=cyclic)
+        assert (index, value) == (int(np.argmin(values)), np.min(values))
+        assert evaluations < size
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_bisection_search_matches_the_grid(seed):
+    data = random_site(seed)
+    k_values = np.arange(0, 1000, 1)/10
+    for tilt_, ori_ in [(math.radians(40), math.radians(185)), (math.radians(30), math.radians(150)), (0, 0)]:
+        clearsky, poa, solar, offsets = site_columns(data, tilt_, ori_)
+        objective = lambda indices: evaluate_k(clearsky, poa, solar, offsets, k_values[indices], 2)
+
+        values = objective(np.arange(len(k_values)))
+        index, value, evaluations = bisection_search(objective, len(k_values))
+        assert (index, value) == (int(np.argmin(values)), np.min(values))
+        assert evaluations < 40
+
+    # no feasible candidate gives the first one, as the grid does
+    index, value, _ = bisection_search(lambda indices: np.full(len(indices), np.inf), 1000)
+    assert index == 0 and np.isinf(value)
+
+
+def example_days():
+    return pd.read_csv(os.path.join(DATA, 'example_home_days.csv'))
+
+
+def example_weeks():
+    data = pd.read_csv(os.path.join(DATA, 'example_home_year.csv'))
+    time = pd.to_datetime(data['time'])
+    return data[(time >= '2015-05-01') & (time < '2015-05-15')]
+
+
+@pytest.fixture
+def no_weather(monkeypatch):
+    # the search does not use the temperature, so no weather is fetched
+    def get_temperature_cloudcover(start_time=None, end_time=None, **kwargs):
+        return pd.DataFrame({'time': pd.date_range(start_time, end_time, freq='H'), 'temperature': np.nan})
+    monkeypatch.setattr(parameters, 'get_temperature_cloudcover', get_temperature_cloudcover)
+
+
+def find_parameters(data_file, search_mode='exhaustive', k_search='grid', compact=False):
+    parameters = ParameterModeling(latitude=42, longitude=-72, data_file=data_file)
+    parameters.set_elevation(elevation=0)
+    parameters.set_search_schedule(search_mode=search_mode, k_search=k_search)
+    parameters.compact = compact
+    parameters.get_onetime_data()
+    parameters.preprocess_data()
+    return parameters.find_parameters()
+
+
+@pytest.mark.parametrize('data', [example_days, example_weeks])
+@pytest.mark.parametrize('search_mode, k_search, compact', schedules)
+def test_search_modes_agree(no_weather, tmp_path, data, search_mode, k_search, compact):
+    data_file = str(tmp_path / 'data.csv')
+    data().to_csv(data_file, index=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        reference = find_parameters(data_file)
+        result = find_parameters(data_file, search_mode=search_mode, k_search=k_search, compact=compact)
+    assert result == pytest.approx(reference)
+
+
+def test_unknown_schedule():
+    parameters = ParameterModeling(latitude=42, longitude=-72, data_file=os.path.join(DATA, 'example_home_days.csv'))
+    with pytest.raises(ValueError):
+        parameters.set_search_schedule(search_mode='random')
+    with pytest.raises(ValueError):
+        parameters.set_search_schedule(k_search='newton')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pandas as pd
+import pytest
+
+from service import SolarService
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+SITE = {'k': 42.2, 'tilt': 42.5, 'orientation': 188, 'latitude': 42, 'longitude': -72, 'timezone': 'US/Eastern',
+        'baseline_temperature': 0, 'temperature_coefficient': 0.005, 'granularity': 3600,
+        'start_time': '2015-06-01 00:00:00', 'end_time': '2015-06-02 00:00:00'}
+
+
+@pytest.fixture
+def service(weather_archive, tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'home.csv').write_text('time,solar\n2015-06-01 00:00:00,0\n2015-06-01 01:00:00,0\n')
+    (tmp_path / 'secret.csv').write_text('time,solar\n')
+    os.symlink(str(tmp_path / 'secret.csv'), str(data_dir / 'link.csv'))
+
+    service = SolarService(workers=2, weather_archive=weather_archive, elevation=0, data_dir=str(data_dir))
+    yield service
+    service.shutdown()
+
+
+def test_maximum_generation(service):
+    status, response = service.handle('/maximum_generation', SITE)
+    assert status == 200
+    assert len(response['time']) == len(response['max_generation']) == 25
+
+
+@pytest.mark.parametrize('changes', [
+    {'k': 'a lot'}, {'k': -1}, {'granularity': None}, {'timezone': 'Mars/Olympus'},
+    {'start_time': '2015-06-01'}, {'end_time': '2015-05-01 00:00:00'},
+    {'latitude': [42, 43], 'longitude': [-72, -72], 'tilt': ['flat', 40]},
+])
+def test_invalid_requests(service, changes):
+    request = dict(SITE, **changes)
+    status, response = service.handle('/maximum_generation', request)
+    assert status == 400 and response['error'].startswith('RequestError')
+
+
+def test_invalid_weather_adjusted(service):
+    status, _ = service.handle('/weather_adjusted', {'latitude': 42, 'longitude': -72, 'time': ['2015-06-01 00:00:00'],
+                                                     'max_generation': [0, 1]})
+    assert status == 400
+
+
+def test_server_errors(service, monkeypatch):
+    # errors that are not errors of the request are server errors, whatever their type
+    def broken(request):
+        raise KeyError('clearsky')
+    monkeypatch.setitem(service.endpoints, '/maximum_generation', broken)
+
+    status, response = service.handle('/maximum_generation', SITE)
+    assert status == 500 and response['error'].startswith('KeyError')
+    assert service.report()['endpoints']['/maximum_generation']['errors'] == 1
+
+
+def test_csv_files_of_the_data_directory(service, tmp_path):
+    assert service.data_file('home.csv') == os.path.realpath(str(tmp_path / 'data' / 'home.csv'))
+
+    # paths outside the data directory, through links as well, are errors of the request
+    for path in ['../secret.csv', str(tmp_path / 'secret.csv'), 'link.csv', 'missing.csv', 7]:
+        status, response = service.handle('/parameters', {'latitude': 42, 'longitude': -72, 'csv': path})
+        assert status == 400 and 'RequestError' in response['error']
+
+
+def test_csv_files_need_a_data_directory(weather_archive):
+    service = SolarService(workers=1, weather_archive=weather_archive, elevation=0)
+    status, response = service.handle('/parameters', {'latitude': 42, 'longitude': -72, 'csv': 'home.csv'})
+    service.shutdown()
+    assert status == 400 and '--data-dir' in response['error']
+
+
+@pytest.mark.parametrize('archive', [True, False])
+def test_parameters(weather_archive, archive):
+    data = pd.read_csv(os.path.join(DATA, 'example_home_days.csv'))
+    request = {'latitude': 42, 'longitude': -72, 'timezone': 'US/Eastern', 'time': data['time'].tolist(),
+               'solar': data['solar'].tolist()}
+    service = SolarService(workers=1, weather_archive=weather_archive if archive else None, elevation=0)
+    status, response = service.handle('/parameters', request)
+    service.shutdown()
+
+    # the same parameters as parameters.py, and the temperature coefficients only with the weather
+    assert status == 200
+    assert (response['k'], response['tilt'], response['orientation']) == pytest.approx((42.2222, 42.5, 188.0), abs=1e-3)
+    if (archive):
+        assert (response['temperature_coefficient'], response['baseline_temperature']) == (0.005, 0)
+    else:
+        assert response['temperature_coefficient'] is None and response['baseline_temperature'] is None
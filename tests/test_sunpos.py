@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sunpos import Ephemeris, get_sun_position, sunpos, sunpos_array
+
+# every 37 minutes over two days, across the spring DST change of US/Eastern
+UTC_TIMES = pd.date_range('2015-03-07 00:00', '2015-03-09 00:00', freq='37min')
+
+
+def scalar_sunpos(times, latitude, longitude):
+    return np.array([sunpos(time, latitude, longitude) for time in times]).T
+
+
+@pytest.mark.parametrize('times', [
+    UTC_TIMES,
+    pd.Series(UTC_TIMES),
+    UTC_TIMES.tz_localize('UTC').tz_convert('US/Eastern'),
+    pd.Series(UTC_TIMES.tz_localize('UTC').tz_convert('Asia/Kolkata')),
+    UTC_TIMES.astype(np.int64).to_numpy() // 10**9,
+    pd.Index(UTC_TIMES.astype(np.int64) // 10**9),
+    pd.Series(UTC_TIMES.astype(np.int64) // 10**9, dtype=np.int32),
+], ids=['naive', 'naive series', 'aware', 'aware series', 'epoch array', 'epoch index', 'epoch series'])
+def test_array_matches_scalar(times):
+    # the same instants in any representation give the sun position of the UTC times
+    expected = scalar_sunpos(UTC_TIMES, 42, -72)
+    np.testing.assert_allclose(np.array(sunpos_array(times, 42, -72)), expected, rtol=1e-12)
+
+    ephemeris = Ephemeris(times)
+    assert ephemeris.time.equals(pd.DatetimeIndex(UTC_TIMES).tz_localize(ephemeris.time.tz))
+    np.testing.assert_allclose(np.array(ephemeris.sun_position(42, -72)), expected, rtol=1e-12)
+
+
+def test_scalar_aware_time():
+    time = UTC_TIMES[10].tz_localize('UTC')
+    assert list(sunpos(time.tz_convert('US/Eastern'), 42, -72)) == list(sunpos(UTC_TIMES[10], 42, -72))
+
+
+def test_aware_range_with_ephemeris():
+    # an aware range is read from an ephemeris of the same instants
+    start, end = UTC_TIMES[0].tz_localize('UTC').tz_convert('US/Eastern'), UTC_TIMES[-1].tz_localize('UTC').tz_convert('US/Eastern')
+    ephemeris = Ephemeris(pd.date_range(start, end, freq='37min'))
+    with_ephemeris = get_sun_position(start_time=start, end_time=end, granularity=37*60, latitude=42, longitude=-72,
+                                      ephemeris=ephemeris)
+    without = get_sun_position(start_time=start, end_time=end, granularity=37*60, latitude=42, longitude=-72)
+    pd.testing.assert_frame_equal(with_ephemeris, without)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import json
+import time
+
+from timezones import TimezoneResolver
+
+
+class SlowTzwhere:
+
+    # stands in for the tzwhere polygons
+    def tzNameAt(self, latitude, longitude):
+        time.sleep(0.001)
+        return 'US/Eastern' if longitude > -80 else 'US/Central'
+
+
+def resolver(cache_file):
+    resolver = TimezoneResolver(cache_file=str(cache_file))
+    resolver.tzwhere = SlowTzwhere()
+    return resolver
+
+
+def test_threads_share_a_resolver(tmp_path):
+    shared = resolver(tmp_path / 'timezones.json')
+    locations = [(40 + i*0.01, -70 - i*0.1) for i in range(200)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        names = list(executor.map(lambda location: shared.timezone_name(*location), locations*2))
+
+    assert names[:200] == names[200:]
+    with open(tmp_path / 'timezones.json') as f:
+        assert len(json.load(f)) == 200
+
+
+def test_resolvers_merge_their_lookups(tmp_path):
+    # two processes with the same cache file keep each other's lookups
+    first, second = resolver(tmp_path / 'timezones.json'), resolver(tmp_path / 'timezones.json')
+    assert first.timezone_name(42, -72) == 'US/Eastern'
+    assert second.timezone_name(37, -100) == 'US/Central'
+
+    with open(tmp_path / 'timezones.json') as f:
+        assert json.load(f) == {'42.0000,-72.0000': 'US/Eastern', '37.0000,-100.0000': 'US/Central'}
+
+
+def test_given_timezone_is_not_looked_up(tmp_path):
+    assert str(TimezoneResolver(cache_file=str(tmp_path / 'timezones.json')).get_timezone(42, -72, 'US/Eastern')) == 'US/Eastern'
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+
+import weather
+import weather_store
+from weather import WeatherFetcher, fetch_days, get_temperature_cloudcover
+from weather_store import WeatherStore
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+
+    # /ok returns a page, /flaky fails twice with 503 before returning a page, /missing is a 404,
+    # and /wu/<day> returns weather underground observations of the day (404 for 20150103)
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if (self.path == '/flaky' and self.server.requests.count('/flaky') <= 2):
+            self.respond(503, {})
+        elif (self.path in ['/ok', '/flaky']):
+            self.respond(200, {'path': self.path})
+        elif (self.path.startswith('/wu/') and not self.path.endswith('20150103')):
+            day = datetime.datetime.strptime(self.path[4:], '%Y%m%d').replace(tzinfo=datetime.timezone.utc)
+            observations = [{'valid_time_gmt': int(day.timestamp()) + 3600*hour, 'temp': 50 + hour, 'clds': 'CLR',
+                             'wx_phrase': 'Fair'} for hour in range(24)]
+            self.respond(200, {'observations': observations})
+        else:
+            self.respond(404, {})
+
+    def respond(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetcher_retries_server_errors(stub_server):
+    server, url = stub_server
+    fetcher = WeatherFetcher(concurrency=2, retries=3, backoff_factor=0)
+    assert fetcher.fetch([url + '/ok', url + '/flaky']) == [{'path': '/ok'}, {'path': '/flaky'}]
+    assert server.requests.count('/flaky') == 3
+
+
+def test_fetcher_skips_missing_pages(stub_server):
+    server, url = stub_server
+    fetcher = WeatherFetcher(concurrency=2, retries=3, backoff_factor=0)
+    with pytest.warns(UserWarning):
+        assert fetcher.fetch([url + '/missing', url + '/ok'], skip_errors=True) == [None, {'path': '/ok'}]
+
+    # a 404 is not retried, and fails the fetch unless it is skipped
+    assert server.requests.count('/missing') == 1
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch([url + '/missing'])
+
+
+def test_fetch_days_uses_the_store(stub_server, tmp_path):
+    server, url = stub_server
+    fetcher = WeatherFetcher(concurrency=2, backoff_factor=0)
+    store = WeatherStore(path=str(tmp_path / 'weather.sqlite'))
+    days, urls = ['20150101', '20150102'], [url + '/ok', url + '/ok']
+
+    assert fetch_days('test', 42, -72, days, urls, fetcher, store) == [{'path': '/ok'}]*2
+    assert fetch_days('test', 42, -72, days, urls, fetcher, store) == [{'path': '/ok'}]*2
+    assert len(server.requests) == 2
+
+
+def test_weather_underground_against_stub(stub_server, tmp_path, monkeypatch):
+    server, url = stub_server
+    monkeypatch.setattr(weather, 'WEATHER_UNDERGROUND_URL', url + '/wu/{2}')
+
+    fetcher = WeatherFetcher(concurrency=4, backoff_factor=0)
+    store = WeatherStore(path=str(tmp_path / 'weather.sqlite'))
+    with pytest.warns(UserWarning):
+        data = get_temperature_cloudcover(start_time=datetime.datetime(2015, 1, 2), end_time=datetime.datetime(2015, 1, 4),
+                                          granularity=3600, latitude=42, longitude=-72, timezone='US/Eastern',
+                                          fetcher=fetcher, store=store, seed=0)
+
+    # the missing day is skipped, and its hours are forward filled from the day before
+    assert sorted(set(server.requests)) == ['/wu/20150101', '/wu/20150102', '/wu/20150103', '/wu/20150104']
+    assert data['time'].is_monotonic_increasing
+    assert data['temperature'].notna().all()
+    assert ((data['clouds'] >= 0) & (data['clouds'] <= 12)).all()
+
+
+def test_store_ttl(tmp_path, monkeypatch):
+    now = [1.5e9]
+    monkeypatch.setattr(weather_store.time, 'time', lambda: now[0])
+    store = WeatherStore(path=str(tmp_path / 'weather.sqlite'), recent_days=3, ttl=3600)
+
+    today = datetime.datetime.utcnow().strftime('%Y%m%d')
+    store.put_many('test', 42, -72, {today: {'day': 'recent'}, '20150101': {'day': 'historical'}})
+    assert store.get_many('test', 42, -72, [today, '20150101']) == {today: {'day': 'recent'}, '20150101': {'day': 'historical'}}
+
+    # recent days expire after the time to live, historical days never do
+    now[0] += 3601
+    assert store.get_many('test', 42, -72, [today, '20150101']) == {'20150101': {'day': 'historical'}}
+
+    store.purge()
+    now[0] = 0
+    assert store.get_many('test', 42, -72, [today, '20150101']) == {'20150101': {'day': 'historical'}}
+
+    # the coordinates are rounded, so a nearby location shares the pages
+    assert store.get_many('test', 42.00001, -72.00001, ['20150101']) == {'20150101': {'day': 'historical'}}
+
+
+def test_store_closes_connections(tmp_path, monkeypatch):
+    connections = []
+    connect = weather_store.sqlite3.connect
+
+    def tracked_connect(*args, **kwargs):
+        connections.append(connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(weather_store.sqlite3, 'connect', tracked_connect)
+    store = WeatherStore(path=str(tmp_path / 'weather.sqlite'))
+    store.put_many('test', 42, -72, {'20150101': {'day': 'historical'}})
+    assert store.get_many('test', 42, -72, ['20150101']) == {'20150101': {'day': 'historical'}}
+    store.purge()
+
+    # a failed block is rolled back, and every connection is closed
+    with pytest.raises(weather_store.sqlite3.OperationalError):
+        with store.connect() as connection:
+            connection.execute('DELETE FROM observations')
+            connection.execute('SELECT * FROM missing')
+    assert store.get_many('test', 42, -72, ['20150101']) == {'20150101': {'day': 'historical'}}
+
+    assert len(connections) == 6
+    for connection in connections:
+        with pytest.raises(weather_store.sqlite3.ProgrammingError):
+            connection.execute('SELECT 1')
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import datetime
+import os
+import time
+
+import pandas as pd
+import pytest
+import pytz
+
+import weather_archive
+from weather import get_temperature_cloudcover
+from weather_archive import WeatherArchive, get_archive
+
+
+def write_dump(path, temperature):
+    pd.DataFrame({'station': ['A', 'A', 'B'], 'latitude': [42.1, 42.1, 37.0], 'longitude': [-72.1, -72.1, -100.0],
+                  'time': [1420070400, 1420074000, 1420070400], 'temperature': temperature,
+                  'clds': ['CLR', 'OVC', 'FEW']}).to_csv(path, index=False)
+
+
+def open_and_query(archive_path):
+    return WeatherArchive(archive_path).query(latitude=42, longitude=-72, start_time=0, end_time=2*10**9)['temperature'].tolist()
+
+
+def test_missing_archive_path():
+    with pytest.raises(ValueError, match='SOLARTK_WEATHER_ARCHIVE'):
+        get_archive(None)
+
+
+def test_archive_is_reopened_when_the_dumps_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(weather_archive, 'archives', {})
+    path = str(tmp_path / 'archive.csv')
+    write_dump(path, [50.0, 51.0, 60.0])
+    archive = get_archive(path)
+    assert get_archive(path) is archive
+    assert archive.query(latitude=42, longitude=-72, start_time=0, end_time=2*10**9)['temperature'].tolist() == [50.0, 51.0]
+
+    write_dump(path, [52.0, 53.0, 60.0])
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    archive = get_archive(path)
+    assert archive.query(latitude=42, longitude=-72, start_time=0, end_time=2*10**9)['temperature'].tolist() == [52.0, 53.0]
+
+    # only the index of the current version is kept
+    assert len(os.listdir(archive.index_root)) == 1
+
+
+def test_concurrent_index_builds(tmp_path):
+    path = str(tmp_path / 'archive.csv')
+    write_dump(path, [50.0, 51.0, 60.0])
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(open_and_query, [path]*8))
+    assert results == [[50.0, 51.0]]*8
+    assert len(os.listdir(WeatherArchive(path).index_root)) == 1
+
+
+@pytest.mark.parametrize('timezone', ['US/Eastern', pytz.timezone('US/Eastern')])
+@pytest.mark.parametrize('start_time, end_time', [
+    # the padded end is in the repeated hour at the end of DST, and the padded start in the
+    # skipped hour of the spring DST change
+    (datetime.datetime(2015, 10, 30, 12, 30), datetime.datetime(2015, 10, 31, 1, 30)),
+    (datetime.datetime(2015, 3, 9, 2, 30), datetime.datetime(2015, 3, 9, 12, 30)),
+])
+def test_archive_bounds_around_dst(weather_archive, timezone, start_time, end_time):
+    data = get_temperature_cloudcover(start_time=start_time, end_time=end_time, granularity=1800, latitude=42,
+                                      longitude=-72, source='archive', timezone=timezone, archive_path=weather_archive)
+    within = data[(data['time'] >= start_time) & (data['time'] <= end_time)]
+    assert within['time'].tolist() == list(pd.date_range(start_time, end_time, freq='30min'))
+    assert within['temperature'].notna().all()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipe_format import MAGIC, PipeWriter, read_pipe
+from writers import CSVWriter, open_writer
+
+METADATA = {'latitude(°)': 42, 'longitude(°)': -72}
+
+
+def table():
+    time = pd.date_range('2015-01-02 00:00', '2015-01-03 00:00', freq='H')
+    return pd.DataFrame({'#time': time, 'max_generation': np.linspace(0, 1, len(time))})
+
+
+def write_csv(chunks):
+    text = io.StringIO()
+    with CSVWriter(text, metadata=METADATA) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return text.getvalue()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 24, 25])
+def test_chunked_csv_matches_whole(chunk_size):
+    whole = table()
+    chunks = [whole.iloc[i:i + chunk_size] for i in range(0, len(whole), chunk_size)]
+    assert write_csv(chunks) == write_csv([whole])
+
+    # a chunk of midnight times keeps the time of day
+    assert write_csv(chunks).splitlines()[-1] == '2015-01-03 00:00:00,1.0'
+
+
+def test_numpy_writer(tmp_path):
+    path = str(tmp_path / 'max_generation.npy')
+    with open_writer(path, metadata=METADATA) as writer:
+        writer.write(table().iloc[:10])
+        writer.write(table().iloc[10:])
+    records = np.load(path)
+    assert len(records) == len(table())
+    assert (records['#time'] == table()['#time'].to_numpy()).all()
+
+
+def test_pipe_format_round_trip():
+    stream = io.BytesIO()
+    with PipeWriter(stream, metadata=METADATA) as writer:
+        writer.write(table().iloc[:10])
+        writer.write(table().iloc[10:])
+
+    stream.seek(0)
+    assert stream.read(len(MAGIC)) == MAGIC
+    metadata, data = read_pipe(stream)
+    assert metadata == METADATA
+    pd.testing.assert_frame_equal(data, table())